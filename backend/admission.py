@@ -0,0 +1,127 @@
+import math
+import os
+from .jobs import JOBS
+from .job_queue import get_job_queue
+from .deadline import MIN_QUALITY_STEPS, MIN_SIDE
+from .compiled_unet import COMPILE_UNET, smaller_buckets
+from . import metrics
+
+# Estimated queue wait, in seconds, above which new diffusion requests are
+# rendered with fewer steps and at a lower resolution (0 disables)
+ADMISSION_SOFT_SECONDS = float(os.environ.get("MUSEMIND_ADMISSION_SOFT_SECONDS", "30"))
+
+# Estimated queue wait above which new diffusion requests are turned away
+# with a 503 and a Retry-After header (0 disables)
+ADMISSION_HARD_SECONDS = float(os.environ.get("MUSEMIND_ADMISSION_HARD_SECONDS", "120"))
+
+# Seconds per diffusion job assumed until throughput has been measured
+DEFAULT_JOB_SECONDS = float(os.environ.get("MUSEMIND_ADMISSION_DEFAULT_JOB_SECONDS", "30"))
+
+# (step fraction, resolution scale) per degradation level; the level rises
+# as the estimated wait moves from the soft limit towards the hard limit
+DEGRADATION_LEVELS = [
+    (1.0, 1.0),
+    (0.75, 1.0),
+    (0.6, 0.875),
+    (0.5, 0.75),
+]
+
+
+class Overloaded(Exception):
+    """Raised when a request is turned away because the queue is too long"""
+
+    def __init__(self, wait_seconds, retry_after):
+        super().__init__(f"Server busy: estimated wait {wait_seconds:.0f}s")
+        self.wait_seconds = wait_seconds
+        self.retry_after = retry_after
+
+
+def estimate_wait():
+    """
+    Estimate how long a new diffusion job would wait before it starts,
+    from the jobs ahead of it and the measured seconds per job
+
+    Returns:
+        tuple: (estimated wait in seconds, jobs ahead, seconds per job)
+    """
+    queue = get_job_queue()
+    jobs_ahead, seconds_per_job = queue.load() if queue is not None else JOBS.diffusion_load()
+    if seconds_per_job is None:
+        seconds_per_job = DEFAULT_JOB_SECONDS
+    return jobs_ahead * seconds_per_job, jobs_ahead, seconds_per_job
+
+
+def degradation_level(wait_seconds, soft=ADMISSION_SOFT_SECONDS, hard=ADMISSION_HARD_SECONDS):
+    """
+    Map an estimated wait to a degradation level
+
+    Returns:
+        int: 0 below the soft limit, up to len(DEGRADATION_LEVELS) - 1 near the hard limit
+    """
+    if soft <= 0 or wait_seconds <= soft:
+        return 0
+    top = len(DEGRADATION_LEVELS) - 1
+    if hard <= soft:
+        return top
+    return min(top, 1 + int((wait_seconds - soft) / (hard - soft) * top))
+
+
+def admit():
+    """
+    Decide whether a diffusion request may be queued, and at what quality
+
+    Returns:
+        int: Degradation level to render at (0 for full quality)
+
+    Raises:
+        Overloaded: If the estimated wait is above the hard limit
+    """
+    wait_seconds, jobs_ahead, seconds_per_job = estimate_wait()
+    metrics.set_gauge("admission_estimated_wait_seconds", round(wait_seconds, 1))
+    metrics.set_gauge("admission_jobs_ahead", jobs_ahead)
+
+    if ADMISSION_HARD_SECONDS > 0 and wait_seconds > ADMISSION_HARD_SECONDS:
+        # Queued work drains at one second per second; come back once the
+        # wait is back under the limit, with one job's time to spare
+        retry_after = max(1, math.ceil(wait_seconds - ADMISSION_HARD_SECONDS + seconds_per_job))
+        metrics.increment("admission_rejected")
+        print(f"Rejecting request: {jobs_ahead} jobs ahead, estimated wait {wait_seconds:.0f}s")
+        raise Overloaded(wait_seconds, retry_after)
+
+    level = degradation_level(wait_seconds)
+    metrics.set_gauge("admission_degradation_level", level)
+    if level:
+        metrics.increment(f"admission_degraded_level_{level}")
+    return level
+
+
+def degrade(level, steps, width, height, device="cpu"):
+    """
+    Scale a run's step count and generation size down to a degradation level.
+    A compiled UNet only drops to a smaller bucket of the same aspect ratio,
+    so with no such bucket only the step count goes down.
+
+    Args:
+        level (int): Degradation level from admit()
+        steps (int): Step count the request would use
+        width (int): Generation width
+        height (int): Generation height
+        device (str): Device the run uses, for its resolution buckets
+
+    Returns:
+        tuple: (steps, width, height)
+    """
+    if not level:
+        return steps, width, height
+    step_fraction, scale = DEGRADATION_LEVELS[min(level, len(DEGRADATION_LEVELS) - 1)]
+    steps = max(min(steps, MIN_QUALITY_STEPS), int(steps * step_fraction))
+    if scale < 1.0 and COMPILE_UNET:
+        # The largest bucket within the degraded area, or the smallest one
+        options = smaller_buckets(width, height, device)
+        area = width * height * scale * scale
+        width, height = next((bucket for bucket in options if bucket[0] * bucket[1] <= area), options[-1])
+    elif scale < 1.0:
+        # Multiples of 64 keep the latents valid
+        width = max(min(width, MIN_SIDE), int(width * scale) // 64 * 64)
+        height = max(min(height, MIN_SIDE), int(height * scale) // 64 * 64)
+    return steps, width, height
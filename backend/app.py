@@ -1,29 +1,323 @@
 import os
+import json
 import random
-from flask import Flask, request, jsonify, render_template, send_from_directory, redirect, url_for
-from werkzeug.utils import secure_filename
-from .generate import generate_image, apply_style_to_image  # Using updated functions
+import socket
+from flask import Flask, Request, request, jsonify, render_template, send_from_directory, redirect, url_for, g, Response, stream_with_context
+from .worker_pool import get_worker_pool, NUM_WORKERS
+from .job_queue import get_job_queue, DONE, QUEUE_DB
+from .jobs import JOBS, JOB_TIMEOUT, JobCancelled, choose_lane, DIFFUSION_LANE
+from .singleflight import SINGLE_FLIGHT, request_key
+from .utils import list_checkpoints, DEFAULT_CHECKPOINT
+from .usage import result_info
+from .uploads import UploadStore, UploadStream, UploadRejected, content_hash, check_stored_image
+from .fanout import group_styles
+from .prefetch import PREFETCH, RANDOM_PROMPTS, RANDOM_STYLES
+from .profiling import PROFILE_SAMPLER, PROFILE_TOKEN, PROFILE_DIR
+from .admission import Overloaded, admit, estimate_wait, degradation_level
+from .compiled_unet import COMPILE_UNET
+from . import metrics
 import time
-import uuid
+
+class UploadRequest(Request):
+    """Receives uploaded files into memory, checking them while they arrive"""
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return UploadStream()
 
 app = Flask(__name__)
+app.request_class = UploadRequest
 
 # Configure upload settings
 UPLOAD_FOLDER = 'uploads'
 GENERATED_FOLDER = 'generated_images'
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload size
 
+# Upper limit on images returned by a single request
+MAX_IMAGES_PER_REQUEST = 8
+
+# Generation functions that accept a degrade_level from admission control
+DEGRADABLE_FUNCTIONS = {"generate_images", "apply_style_to_images", "apply_styles_to_image"}
+
 # Create necessary folders
 for folder in ["static", "templates", UPLOAD_FOLDER, GENERATED_FOLDER]:
     if not os.path.exists(folder):
         os.makedirs(folder)
 
+# Uploads are stored once per content; original filenames become aliases
+UPLOAD_STORE = UploadStore(UPLOAD_FOLDER)
+
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def parse_batch_params(data):
+    """
+    Read the optional multi-image fields from a request body
+    
+    Args:
+        data (dict): Parsed JSON request body
+        
+    Returns:
+        tuple: (num_images, seeds, prompts, error message or None)
+    """
+    seeds = data.get("seeds")
+    prompts = data.get("prompts")
+    
+    # A single "seed" is shorthand for a one-element seed list
+    if seeds is None and data.get("seed") is not None:
+        seeds = [data.get("seed")]
+    
+    try:
+        num_images = int(data.get("num_images", 1))
+        if seeds is not None:
+            if not isinstance(seeds, list):
+                return None, None, None, "seeds must be a list of integers"
+            seeds = [int(seed) for seed in seeds]
+    except (TypeError, ValueError):
+        return None, None, None, "num_images and seeds must be integers"
+    
+    if prompts is not None and (not isinstance(prompts, list) or not all(isinstance(p, str) and p for p in prompts)):
+        return None, None, None, "prompts must be a list of non-empty strings"
+    
+    num_images = max(num_images, len(seeds or []), len(prompts or []))
+    if num_images < 1 or num_images > MAX_IMAGES_PER_REQUEST:
+        return None, None, None, f"num_images must be between 1 and {MAX_IMAGES_PER_REQUEST}"
+    
+    return num_images, seeds or None, prompts or None, None
+
+def parse_checkpoint(data):
+    """
+    Read and validate the optional checkpoint field of a request body
+    
+    Args:
+        data (dict): Parsed JSON request body
+        
+    Returns:
+        tuple: (checkpoint name or None for the default, error message or None)
+    """
+    checkpoint = data.get("checkpoint")
+    if not checkpoint:
+        return None, None
+    
+    if checkpoint not in list_checkpoints():
+        return None, f"Unknown checkpoint: {checkpoint}"
+    
+    return checkpoint, None
+
+def parse_deadline(data):
+    """
+    Read the optional deadline_ms field of a request body
+    
+    Args:
+        data (dict): Parsed JSON request body
+        
+    Returns:
+        tuple: (deadline_ms or None, wall-clock deadline or None, error message or None)
+    """
+    deadline_ms = data.get("deadline_ms")
+    if deadline_ms is None:
+        return None, None, None
+    
+    try:
+        deadline_ms = int(deadline_ms)
+    except (TypeError, ValueError):
+        return None, None, "deadline_ms must be an integer"
+    if deadline_ms <= 0:
+        return None, None, "deadline_ms must be positive"
+    
+    # Measured from when the request arrived, so queueing counts against it
+    return deadline_ms, time.time() + deadline_ms / 1000, None
+
+def client_disconnected():
+    """
+    Check whether the client of the current request has closed its connection
+    
+    Returns:
+        bool: True if the peer is known to have gone away
+    """
+    # Werkzeug's dev server and gunicorn both expose the raw socket
+    sock = request.environ.get("werkzeug.socket") or request.environ.get("gunicorn.socket")
+    if sock is None:
+        return False
+    
+    try:
+        # A readable socket with no data means the peer sent FIN
+        return sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b""
+    except (BlockingIOError, InterruptedError):
+        return False
+    except OSError:
+        return True
+
+def claim_profile():
+    """
+    Check whether this request asked to be profiled and may be
+    
+    Profiling is requested with the X-MuseMind-Profile header or the
+    profile query parameter, either carrying MUSEMIND_PROFILE_TOKEN.
+    
+    Returns:
+        str: Profile id to run under (release it when done), or None
+    """
+    requested = request.headers.get("X-MuseMind-Profile") or request.args.get("profile")
+    if not PROFILE_TOKEN or requested != PROFILE_TOKEN:
+        return None
+    
+    profile_id = PROFILE_SAMPLER.acquire()
+    if profile_id is None:
+        print("Profiling skipped: sample rate limit reached")
+        metrics.increment("profiles_skipped")
+    else:
+        metrics.increment("profiles_taken")
+    return profile_id
+
+def admission_level():
+    """
+    Admit the current request to the diffusion lane, once per request
+    
+    Returns:
+        int: Degradation level the request's runs use (0 for full quality)
+        
+    Raises:
+        Overloaded: If the estimated queue wait is above the hard limit
+    """
+    level = getattr(g, "degradation_level", None)
+    if level is None:
+        level = g.degradation_level = admit()
+    return level
+
+def run_generation(func_name, key_params, *args, lane=None, **kwargs):
+    """
+    Run an inference function as a job on the right lane, sharing the job
+    with any identical request that is already in flight. The job is
+    cancelled if this request times out, is cancelled through /cancel,
+    or its client disconnects (and no other request is waiting on it).
+    
+    Args:
+        func_name (str): backend.generate function to run
+        key_params (dict): Normalized parameters identifying the request
+        *args: Positional arguments for the function
+        lane (str): Lane to run on, chosen from the request if omitted
+        **kwargs: Keyword arguments for the function
+        
+    Returns:
+        The function's result, or None if the job failed
+        
+    Raises:
+        JobCancelled: If the job was cancelled or timed out
+        Overloaded: If admission control turned the request away
+    """
+    data = request.get_json(silent=True) or {}
+    if lane is None:
+        lane = choose_lane(func_name, key_params.get("style"), key_params.get("image_hash") is not None)
+    
+    # Diffusion work is shed or degraded while the queue is long
+    if lane == DIFFUSION_LANE and func_name in DEGRADABLE_FUNCTIONS:
+        degrade_level = admission_level()
+        if degrade_level:
+            kwargs["degrade_level"] = degrade_level
+            key_params = dict(key_params, degrade_level=degrade_level)
+    
+    try:
+        timeout = min(float(data.get("timeout", JOB_TIMEOUT)), JOB_TIMEOUT)
+    except (TypeError, ValueError):
+        timeout = JOB_TIMEOUT
+    
+    # A profiled run is never shared with other requests
+    profile_id = claim_profile()
+    if profile_id:
+        key_params = dict(key_params, profile_id=profile_id)
+        args = (profile_id, func_name) + args
+        func_name = "run_profiled"
+    
+    # Clients may pick their own id so they can cancel before the response arrives
+    ticket = JOBS.open_ticket(request.headers.get("X-Job-Id") or data.get("job_id"))
+    g.job_id = ticket.ticket_id
+    
+    def should_detach():
+        if ticket.reason:
+            return ticket.reason
+        if client_disconnected():
+            return "client disconnected"
+        return None
+    
+    try:
+        key = request_key(func_name, **key_params)
+        job = SINGLE_FLIGHT.join(key, lambda: JOBS.submit(lane, func_name, *args, timeout=timeout, **kwargs))
+        # Queued jobs keep their result under this id (see /jobs/<job_id>)
+        if get_job_queue() is not None and lane == DIFFUSION_LANE:
+            g.queue_job_id = job.job_id
+        result = job.wait(should_detach)
+        
+        # Peak memory per request, for sizing concurrency on each node
+        info = result_info(result)
+        peak_rss_mb = info.get("peak_rss_mb")
+        if peak_rss_mb is not None:
+            metrics.set_gauge("peak_rss_mb_last", peak_rss_mb)
+            metrics.set_gauge_max(f"peak_rss_mb_max_{lane}", peak_rss_mb)
+        
+        # Link the profile artifacts in the response
+        profile = info.get("profile")
+        if profile:
+            profile["links"] = {name: url_for("serve_profile", filename=f"{profile['id']}/{file_name}")
+                                for name, file_name in profile["files"].items()}
+        
+        # Result cache lookups happen in the workers; count them here
+        if "cache_lookups" in info:
+            metrics.increment("result_cache_lookups", info["cache_lookups"])
+            metrics.increment("result_cache_hits", info["cache_hits"])
+        if "latent_cache_hit" in info:
+            metrics.increment("latent_cache_lookups")
+            metrics.increment("latent_cache_hits", int(info["latent_cache_hit"]))
+        if "warm_start_hit" in info:
+            metrics.increment("warm_start_lookups")
+            metrics.increment("warm_start_hits", int(info["warm_start_hit"]))
+        return result
+    except JobCancelled:
+        raise
+    except Exception as e:
+        print(f"Inference job {func_name} failed: {str(e)}")
+        return None
+    finally:
+        JOBS.close_ticket(ticket)
+        if profile_id:
+            PROFILE_SAMPLER.release()
+
+@app.errorhandler(JobCancelled)
+def job_cancelled(error):
+    """Report a cancelled or timed-out generation job"""
+    status = 504 if error.reason == "timeout" else 409
+    return jsonify({
+        "success": False,
+        "message": f"Job cancelled: {error.reason}"
+    }), status
+
+@app.errorhandler(Overloaded)
+def overloaded(error):
+    """Turn a request away while the queue is too long, saying when to retry"""
+    response = jsonify({
+        "success": False,
+        "message": str(error),
+        "retry_after": error.retry_after
+    })
+    response.headers["Retry-After"] = str(error.retry_after)
+    return response, 503
+
+@app.after_request
+def add_job_id(response):
+    """Tell clients which id cancels their job"""
+    job_id = getattr(g, "job_id", None)
+    if job_id:
+        response.headers["X-Job-Id"] = job_id
+    queue_job_id = getattr(g, "queue_job_id", None)
+    if queue_job_id:
+        response.headers["X-Queue-Job-Id"] = queue_job_id
+    level = getattr(g, "degradation_level", None)
+    if level is not None:
+        response.headers["X-Degradation-Level"] = str(level)
+    return response
+
 @app.route("/")
 def index():
     """Serve a simple HTML interface for image generation"""
@@ -37,8 +331,22 @@ def generate():
     width = int(data.get("width", 512))
     height = int(data.get("height", 512))
     style = data.get("style")  # Get the style parameter
+    num_images, seeds, prompts, error = parse_batch_params(data)
+    if not error:
+        checkpoint, error = parse_checkpoint(data)
+    if not error:
+        deadline_ms, deadline, error = parse_deadline(data)
     
     # Validate input parameters
+    if error:
+        return jsonify({
+            "success": False,
+            "message": error
+        }), 400
+    
+    if not prompt and prompts:
+        prompt = prompts[0]
+    
     if not prompt:
         return jsonify({
             "success": False,
@@ -52,24 +360,31 @@ def generate():
     # Log the received prompt
     print(f"Prompt received: {prompt}")
     print(f"Dimensions: {width}x{height}")
+    print(f"Number of images: {num_images}")
     if style:
         print(f"Style: {style}")
 
     # Track generation time
     start_time = time.time()
     
-    # Generate the image with the style parameter
-    generated_image = generate_image(prompt, width, height, style)
+    # Generate the images with the style parameter in a single batched run
+    key_params = dict(prompt=prompt, style=style, width=width, height=height, seed=seeds,
+                      prompts=prompts, num_images=num_images, checkpoint=checkpoint, deadline_ms=deadline_ms)
+    generated_images = run_generation("generate_images", key_params,
+                                      prompt, width, height, style, num_images, seeds, prompts,
+                                      checkpoint=checkpoint, deadline=deadline)
     
     # Calculate generation time
     generation_time = time.time() - start_time
     print(f"Image generation took {generation_time:.2f} seconds")
     
-    if generated_image:
+    if generated_images:
         return jsonify({
             "success": True,
             "message": "Image generated successfully",
-            "image": generated_image,
+            "image": generated_images[0],
+            "images": generated_images,
+            "info": result_info(generated_images),
             "generation_time": f"{generation_time:.2f}"
         })
     else:
@@ -80,14 +395,25 @@ def generate():
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
+    # Parsing the form streams the file through UploadStream, which rejects
+    # non-images and oversized images before the body has been read
+    try:
+        files = request.files
+    except UploadRejected as e:
+        metrics.increment("uploads_rejected")
+        return jsonify({
+            "success": False,
+            "message": str(e)
+        }), 400
+    
     # Check if the post request has the file part
-    if 'file' not in request.files:
+    if 'file' not in files:
         return jsonify({
             "success": False,
             "message": "No file part"
         }), 400
     
-    file = request.files['file']
+    file = files['file']
     
     # If the user does not select a file, browser submits an empty file without filename
     if file.filename == '':
@@ -97,22 +423,35 @@ def upload_file():
         }), 400
     
     if file and allowed_file(file.filename):
-        # Generate unique filename to avoid collisions
-        filename = str(uuid.uuid4()) + '_' + secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
+        # Store by content hash, so re-uploads of the same image share one file
+        try:
+            stored = UPLOAD_STORE.save(file.stream, file.filename)
+        except UploadRejected as e:
+            metrics.increment("uploads_rejected")
+            return jsonify({
+                "success": False,
+                "message": str(e)
+            }), 400
+        metrics.increment("uploads")
+        if stored["deduplicated"]:
+            metrics.increment("uploads_deduplicated")
+            print(f"Upload {stored['alias']} matches existing {stored['filename']}")
         
         # Return the uploaded file path for later use
         return jsonify({
             "success": True,
             "message": "File successfully uploaded",
-            "filename": filename,
-            "filepath": filepath
+            "filename": stored["filename"],
+            "filepath": stored["filepath"],
+            "alias": stored["alias"],
+            "hash": stored["hash"],
+            "image": stored["image"],
+            "deduplicated": stored["deduplicated"]
         })
     else:
         return jsonify({
             "success": False,
-            "message": "File type not allowed. Please upload PNG, JPG, JPEG, or GIF files."
+            "message": "File type not allowed. Please upload PNG, JPG, JPEG, GIF or WEBP files."
         }), 400
 
 @app.route('/apply_style', methods=['POST'])
@@ -124,6 +463,20 @@ def apply_style():
     prompt = data.get('prompt')  # Get optional prompt for additional guidance
     width = int(data.get("width", 512))
     height = int(data.get("height", 512))
+    num_images, seeds, prompts, error = parse_batch_params(data)
+    if not error:
+        checkpoint, error = parse_checkpoint(data)
+    if not error:
+        deadline_ms, deadline, error = parse_deadline(data)
+    
+    if error:
+        return jsonify({
+            "success": False,
+            "message": error
+        }), 400
+    
+    if not prompt and prompts:
+        prompt = prompts[0]
     
     # If both filename and prompt are missing, we can't proceed
     if not filename and not prompt:
@@ -141,18 +494,24 @@ def apply_style():
         # Track generation time
         start_time = time.time()
         
-        # Use generate_image instead of applying style to an existing image
-        generated_image = generate_image(prompt, width, height, style)
+        # Use generate_images instead of applying style to an existing image
+        key_params = dict(prompt=prompt, style=style, width=width, height=height, seed=seeds,
+                          prompts=prompts, num_images=num_images, checkpoint=checkpoint, deadline_ms=deadline_ms)
+        generated_images = run_generation("generate_images", key_params,
+                                          prompt, width, height, style, num_images, seeds, prompts,
+                                          checkpoint=checkpoint, deadline=deadline)
         
         # Calculate generation time
         generation_time = time.time() - start_time
         print(f"Image generation took {generation_time:.2f} seconds")
         
-        if generated_image:
+        if generated_images:
             return jsonify({
                 "success": True,
                 "message": "Image generated successfully",
-                "image": generated_image,
+                "image": generated_images[0],
+                "images": generated_images,
+                "info": result_info(generated_images),
                 "generation_time": f"{generation_time:.2f}"
             })
         else:
@@ -163,14 +522,13 @@ def apply_style():
     
     # If we have a filename, proceed with style application to an uploaded image
     if filename:
-        # Full path to the uploaded image with improved path handling
-        image_path = os.path.normpath(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+        # Resolve the stored file; filename may be a blob name or an upload alias
+        image_path = UPLOAD_STORE.resolve(filename)
         print(f"Looking for file: {filename}")
         print(f"Full path: {image_path}")
-        print(f"File exists: {os.path.exists(image_path)}")
         
         # Check if file exists
-        if not os.path.exists(image_path):
+        if not image_path:
             # List files in the upload directory to debug
             files_in_dir = os.listdir(app.config['UPLOAD_FOLDER'])
             print(f"Files in upload directory: {files_in_dir}")
@@ -179,21 +537,36 @@ def apply_style():
                 "message": f"File not found: {filename}"
             }), 404
         
+        try:
+            check_stored_image(image_path)
+        except UploadRejected as e:
+            return jsonify({
+                "success": False,
+                "message": str(e)
+            }), 400
+        
         # Track processing time
         start_time = time.time()
         
         # Apply style to the uploaded image (pass instructions and prompt if provided)
-        result = apply_style_to_image(image_path, style, instructions, prompt)
+        key_params = dict(prompt=prompt, style=style, seed=seeds, image_hash=content_hash(image_path),
+                          instructions=instructions, prompts=prompts, num_images=num_images,
+                          checkpoint=checkpoint, deadline_ms=deadline_ms)
+        results = run_generation("apply_style_to_images", key_params,
+                                 image_path, style, instructions, prompt, num_images, seeds, prompts,
+                                 checkpoint=checkpoint, deadline=deadline)
         
         # Calculate processing time
         processing_time = time.time() - start_time
         print(f"Style application took {processing_time:.2f} seconds")
         
-        if result:
+        if results:
             return jsonify({
                 "success": True,
                 "message": "Style applied successfully",
-                "image": result,
+                "image": results[0],
+                "images": results,
+                "info": result_info(results),
                 "generation_time": f"{processing_time:.2f}"
             })
         else:
@@ -202,6 +575,111 @@ def apply_style():
                 "message": "Error applying style to image"
             }), 500
 
+@app.route('/apply_styles', methods=['POST'])
+def apply_styles():
+    """
+    Render one upload in many styles and stream each result as soon as
+    its group is done, as newline-delimited JSON. Styles with compatible
+    strength and step counts share batched img2img calls.
+    """
+    data = request.get_json()
+    filename = data.get('filename')
+    instructions = data.get('instructions')
+    prompt = data.get('prompt')
+    checkpoint, error = parse_checkpoint(data)
+    
+    styles = data.get('styles')
+    if not error and styles is not None and (not isinstance(styles, list) or not styles):
+        error = "styles must be a non-empty list of style names"
+    if not error:
+        try:
+            # One seed for every style keeps the results comparable
+            seed = int(data["seed"]) if data.get("seed") is not None else random.randint(0, 9999)
+        except (TypeError, ValueError):
+            error = "seed must be an integer"
+    if not error:
+        groups, unknown = group_styles(styles)
+        if unknown:
+            error = f"Unknown styles: {', '.join(unknown)}"
+    
+    if error:
+        return jsonify({
+            "success": False,
+            "message": error
+        }), 400
+    
+    image_path = UPLOAD_STORE.resolve(filename)
+    if not image_path:
+        return jsonify({
+            "success": False,
+            "message": f"File not found: {filename}"
+        }), 404
+    try:
+        check_stored_image(image_path)
+    except UploadRejected as e:
+        return jsonify({
+            "success": False,
+            "message": str(e)
+        }), 400
+    image_hash = content_hash(image_path)
+    print(f"Fanning out {filename} to {sum(len(group) for group in groups)} styles in {len(groups)} groups")
+    
+    # Admit the whole fan-out before the response starts streaming
+    if any(len(group) > 1 or choose_lane("apply_style_to_images", group[0], True) == DIFFUSION_LANE
+           for group in groups):
+        admission_level()
+    
+    def stream():
+        start_time = time.time()
+        completed = failed = 0
+        for group_index, group in enumerate(groups):
+            group_start = time.time()
+            try:
+                if len(group) == 1:
+                    # Also covers the CPU-only styles, which run on the fast lane
+                    key_params = dict(prompt=prompt, style=group[0], seed=[seed], image_hash=image_hash,
+                                      instructions=instructions, prompts=None, num_images=1,
+                                      checkpoint=checkpoint, deadline_ms=None)
+                    results = run_generation("apply_style_to_images", key_params,
+                                             image_path, group[0], instructions, prompt, 1, [seed], None,
+                                             checkpoint=checkpoint)
+                else:
+                    key_params = dict(prompt=prompt, styles=group, seed=seed, image_hash=image_hash,
+                                      instructions=instructions, checkpoint=checkpoint)
+                    results = run_generation("apply_styles_to_image", key_params,
+                                             image_path, group, instructions, prompt, seed,
+                                             checkpoint=checkpoint)
+            except JobCancelled as e:
+                yield json.dumps({"success": False, "styles": group, "message": f"Job {e.reason}"}) + "\n"
+                break
+            
+            if not results:
+                failed += len(group)
+                yield json.dumps({"success": False, "styles": group,
+                                  "message": "Error applying styles to image"}) + "\n"
+                continue
+            
+            completed += len(group)
+            for style, image in zip(group, results):
+                yield json.dumps({
+                    "success": True,
+                    "style": style,
+                    "group": group_index,
+                    "image": image,
+                    "info": result_info(results),
+                    "generation_time": f"{time.time() - group_start:.2f}"
+                }) + "\n"
+        
+        yield json.dumps({
+            "done": True,
+            "success": failed == 0,
+            "completed": completed,
+            "failed": failed,
+            "generation_time": f"{time.time() - start_time:.2f}"
+        }) + "\n"
+    
+    return Response(stream_with_context(stream()), mimetype="application/x-ndjson")
+
 @app.route("/generated_images/<path:filename>")
 def serve_image(filename):
     """Serve generated images"""
@@ -210,7 +688,14 @@ def serve_image(filename):
 @app.route("/uploads/<path:filename>")
 def serve_upload(filename):
     """Serve uploaded images"""
-    return send_from_directory(UPLOAD_FOLDER, filename)
+    path = UPLOAD_STORE.resolve(filename)
+    return send_from_directory(UPLOAD_FOLDER, os.path.basename(path) if path else filename)
+
+@app.route("/profiles/<path:filename>")
+def serve_profile(filename):
+    """Serve profiling artifacts"""
+    # Flask resolves relative directories against the app's root, not the working directory
+    return send_from_directory(os.path.abspath(PROFILE_DIR), filename)
 
 # List all uploaded files
 @app.route("/uploads")
@@ -225,6 +710,7 @@ def list_uploads():
             file_path = os.path.join(UPLOAD_FOLDER, filename)
             file_info = {
                 "filename": filename,
+                "aliases": UPLOAD_STORE.aliases_of(filename),
                 "path": f"/uploads/{filename}",
                 "size": os.path.getsize(file_path),
                 "modified": os.path.getmtime(file_path)
@@ -246,39 +732,48 @@ def random_image():
     data = request.get_json() or {}
     width = int(data.get("width", 512))
     height = int(data.get("height", 512))
+    seed = data.get("seed")
+    deadline_ms, deadline, error = parse_deadline(data)
+    if error:
+        return jsonify({
+            "success": False,
+            "message": error
+        }), 400
     
     # Limit dimensions to reasonable values
     width = min(max(width, 256), 1024)
     height = min(max(height, 256), 1024)
     
-    # Predefined list of prompts for random generation
-    prompts = [
-        "A peaceful mountain landscape at sunset",
-        "A futuristic cyberpunk city at night with neon lights",
-        "An underwater scene with colorful coral reef and fish",
-        "A fantasy castle in the clouds",
-        "A cozy cottage in a forest clearing",
-        "A tropical beach paradise with palm trees",
-        "A space station orbiting a distant planet",
-        "An ancient temple hidden in the jungle",
-        "A steampunk airship floating in the sky",
-        "A winter wonderland with snow-covered trees",
-        "A magical fairy garden with glowing mushrooms",
-        "A medieval village market scene",
-        "A desert oasis with camels and palm trees",
-        "A rustic farm with fields of wheat at golden hour",
-        "A bustling city street in the rain"
-    ]
-    
-    # Predefined list of styles for random selection
-    styles = [
-        "realistic", "anime", "ghibli", "oil_painting", 
-        "watercolor", "pixel_art", "cyberpunk", "fantasy"
-    ]
-    
-    # Randomly select a prompt and style
-    prompt = random.choice(prompts)
-    style = random.choice(styles)
+    if seed is not None:
+        try:
+            seed = int(seed)
+        except (TypeError, ValueError):
+            return jsonify({
+                "success": False,
+                "message": "seed must be an integer"
+            }), 400
+    
+    # Serve a pre-rendered image when one is ready; seeded requests must be reproducible
+    PREFETCH.start()
+    if seed is None:
+        entry = PREFETCH.take(width, height)
+        if entry:
+            print(f"Serving prefetched {entry['style']} image: {entry['prompt']}")
+            return jsonify({
+                "success": True,
+                "message": "Random image generated successfully",
+                "image": entry["image"],
+                "prompt": entry["prompt"],
+                "style": entry["style"],
+                "info": dict(entry["info"], prefetched=True),
+                "generation_time": "0.00"
+            })
+    
+    # Randomly select a prompt and style (reproducibly when a seed is given)
+    rng = random.Random(seed) if seed is not None else random
+    prompt = rng.choice(RANDOM_PROMPTS)
+    style = rng.choice(RANDOM_STYLES)
+    seeds = [seed] if seed is not None else None
     
     print(f"Random prompt: {prompt}")
     print(f"Random style: {style}")
@@ -288,7 +783,10 @@ def random_image():
     start_time = time.time()
     
     # Generate the image
-    generated_image = generate_image(prompt, width, height, style)
+    key_params = dict(prompt=prompt, style=style, width=width, height=height, seed=seeds, deadline_ms=deadline_ms)
+    generated_images = run_generation("generate_images", key_params, prompt, width, height, style, 1, seeds,
+                                      deadline=deadline)
+    generated_image = generated_images[0] if generated_images else None
     
     # Calculate generation time
     generation_time = time.time() - start_time
@@ -301,6 +799,7 @@ def random_image():
             "image": generated_image,
             "prompt": prompt,
             "style": style,
+            "info": result_info(generated_images),
             "generation_time": f"{generation_time:.2f}"
         })
     else:
@@ -309,6 +808,141 @@ def random_image():
             "message": "Error generating random image"
         }), 500
 
+@app.route("/cancel/<job_id>", methods=["POST"])
+def cancel_job(job_id):
+    """Cancel a running generation request by its job id"""
+    if not JOBS.cancel(job_id):
+        return jsonify({
+            "success": False,
+            "message": f"No running job with id {job_id}"
+        }), 404
+    
+    return jsonify({
+        "success": True,
+        "message": f"Job {job_id} cancelled"
+    })
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    """Report the state of a queued job, with its result once it is done"""
+    queue = get_job_queue()
+    job = queue.get(job_id) if queue is not None else None
+    if job is None:
+        return jsonify({
+            "success": False,
+            "message": f"No stored job with id {job_id}"
+        }), 404
+    
+    response = {
+        "success": job["state"] == DONE,
+        "job_id": job_id,
+        "state": job["state"],
+        "attempts": job["attempts"],
+    }
+    if job["state"] == DONE:
+        if isinstance(job["result"], list):
+            response["images"] = list(job["result"])
+            response["info"] = result_info(job["result"])
+        else:
+            response["result"] = job["result"]
+    elif job["error"]:
+        response["message"] = job["error"]
+    return jsonify(response)
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """Report server metrics"""
+    metrics.set_gauge("singleflight_in_flight", SINGLE_FLIGHT.in_flight())
+    metrics.set_gauge("singleflight_dedupe_rate", metrics.ratio("singleflight_deduplicated", "singleflight_requests"))
+    metrics.set_gauge("upload_dedupe_rate", metrics.ratio("uploads_deduplicated", "uploads"))
+    metrics.set_gauge("result_cache_hit_rate", metrics.ratio("result_cache_hits", "result_cache_lookups"))
+    metrics.set_gauge("latent_cache_hit_rate", metrics.ratio("latent_cache_hits", "latent_cache_lookups"))
+    metrics.set_gauge("warm_start_hit_rate", metrics.ratio("warm_start_hits", "warm_start_lookups"))
+    metrics.set_gauge("prefetch_hit_rate", metrics.ratio("prefetch_hits", "prefetch_requests"))
+    wait_seconds, jobs_ahead, _ = estimate_wait()
+    metrics.set_gauge("admission_estimated_wait_seconds", round(wait_seconds, 1))
+    metrics.set_gauge("admission_jobs_ahead", jobs_ahead)
+    metrics.set_gauge("admission_degradation_level", degradation_level(wait_seconds))
+    for resolution, ready in PREFETCH.stats().items():
+        metrics.set_gauge(f"prefetch_ready_{resolution}", ready)
+    
+    return jsonify({
+        "success": True,
+        **metrics.snapshot()
+    })
+
+@app.route("/admin/workers")
+def worker_status():
+    """Report the state of the inference worker pool or job queue"""
+    queue = get_job_queue()
+    if queue is not None:
+        return jsonify({
+            "success": True,
+            "mode": "queue",
+            **queue.stats()
+        })
+    
+    pool = get_worker_pool()
+    if pool is None:
+        return jsonify({
+            "success": True,
+            "mode": "in-process"
+        })
+    
+    return jsonify({
+        "success": True,
+        "mode": "worker-pool",
+        **pool.stats()
+    })
+
+@app.route("/admin/models")
+def model_status():
+    """Report loaded pipelines and the model memory budget"""
+    if get_job_queue() is not None or get_worker_pool() is not None:
+        # Each worker process owns its own model manager
+        return jsonify({
+            "success": True,
+            "mode": "queue" if get_job_queue() is not None else "worker-pool",
+            "checkpoints": list_checkpoints(),
+            "default_checkpoint": DEFAULT_CHECKPOINT
+        })
+    
+    from .model_manager import MODEL_MANAGER
+    return jsonify({
+        "success": True,
+        "mode": "in-process",
+        **MODEL_MANAGER.stats()
+    })
+
+@app.route("/admin/models/unload", methods=["POST"])
+def unload_models():
+    """Unload pipelines, optionally only for one checkpoint or pipeline type"""
+    if get_job_queue() is not None or get_worker_pool() is not None:
+        return jsonify({
+            "success": False,
+            "message": "Pipelines are owned by the worker processes"
+        }), 409
+    
+    data = request.get_json(silent=True) or {}
+    from .model_manager import MODEL_MANAGER
+    unloaded = MODEL_MANAGER.unload(data.get("checkpoint"), data.get("pipeline_type"))
+    
+    return jsonify({
+        "success": True,
+        "message": f"Unloaded {unloaded} pipeline(s)"
+    })
+
 if __name__ == "__main__":
     print("Starting AI Image Generator server...")
+    
+    # Compile every resolution bucket before serving. Only the process the
+    # reloader runs the server in does this, not its file watcher; queue
+    # workers warm up in their own processes
+    if COMPILE_UNET and os.environ.get("WERKZEUG_RUN_MAIN") == "true" and not QUEUE_DB:
+        if NUM_WORKERS > 0:
+            # Pool workers compile as they start, before taking jobs
+            get_worker_pool()
+        else:
+            from .generate import warmup_pipelines
+            warmup_pipelines()
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,206 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from styles import get_style
+from .compiled_unet import snap_to_bucket
+from .inference_backends import inference_device
+from .generate import (prepare_init_image, get_direct_processor, is_pixel_art, style_image_batch,
+                       postprocess_styled_image, restore_size)
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".webp", ".bmp")
+
+# Marks the end of a stage's output
+_END = object()
+
+
+def list_images(input_dir):
+    """Return the image files directly inside input_dir, sorted by name"""
+    return sorted(
+        os.path.join(input_dir, name) for name in os.listdir(input_dir)
+        if name.lower().endswith(IMAGE_EXTENSIONS) and os.path.isfile(os.path.join(input_dir, name))
+    )
+
+
+def output_path_for(path, output_dir):
+    """Return where the styled version of an input file is written"""
+    return os.path.join(output_dir, os.path.splitext(os.path.basename(path))[0] + ".png")
+
+
+class _Item:
+    """One image travelling through the pipeline"""
+
+    def __init__(self, index, path):
+        self.index = index
+        self.path = path
+        self.image = None
+        self.original_size = None
+        self.error = None
+
+
+def _decode(item, style_obj, device, uses_model):
+    """Decode stage: load, pre-process and, for diffusion styles, resize one image to its bucket"""
+    try:
+        with Image.open(item.path) as image:
+            image = image.convert("RGB")
+        item.original_size = image.size
+
+        # Model-free styles work on the full-resolution image
+        if get_direct_processor(style_obj) is None:
+            image, _ = prepare_init_image(image, device, style_obj)
+        if uses_model:
+            # Stretch to a fixed bucket so different photos can share a batch;
+            # the encode stage stretches the result back
+            image = image.resize(snap_to_bucket(image.width, image.height, device), Image.LANCZOS)
+        item.image = image
+    except Exception as e:
+        item.error = f"{type(e).__name__}: {e}"
+    return item
+
+
+def style_directory(input_dir, output_dir, style=None, instructions=None, prompt=None, seed=None,
+                    checkpoint=None, batch_size=4, decode_workers=2, encode_workers=2, queue_size=8,
+                    overwrite=False):
+    """
+    Style every image in a directory as a streaming pipeline. A decode
+    thread pool reads and pre-processes images ahead of inference,
+    inference runs img2img in batches of same-size images, and encoder
+    threads post-process, encode and write results behind it. Stages are joined
+    by bounded queues, so memory use does not grow with the folder size.
+
+    Args:
+        input_dir (str): Directory of images to style
+        output_dir (str): Directory to write <name>.png results to
+        style (str): Style to apply
+        instructions (str): Additional instructions for image processing
+        prompt (str): Additional prompt to guide the style transfer
+        seed (int): Base seed; image i uses seed + i
+        checkpoint (str): Optional checkpoint name, defaults to MUSEMIND_CHECKPOINT
+        batch_size (int): Images per img2img call
+        decode_workers (int): Decode threads
+        encode_workers (int): Encode and write threads
+        queue_size (int): Capacity of each queue between stages
+        overwrite (bool): Restyle images that already have an output
+
+    Returns:
+        dict: Counts of styled, skipped and failed images, plus timings
+    """
+    device = inference_device()
+    style_obj = get_style(style)
+    uses_model = get_direct_processor(style_obj) is None and not is_pixel_art(style, style_obj)
+    os.makedirs(output_dir, exist_ok=True)
+
+    paths = list_images(input_dir)
+    if not overwrite:
+        paths = [path for path in paths if not os.path.exists(output_path_for(path, output_dir))]
+    print(f"Styling {len(paths)} images from {input_dir} with batch size {batch_size}")
+
+    stats = {"styled": 0, "failed": 0, "skipped": 0, "inferred": 0, "inference_seconds": 0.0}
+    stats_lock = threading.Lock()
+    start_time = time.time()
+
+    # Decoded items, in input order; put() blocks once the queue is full,
+    # which keeps the decode pool at most queue_size images ahead
+    decoded = queue.Queue(maxsize=queue_size)
+    # Styled items waiting to be encoded and written
+    styled = queue.Queue(maxsize=queue_size)
+
+    decoder = ThreadPoolExecutor(max_workers=decode_workers, thread_name_prefix="style-decode")
+
+    def feed():
+        for index, path in enumerate(paths):
+            decoded.put(decoder.submit(_decode, _Item(index, path), style_obj, device, uses_model))
+        decoded.put(_END)
+
+    def encode():
+        while True:
+            item = styled.get()
+            if item is _END:
+                break
+            try:
+                image = item.image
+                if uses_model:
+                    image = postprocess_styled_image(image)
+                image = restore_size(image, item.original_size)
+                output_path = output_path_for(item.path, output_dir)
+                image.save(output_path + ".tmp", format="PNG", optimize=True)
+                os.replace(output_path + ".tmp", output_path)
+                with stats_lock:
+                    stats["styled"] += 1
+            except Exception as e:
+                print(f"Error writing {item.path}: {str(e)}")
+                with stats_lock:
+                    stats["failed"] += 1
+
+    def run_batch(batch):
+        seeds = [seed + item.index for item in batch] if seed is not None else None
+        batch_start = time.time()
+        try:
+            images = style_image_batch([item.image for item in batch], style, instructions, prompt,
+                                       seeds=seeds, checkpoint=checkpoint, postprocess=False)
+        except Exception as e:
+            print(f"Error styling batch starting at {batch[0].path}: {str(e)}")
+            with stats_lock:
+                stats["failed"] += len(batch)
+            return
+        stats["inference_seconds"] += time.time() - batch_start
+        stats["inferred"] += len(batch)
+
+        for item, image in zip(batch, images):
+            item.image = image
+            styled.put(item)
+
+        elapsed = time.time() - start_time
+        print(f"[{stats['inferred']}/{len(paths)}] {stats['inferred'] / elapsed * 60:.1f} images/min")
+
+    feeder = threading.Thread(target=feed, name="style-feed", daemon=True)
+    encoders = [threading.Thread(target=encode, name=f"style-encode-{i}", daemon=True)
+                for i in range(max(1, encode_workers))]
+    feeder.start()
+    for thread in encoders:
+        thread.start()
+
+    # Inference stage: group decoded images by size so each batch stacks
+    pending = {}
+    pending_count = 0
+    while True:
+        future = decoded.get()
+        if future is _END:
+            break
+
+        item = future.result()
+        if item.error:
+            print(f"Skipping {item.path}: {item.error}")
+            stats["skipped"] += 1
+            continue
+
+        pending.setdefault(item.image.size, []).append(item)
+        pending_count += 1
+
+        full = [size for size, items in pending.items() if len(items) >= batch_size]
+        if full:
+            batch = pending.pop(full[0])
+        elif pending_count >= max(batch_size, queue_size):
+            # Too many odd sizes waiting; flush the fullest group to bound memory
+            batch = pending.pop(max(pending, key=lambda size: len(pending[size])))
+        else:
+            continue
+        pending_count -= len(batch)
+        run_batch(batch)
+
+    for batch in list(pending.values()):
+        run_batch(batch)
+
+    for _ in encoders:
+        styled.put(_END)
+    for thread in encoders:
+        thread.join()
+    decoder.shutdown()
+
+    stats["elapsed_seconds"] = round(time.time() - start_time, 1)
+    stats["inference_seconds"] = round(stats["inference_seconds"], 1)
+    print(f"Styled {stats['styled']} images in {stats['elapsed_seconds']}s "
+          f"({stats['inference_seconds']}s in inference), {stats['failed']} failed, {stats['skipped']} skipped")
+    return stats
@@ -0,0 +1,138 @@
+import os
+import time
+from .jobs import JobCancelled
+
+# Fraction of the denoising steps that use classifier-free guidance; the
+# rest run only the conditional branch, halving their UNet batch (1 = guide
+# every step)
+GUIDANCE_STOP_FRACTION = float(os.environ.get("MUSEMIND_GUIDANCE_STOP_FRACTION", "1.0"))
+
+# Tensors the pipelines hand to step callbacks (guidance truncation swaps
+# the prompt embeddings, the deadline stop the latents)
+CALLBACK_TENSOR_INPUTS = ["latents", "prompt_embeds"]
+
+
+def make_step_callback(*hooks):
+    """
+    Combine per-step hooks into a single callback_on_step_end function
+
+    Each hook is called as hook(pipe, step, timestep, callback_kwargs) at the
+    end of every denoising step and may return an updated callback_kwargs
+    dict. None entries are ignored.
+
+    Returns:
+        callable: The combined callback, or None if there are no hooks
+    """
+    hooks = [hook for hook in hooks if hook is not None]
+    if not hooks:
+        return None
+
+    def callback(pipe, step, timestep, callback_kwargs):
+        for hook in hooks:
+            updated = hook(pipe, step, timestep, callback_kwargs)
+            if updated is not None:
+                callback_kwargs = updated
+        return callback_kwargs
+
+    return callback
+
+
+def cancellation_hook(should_cancel):
+    """
+    Build a step hook that stops the denoising loop once should_cancel() is true
+
+    Args:
+        should_cancel (callable): Returns True when the job must stop
+
+    Returns:
+        callable: Step hook, or None if should_cancel is None
+    """
+    if should_cancel is None:
+        return None
+
+    def hook(pipe, step, timestep, callback_kwargs):
+        if should_cancel():
+            raise JobCancelled(f"stopped at step {step + 1}")
+
+    return hook
+
+
+def deadline_hook(deadline, finish_seconds):
+    """
+    Build a step hook that ends the denoising loop early when the deadline
+    is about to pass. The remaining steps are skipped and the scheduler's
+    latest denoised estimate is decoded in place of the noisy latents, so
+    the result is a clean, if less detailed, image.
+
+    Args:
+        deadline (float): Wall-clock time the result is due
+        finish_seconds (float): Estimated time for one more step plus decoding
+
+    Returns:
+        callable: Step hook with a stopped_at attribute (the number of steps
+        run, or None if the loop finished normally), or None if there is
+        no deadline
+    """
+    if deadline is None:
+        return None
+
+    def hook(pipe, step, timestep, callback_kwargs):
+        if hook.stopped_at is not None or time.time() + finish_seconds < deadline:
+            return None
+
+        hook.stopped_at = step + 1
+        pipe._interrupt = True
+
+        # DPM++ keeps its x0 predictions; the newest one is the best image so far
+        model_outputs = getattr(pipe.scheduler, "model_outputs", None)
+        denoised = model_outputs[-1] if model_outputs else None
+        if denoised is not None and "latents" in callback_kwargs:
+            return dict(callback_kwargs, latents=denoised.to(callback_kwargs["latents"].dtype))
+        return None
+
+    hook.stopped_at = None
+    return hook
+
+
+def guidance_truncation_hook(stop_fraction=GUIDANCE_STOP_FRACTION):
+    """
+    Build a step hook that turns classifier-free guidance off once
+    `stop_fraction` of the steps have run. The unconditional half of the
+    prompt embeddings is dropped, so the remaining steps evaluate the UNet
+    on the conditional batch only. Late steps refine detail the guidance
+    no longer steers, so the image changes little.
+
+    The pipeline must be called with callback_on_step_end_tensor_inputs
+    including "prompt_embeds".
+
+    Args:
+        stop_fraction (float): Fraction of the steps run with guidance
+
+    Returns:
+        callable: Step hook with a saved attribute (per-image unconditional
+        UNet evaluations skipped), or None if guidance is never truncated
+    """
+    if stop_fraction >= 1:
+        return None
+
+    def hook(pipe, step, timestep, callback_kwargs):
+        prompt_embeds = callback_kwargs.get("prompt_embeds")
+        if hook.stopped_at is not None:
+            # This step ran on the conditional batch alone
+            hook.saved += prompt_embeds.shape[0] if prompt_embeds is not None else 1
+            return None
+
+        guided_steps = max(1, round(pipe.num_timesteps * stop_fraction))
+        if step + 1 < guided_steps or step + 1 >= pipe.num_timesteps:
+            return None
+        if prompt_embeds is None or not pipe.do_classifier_free_guidance:
+            return None
+
+        hook.stopped_at = step + 1
+        pipe._guidance_scale = 0.0
+        # Embeddings are stacked [unconditional, conditional]
+        return dict(callback_kwargs, prompt_embeds=prompt_embeds.chunk(2)[1])
+
+    hook.stopped_at = None
+    hook.saved = 0
+    return hook
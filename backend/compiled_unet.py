@@ -0,0 +1,172 @@
+import math
+import os
+import time
+import torch
+from PIL import Image, ImageOps
+
+# Compile the UNet with torch.compile and snap requests to resolution buckets
+# (PyTorch backend only)
+COMPILE_UNET = (os.environ.get("MUSEMIND_COMPILE_UNET", "0") == "1" and
+                os.environ.get("MUSEMIND_BACKEND", "torch") == "torch")
+
+# Inductor's compiled graphs are kept here so restarts reuse them
+COMPILE_CACHE_DIR = os.environ.get("MUSEMIND_COMPILE_CACHE_DIR", "./compile_cache")
+
+# Every distinct latent shape is a separate compiled graph, so requests
+# are snapped to a few fixed sizes. CPU generation is capped at 640px.
+DEFAULT_BUCKETS = {
+    "cpu": "512x512,640x640,640x448,448x640,640x384,384x640",
+    "cuda": "512x512,768x768,1024x1024,768x512,512x768,1024x640,640x1024",
+}
+
+
+def parse_buckets(spec):
+    """
+    Parse a bucket list such as "512x512,640x448"
+
+    Args:
+        spec (str): Comma-separated WIDTHxHEIGHT pairs
+
+    Returns:
+        list: (width, height) tuples
+
+    Raises:
+        ValueError: If a size is malformed or not a multiple of 64
+    """
+    buckets = []
+    for item in spec.split(","):
+        item = item.strip().lower()
+        if not item:
+            continue
+        width, height = (int(value) for value in item.split("x"))
+        if width % 64 or height % 64:
+            raise ValueError(f"Resolution bucket {item} is not a multiple of 64")
+        buckets.append((width, height))
+    return buckets
+
+
+def resolution_buckets(device="cpu"):
+    """Return the resolution buckets for a device, honouring MUSEMIND_RESOLUTION_BUCKETS"""
+    spec = os.environ.get("MUSEMIND_RESOLUTION_BUCKETS") or DEFAULT_BUCKETS.get(device, DEFAULT_BUCKETS["cpu"])
+    return parse_buckets(spec)
+
+
+def snap_to_bucket(width, height, device="cpu"):
+    """
+    Pick the bucket closest to a requested size, weighing aspect ratio
+    more than area so crops stay small
+
+    Args:
+        width (int): Requested width
+        height (int): Requested height
+        device (str): "cuda" or "cpu"
+
+    Returns:
+        tuple: (width, height) of the bucket
+    """
+    def distance(bucket):
+        aspect = abs(math.log((bucket[0] / bucket[1]) / (width / height)))
+        area = abs(math.log((bucket[0] * bucket[1]) / (width * height)))
+        return 2 * aspect + area
+
+    return min(resolution_buckets(device), key=distance)
+
+
+def smaller_buckets(width, height, device="cpu"):
+    """
+    List the bucket a size snaps to and the smaller buckets of the same
+    aspect ratio, largest first: the sizes a compiled UNet can drop to
+    without cropping differently
+
+    Args:
+        width (int): Requested width
+        height (int): Requested height
+        device (str): "cuda" or "cpu"
+
+    Returns:
+        list: (width, height) tuples
+    """
+    bucket_width, bucket_height = snap_to_bucket(width, height, device)
+    options = {bucket for bucket in resolution_buckets(device)
+               if bucket[0] <= bucket_width and bucket[0] * bucket_height == bucket[1] * bucket_width}
+    return sorted(options, reverse=True)
+
+
+def fit_to_size(image, width, height):
+    """
+    Bring a bucket-sized image to the requested size: scale it to cover
+    the target, then center-crop the overflow
+
+    Args:
+        image (PIL.Image): Image rendered at bucket size
+        width (int): Requested width
+        height (int): Requested height
+
+    Returns:
+        PIL.Image: Image of exactly width x height
+    """
+    if image.size == (width, height):
+        return image
+    return ImageOps.fit(image, (width, height), Image.LANCZOS, centering=(0.5, 0.5))
+
+
+def configure_compile_cache():
+    """Point Inductor's graph cache at COMPILE_CACHE_DIR and turn it on"""
+    cache_dir = os.path.abspath(COMPILE_CACHE_DIR)
+    os.makedirs(cache_dir, exist_ok=True)
+    os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", cache_dir)
+    os.environ.setdefault("TORCHINDUCTOR_FX_GRAPH_CACHE", "1")
+
+    import torch._inductor.config as inductor_config
+    inductor_config.fx_graph_cache = True
+
+
+def compile_unet(unet):
+    """
+    Wrap a UNet with torch.compile, once
+
+    Args:
+        unet (torch.nn.Module): The pipeline's UNet
+
+    Returns:
+        torch.nn.Module: The compiled UNet
+    """
+    # Sibling pipelines share the UNet, which may already be compiled
+    if hasattr(unet, "_orig_mod"):
+        return unet
+
+    configure_compile_cache()
+    unet.to(memory_format=torch.channels_last)
+    print("Compiling UNet (graphs are built per resolution bucket on first use)")
+    # Static shapes: each bucket gets its own specialised graph
+    return torch.compile(unet, dynamic=False)
+
+
+def warmup_buckets(pipe, device="cpu", steps=2):
+    """
+    Run each resolution bucket once so its graph is compiled (or loaded
+    from the on-disk cache) before real requests arrive
+
+    Args:
+        pipe: Text-to-image pipeline with a compiled UNet
+        device (str): "cuda" or "cpu"
+        steps (int): Denoising steps per warmup run
+
+    Returns:
+        list: Buckets warmed by this call
+    """
+    unet = pipe.unet
+    warmed = getattr(unet, "_musemind_warm_buckets", set())
+
+    buckets = [bucket for bucket in resolution_buckets(device) if bucket not in warmed]
+    for width, height in buckets:
+        start = time.time()
+        # Guidance above 1 runs the batched conditional/unconditional pass
+        # that real requests use; the VAE is skipped since it isn't compiled
+        pipe(prompt="", width=width, height=height, num_inference_steps=steps,
+             guidance_scale=7.5, output_type="latent")
+        warmed.add((width, height))
+        print(f"Warmed UNet bucket {width}x{height} in {time.time() - start:.1f}s")
+
+    unet._musemind_warm_buckets = warmed
+    return buckets
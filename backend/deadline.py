@@ -0,0 +1,191 @@
+import os
+import threading
+import time
+
+# Seconds per denoising step for one 512x512 image before anything has
+# been measured on this node
+DEFAULT_SECONDS_PER_STEP = {
+    "cuda": float(os.environ.get("MUSEMIND_DEFAULT_STEP_SECONDS_CUDA", "0.06")),
+    "cpu": float(os.environ.get("MUSEMIND_DEFAULT_STEP_SECONDS_CPU", "1.2")),
+}
+
+# Fixed cost of a call (text encoding and VAE decode) relative to one step
+DEFAULT_OVERHEAD_STEPS = 3.0
+
+# Fewer steps than this gives unusable images with DPM++; below it the
+# resolution is lowered instead
+MIN_QUALITY_STEPS = 15
+
+# Absolute floor when even the smallest resolution can't fit the deadline
+MIN_STEPS = 6
+
+# Resolution scales tried, largest first
+RESOLUTION_SCALES = (1.0, 0.875, 0.75, 0.625, 0.5)
+
+# Smallest generation side in pixels
+MIN_SIDE = 256
+
+# Keep this fraction of the budget spare for noise in the estimates
+SAFETY_MARGIN = 0.85
+
+# Weight of the newest measurement in the running averages
+EMA_WEIGHT = 0.2
+
+
+class LatencyModel:
+    """
+    Running estimates of how long denoising steps take on this node.
+    Step cost is modelled as linear in image area times batch size and is
+    tracked separately per device and pipeline type, along with the fixed
+    per-call overhead.
+    """
+
+    def __init__(self):
+        self._step = {}
+        self._overhead = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _units(width, height, batch):
+        return width * height / (512 * 512) * max(1, batch)
+
+    def observe(self, key, width, height, batch, step_seconds, overhead_seconds=None):
+        """
+        Record a measured run
+
+        Args:
+            key (tuple): (device, pipeline type)
+            width (int): Generation width
+            height (int): Generation height
+            batch (int): Images per call
+            step_seconds (float): Mean seconds per denoising step
+            overhead_seconds (float): Seconds spent outside the steps, if known
+        """
+        units = self._units(width, height, batch)
+        with self._lock:
+            per_unit = step_seconds / units
+            previous = self._step.get(key)
+            self._step[key] = per_unit if previous is None else previous + (per_unit - previous) * EMA_WEIGHT
+
+            if overhead_seconds is not None and overhead_seconds >= 0:
+                per_unit = overhead_seconds / units
+                previous = self._overhead.get(key)
+                self._overhead[key] = per_unit if previous is None else previous + (per_unit - previous) * EMA_WEIGHT
+
+    def step_seconds(self, key, width, height, batch):
+        """Return the estimated seconds per denoising step"""
+        with self._lock:
+            per_unit = self._step.get(key)
+        if per_unit is None:
+            per_unit = DEFAULT_SECONDS_PER_STEP.get(key[0], DEFAULT_SECONDS_PER_STEP["cpu"])
+        return per_unit * self._units(width, height, batch)
+
+    def overhead_seconds(self, key, width, height, batch):
+        """Return the estimated seconds a call spends outside the denoising steps"""
+        with self._lock:
+            per_unit = self._overhead.get(key)
+        if per_unit is None:
+            return self.step_seconds(key, width, height, batch) * DEFAULT_OVERHEAD_STEPS
+        return per_unit * self._units(width, height, batch)
+
+    def measured(self, key):
+        """Return True once a run with this key has been observed"""
+        with self._lock:
+            return key in self._step
+
+    def plan(self, key, remaining_seconds, width, height, batch=1, calls=1, max_steps=30, strength=1.0,
+             sizes=None):
+        """
+        Choose the step count and resolution that fit a time budget
+
+        Full resolution is kept as long as it allows MIN_QUALITY_STEPS;
+        beyond that the resolution drops, and as a last resort the step
+        count goes down to MIN_STEPS at the smallest resolution.
+
+        Args:
+            key (tuple): (device, pipeline type)
+            remaining_seconds (float): Time left until the deadline
+            width (int): Preferred generation width
+            height (int): Preferred generation height
+            batch (int): Images per call
+            calls (int): Pipeline calls needed for the request
+            max_steps (int): Step count used without a deadline
+            strength (float): img2img strength; only this fraction of the
+                steps actually runs
+            sizes (list): (width, height) sizes to choose from, largest
+                first, instead of scaling the preferred size down
+
+        Returns:
+            dict: steps, width, height and the predicted seconds
+        """
+        budget = max(0.0, remaining_seconds) * SAFETY_MARGIN / max(1, calls)
+        strength = min(max(strength, 0.05), 1.0)
+
+        if sizes is None:
+            sizes = []
+            for scale in RESOLUTION_SCALES:
+                if scale == 1.0:
+                    size = (width, height)
+                else:
+                    # Multiples of 64 keep the latents valid
+                    size = (max(MIN_SIDE, int(width * scale) // 64 * 64),
+                            max(MIN_SIDE, int(height * scale) // 64 * 64))
+                if size not in sizes:
+                    sizes.append(size)
+
+        candidates = []
+        for gen_width, gen_height in sizes:
+            step_time = self.step_seconds(key, gen_width, gen_height, batch)
+            overhead = self.overhead_seconds(key, gen_width, gen_height, batch)
+            fitting = int((budget - overhead) / (step_time * strength)) if budget > overhead else 0
+            candidates.append((min(max_steps, fitting), gen_width, gen_height, step_time, overhead))
+
+            if fitting >= min(max_steps, MIN_QUALITY_STEPS):
+                break
+
+        steps, gen_width, gen_height, step_time, overhead = candidates[-1]
+        steps = max(min(MIN_STEPS, max_steps), steps)
+        return {
+            "steps": steps,
+            "width": gen_width,
+            "height": gen_height,
+            "predicted_seconds": round((overhead + steps * strength * step_time) * max(1, calls), 2),
+            "measured": self.measured(key),
+        }
+
+
+class StepTimer:
+    """
+    Step hook that times the denoising steps of one pipeline call and
+    feeds the result into a LatencyModel when the call finishes
+    """
+
+    def __init__(self, model, key, width, height, batch):
+        self.model = model
+        self.key = key
+        self.width = width
+        self.height = height
+        self.batch = batch
+        self.started = time.perf_counter()
+        self.step_times = []
+        self._last = None
+
+    def __call__(self, pipe, step, timestep, callback_kwargs):
+        now = time.perf_counter()
+        # The first interval also covers text encoding and latent setup
+        if self._last is not None:
+            self.step_times.append(now - self._last)
+        self._last = now
+
+    def finish(self):
+        """Record the call; steps skipped after an early stop are not counted"""
+        if not self.step_times:
+            return
+        step_seconds = sum(self.step_times) / len(self.step_times)
+        total = time.perf_counter() - self.started
+        overhead = total - step_seconds * (len(self.step_times) + 1)
+        self.model.observe(self.key, self.width, self.height, self.batch, step_seconds, overhead)
+
+
+# Per-process latency estimates (each worker measures its own)
+LATENCY = LatencyModel()
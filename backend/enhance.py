@@ -0,0 +1,195 @@
+import numpy as np
+from PIL import Image
+
+# Rec. 709 luma weights
+LUMA_WEIGHTS = np.array([0.2126, 0.7152, 0.0722], dtype=np.float32)
+
+
+def box_filter(array, radius):
+    """
+    Mean filter over a (2 * radius + 1) square window using summed-area
+    tables, so the cost does not depend on the radius
+
+    Args:
+        array (np.ndarray): HxW or HxWxC float32 array
+        radius (int): Window radius in pixels
+
+    Returns:
+        np.ndarray: Filtered array of the same shape
+    """
+    if radius < 1:
+        return array
+
+    size = 2 * radius + 1
+    pad = [(radius + 1, radius), (radius + 1, radius)] + [(0, 0)] * (array.ndim - 2)
+    padded = np.pad(array, pad, mode="edge")
+
+    summed = np.cumsum(padded, axis=0)
+    summed = summed[size:] - summed[:-size]
+    summed = np.cumsum(summed, axis=1)
+    summed = summed[:, size:] - summed[:, :-size]
+    return summed / (size * size)
+
+
+def guided_filter(array, radius, eps):
+    """
+    Edge-preserving smoothing using the array as its own guide
+
+    Args:
+        array (np.ndarray): HxW or HxWxC float32 array
+        radius (int): Window radius in pixels
+        eps (float): Regularization; larger values smooth stronger edges
+
+    Returns:
+        np.ndarray: Smoothed array
+    """
+    mean = box_filter(array, radius)
+    variance = box_filter(array * array, radius) - mean * mean
+    a = variance / (variance + eps)
+    b = mean - a * mean
+    return box_filter(a, radius) * array + box_filter(b, radius)
+
+
+def luminance(rgb):
+    """Return the HxW luma channel of an HxWx3 array"""
+    return rgb @ LUMA_WEIGHTS
+
+
+def denoise(rgb, strength=1.0):
+    """
+    Remove sensor and compression noise while keeping edges: luma goes
+    through an edge-preserving filter, chroma (where noise is least
+    visible as detail) through a plain box blur
+
+    Args:
+        rgb (np.ndarray): HxWx3 float32 array in [0, 1]
+        strength (float): 0 disables, 1 is the default amount
+
+    Returns:
+        np.ndarray: Denoised array
+    """
+    if strength <= 0:
+        return rgb
+
+    lum = luminance(rgb)[..., None]
+    chroma = rgb - lum
+
+    smooth_lum = guided_filter(lum[..., 0], radius=2, eps=(0.03 * strength) ** 2)[..., None]
+    smooth_chroma = box_filter(chroma, 2)
+
+    mix = min(strength, 1.0)
+    return np.clip(lum + (smooth_lum - lum) * mix + chroma + (smooth_chroma - chroma) * mix, 0.0, 1.0)
+
+
+def correct_color(rgb, white_balance=0.5, clip_percent=0.5):
+    """
+    Partial gray-world white balance followed by a percentile levels stretch
+
+    Args:
+        rgb (np.ndarray): HxWx3 float32 array in [0, 1]
+        white_balance (float): How far to move towards gray-world balance
+        clip_percent (float): Percent of pixels clipped at each end
+
+    Returns:
+        np.ndarray: Color-corrected array
+    """
+    # Estimate statistics on a subsample, which is plenty for global values
+    step = max(1, int(np.sqrt(rgb.shape[0] * rgb.shape[1] / 65536)))
+    sample = rgb[::step, ::step].reshape(-1, 3)
+
+    channel_means = sample.mean(axis=0) + 1e-6
+    gains = np.clip(channel_means.mean() / channel_means, 0.8, 1.25)
+    gains = 1.0 + (gains - 1.0) * white_balance
+    rgb = rgb * gains.astype(np.float32)
+
+    low, high = np.percentile(luminance(sample * gains.astype(np.float32)), [clip_percent, 100 - clip_percent])
+    low, high = float(low), float(high)
+    if high - low > 1e-3:
+        rgb = (rgb - low) / (high - low)
+    return np.clip(rgb, 0.0, 1.0)
+
+
+def tone_map(rgb, compression=0.75, detail=1.35):
+    """
+    Local tone mapping: compress the large-scale luminance range while
+    boosting fine detail, applied as a per-pixel gain so hue is preserved
+
+    Args:
+        rgb (np.ndarray): HxWx3 float32 array in [0, 1]
+        compression (float): Scale for the base layer contrast (< 1 compresses)
+        detail (float): Scale for the detail layer (> 1 boosts local contrast)
+
+    Returns:
+        np.ndarray: Tone-mapped array
+    """
+    lum = luminance(rgb)
+    log_lum = np.log(lum + 1e-3)
+
+    radius = max(4, min(rgb.shape[0], rgb.shape[1]) // 48)
+    base = guided_filter(log_lum, radius=radius, eps=0.1)
+    detail_layer = log_lum - base
+
+    # Pivot around the mean luminance so overall brightness is kept
+    anchor = float(np.log(lum.mean() + 1e-3))
+    mapped = (base - anchor) * compression + anchor + detail_layer * detail
+
+    gain = np.exp(mapped - log_lum)[..., None]
+    return np.clip(rgb * gain, 0.0, 1.0)
+
+
+def adjust_saturation(rgb, amount=1.1):
+    """Scale chroma around the luma of each pixel"""
+    lum = luminance(rgb)[..., None]
+    return np.clip(lum + (rgb - lum) * amount, 0.0, 1.0)
+
+
+def sharpen(rgb, amount=0.6, threshold=0.01):
+    """
+    Unsharp mask on luminance with a noise threshold
+
+    Args:
+        rgb (np.ndarray): HxWx3 float32 array in [0, 1]
+        amount (float): Strength of the sharpening
+        threshold (float): Detail below this is left alone
+
+    Returns:
+        np.ndarray: Sharpened array
+    """
+    lum = luminance(rgb)
+    # Two box passes approximate a small gaussian
+    blurred = box_filter(box_filter(lum, 1), 1)
+    high_pass = lum - blurred
+    high_pass = np.where(np.abs(high_pass) > threshold, high_pass, 0.0)
+    return np.clip(rgb + (amount * high_pass)[..., None], 0.0, 1.0)
+
+
+def enhance_image(image, denoise_strength=1.0, compression=0.75, detail=1.35,
+                  saturation=1.1, sharpness=0.6, white_balance=0.5):
+    """
+    Model-free photo enhancement: denoise, color correction, local tone
+    mapping, saturation and sharpening, all as vectorized array operations
+
+    Args:
+        image (PIL.Image): Input image
+        denoise_strength (float): Noise removal amount (0 disables)
+        compression (float): Large-scale contrast compression for tone mapping
+        detail (float): Local contrast boost for tone mapping
+        saturation (float): Chroma scale
+        sharpness (float): Unsharp mask amount
+        white_balance (float): Gray-world correction amount
+
+    Returns:
+        PIL.Image: Enhanced RGB image
+    """
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+
+    rgb = np.asarray(image, dtype=np.float32) / 255.0
+
+    rgb = denoise(rgb, denoise_strength)
+    rgb = correct_color(rgb, white_balance=white_balance)
+    rgb = tone_map(rgb, compression=compression, detail=detail)
+    rgb = adjust_saturation(rgb, saturation)
+    rgb = sharpen(rgb, amount=sharpness)
+
+    return Image.fromarray((rgb * 255.0 + 0.5).astype(np.uint8), "RGB")
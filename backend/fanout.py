@@ -0,0 +1,55 @@
+import os
+from styles import get_style, STYLE_NAMES
+from .jobs import CPU_ONLY_STYLES
+
+# Styles whose img2img strength and step counts are within these limits of
+# each other are rendered together in one batched call, at the group's mean
+# strength and guidance and its largest step count
+FANOUT_STRENGTH_TOLERANCE = float(os.environ.get("MUSEMIND_FANOUT_STRENGTH_TOLERANCE", "0.05"))
+FANOUT_STEP_TOLERANCE = int(os.environ.get("MUSEMIND_FANOUT_STEP_TOLERANCE", "10"))
+
+
+def group_styles(style_names=None, strength_tolerance=FANOUT_STRENGTH_TOLERANCE,
+                 step_tolerance=FANOUT_STEP_TOLERANCE):
+    """
+    Split styles into groups that can share a batched img2img call
+
+    Styles that never touch the diffusion model (pixel art and direct
+    enhancement) each form a group of their own.
+
+    Args:
+        style_names (list): Style names or aliases, defaults to every style
+        strength_tolerance (float): Largest strength difference within a group
+        step_tolerance (int): Largest step count difference within a group
+
+    Returns:
+        tuple: (groups as lists of canonical style names, cheapest first,
+        unknown style names)
+    """
+    style_objs = []
+    unknown = []
+    seen = set()
+    for name in style_names or STYLE_NAMES:
+        style_obj = get_style(name)
+        if style_obj is None:
+            unknown.append(name)
+        elif style_obj.name not in seen:
+            seen.add(style_obj.name)
+            style_objs.append(style_obj)
+
+    cpu_only = [style_obj for style_obj in style_objs
+                if style_obj.name in CPU_ONLY_STYLES or style_obj.is_direct()]
+    diffusion = sorted((style_obj for style_obj in style_objs if style_obj not in cpu_only),
+                       key=lambda style_obj: (style_obj.img2img_strength, style_obj.inference_steps))
+
+    groups = [[style_obj.name] for style_obj in cpu_only]
+    current = []
+    for style_obj in diffusion:
+        if current and (style_obj.img2img_strength - current[0].img2img_strength > strength_tolerance + 1e-9 or
+                        abs(style_obj.inference_steps - current[0].inference_steps) > step_tolerance):
+            groups.append([member.name for member in current])
+            current = []
+        current.append(style_obj)
+    if current:
+        groups.append([member.name for member in current])
+    return groups, unknown
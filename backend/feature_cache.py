@@ -0,0 +1,171 @@
+import os
+from contextlib import contextmanager
+import torch
+from .compiled_unet import COMPILE_UNET
+from .inference_backends import BACKEND
+
+# Run the whole UNet only every N denoising steps and reuse its deep
+# features in between (DeepCache); 0 or 1 disables caching
+FEATURE_CACHE_INTERVALS = {
+    "cpu": int(os.environ.get("MUSEMIND_FEATURE_CACHE_INTERVAL_CPU", "0")),
+    "cuda": int(os.environ.get("MUSEMIND_FEATURE_CACHE_INTERVAL_CUDA", "0")),
+}
+
+# Per-style overrides as comma-separated style=N, e.g. "anime=3,realistic=0";
+# detailed styles drift further from the full model at large intervals
+FEATURE_CACHE_STYLE_INTERVALS = os.environ.get("MUSEMIND_FEATURE_CACHE_STYLE_INTERVALS", "")
+
+
+def parse_style_intervals(spec):
+    """Parse "anime=3,realistic=0" into a {style name: interval} dict"""
+    intervals = {}
+    for item in spec.split(","):
+        if "=" in item:
+            name, value = item.split("=", 1)
+            intervals[name.strip().lower()] = int(value)
+    return intervals
+
+
+STYLE_INTERVALS = parse_style_intervals(FEATURE_CACHE_STYLE_INTERVALS)
+
+
+def feature_cache_interval(device, style_objs=()):
+    """
+    Return the feature cache interval for a run
+
+    Args:
+        device (str): "cuda" or "cpu"
+        style_objs (list): Styles rendered together; the smallest interval
+            among their overrides wins
+
+    Returns:
+        int: Steps between full UNet evaluations (0 when caching is off)
+    """
+    if COMPILE_UNET or not BACKEND.supports_unet_hooks:
+        # The cached path is a different graph from the compiled forward,
+        # and exported UNets can't be split into blocks
+        return 0
+    interval = FEATURE_CACHE_INTERVALS.get(device, 0)
+    overrides = [STYLE_INTERVALS[style_obj.name] for style_obj in style_objs
+                 if style_obj is not None and style_obj.name in STYLE_INTERVALS]
+    if overrides:
+        interval = min(overrides)
+    return interval if interval > 1 else 0
+
+
+class FeatureCacheState:
+    """Step counter and cached features of one pipeline call"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.step = 0
+        self.features = None
+        self.full_steps = 0
+        self.cached_steps = 0
+
+
+def _shallow_forward(unet, state, sample, timestep, encoder_hidden_states, cross_attention_kwargs):
+    """
+    Run only the outermost blocks: the time embedding, conv_in, the first
+    down block and the last up block, which is fed the features the
+    deeper blocks produced at the last full step
+    """
+    timesteps = timestep
+    if not torch.is_tensor(timesteps):
+        timesteps = torch.tensor([timesteps], device=sample.device)
+    elif timesteps.ndim == 0:
+        timesteps = timesteps[None].to(sample.device)
+    timesteps = timesteps.expand(sample.shape[0])
+    emb = unet.time_embedding(unet.time_proj(timesteps).to(dtype=sample.dtype))
+
+    sample = unet.conv_in(sample)
+    residuals = (sample,)
+    down_block = unet.down_blocks[0]
+    if getattr(down_block, "has_cross_attention", False):
+        _, down_residuals = down_block(hidden_states=sample, temb=emb, encoder_hidden_states=encoder_hidden_states,
+                                       cross_attention_kwargs=cross_attention_kwargs)
+    else:
+        _, down_residuals = down_block(hidden_states=sample, temb=emb)
+    residuals += down_residuals
+
+    # The last up block consumes the skip connections of conv_in and the
+    # first down block's resnets; the downsampler output feeds deeper blocks
+    up_block = unet.up_blocks[-1]
+    residuals = residuals[:len(up_block.resnets)]
+    if getattr(up_block, "has_cross_attention", False):
+        sample = up_block(hidden_states=state.features, temb=emb, res_hidden_states_tuple=residuals,
+                          encoder_hidden_states=encoder_hidden_states,
+                          cross_attention_kwargs=cross_attention_kwargs, upsample_size=None)
+    else:
+        sample = up_block(hidden_states=state.features, temb=emb, res_hidden_states_tuple=residuals,
+                          upsample_size=None)
+
+    if unet.conv_norm_out is not None:
+        sample = unet.conv_act(unet.conv_norm_out(sample))
+    return unet.conv_out(sample)
+
+
+@contextmanager
+def feature_cache(unet, interval):
+    """
+    Cache the UNet's deep features across the denoising steps of one
+    pipeline call. Every `interval` steps (and always on the first) the
+    full UNet runs and the input of its last up block is kept; the steps
+    in between recompute only the outermost blocks around those features.
+
+    Calls the shortcut can't reproduce (extra conditioning, ControlNet
+    residuals, a different batch) run the full UNet.
+
+    Args:
+        unet (UNet2DConditionModel): UNet of the pipeline about to run
+        interval (int): Steps between full evaluations (0 or 1 disables)
+
+    Yields:
+        FeatureCacheState: Counts of full and cached steps, or None when
+        caching is disabled
+    """
+    if interval <= 1:
+        yield None
+        return
+
+    state = FeatureCacheState(interval)
+    # CPU offload hooks replace forward and call the original as _old_forward
+    attr = "_old_forward" if hasattr(unet, "_old_forward") else "forward"
+    patched_instance = attr in unet.__dict__
+    original = getattr(unet, attr)
+
+    def capture(module, args, kwargs):
+        state.features = kwargs["hidden_states"] if "hidden_states" in kwargs else args[0]
+
+    def forward(sample, timestep, encoder_hidden_states, class_labels=None, timestep_cond=None,
+                attention_mask=None, cross_attention_kwargs=None, added_cond_kwargs=None,
+                down_block_additional_residuals=None, mid_block_additional_residual=None,
+                *args, return_dict=True, **kwargs):
+        step, state.step = state.step, state.step + 1
+        shortcut = (step % interval != 0 and state.features is not None and not return_dict and
+                    state.features.shape[0] == sample.shape[0] and class_labels is None and
+                    timestep_cond is None and attention_mask is None and not added_cond_kwargs and
+                    down_block_additional_residuals is None and mid_block_additional_residual is None and
+                    all(value is None for value in (*args, *kwargs.values())) and
+                    getattr(unet, "class_embedding", None) is None and getattr(unet, "add_embedding", None) is None)
+        if shortcut:
+            state.cached_steps += 1
+            return (_shallow_forward(unet, state, sample, timestep, encoder_hidden_states, cross_attention_kwargs),)
+
+        state.full_steps += 1
+        hook = unet.up_blocks[-1].register_forward_pre_hook(capture, with_kwargs=True)
+        try:
+            return original(sample, timestep, encoder_hidden_states, class_labels, timestep_cond, attention_mask,
+                            cross_attention_kwargs, added_cond_kwargs, down_block_additional_residuals,
+                            mid_block_additional_residual, *args, return_dict=return_dict, **kwargs)
+        finally:
+            hook.remove()
+
+    setattr(unet, attr, forward)
+    try:
+        yield state
+    finally:
+        if patched_instance:
+            setattr(unet, attr, original)
+        else:
+            delattr(unet, attr)
@@ -1,6 +1,5 @@
 import os
 import torch
-from diffusers import StableDiffusionPipeline, DPMSolverMultistepScheduler, StableDiffusionImg2ImgPipeline
 import base64
 from io import BytesIO
 from PIL import Image, ImageEnhance, ImageFilter, ImageOps
@@ -8,78 +7,159 @@ import time
 import re
 import numpy as np
 from styles import get_style
+from .utils import max_batch_size, DEFAULT_CHECKPOINT
+from .callbacks import (make_step_callback, cancellation_hook, deadline_hook, guidance_truncation_hook,
+                        GUIDANCE_STOP_FRACTION, CALLBACK_TENSOR_INPUTS)
+from .jobs import JobCancelled
+from .enhance import enhance_image
+from .model_manager import MODEL_MANAGER
+from .compiled_unet import COMPILE_UNET, snap_to_bucket, smaller_buckets, fit_to_size, warmup_buckets
+from .usage import GenerationResult, PeakMemory
+from .deadline import LATENCY, StepTimer
+from .result_cache import RESULT_CACHE, result_key
+from .uploads import content_hash
+from .latent_cache import encode_init_latents, sample_init_latents
+from .profiling import profile_call
+from .feature_cache import feature_cache, feature_cache_interval
+from .token_merge import TOKEN_MERGING, TOKEN_MERGE_RATIOS
+from .admission import degrade
+from .inference_backends import BACKEND, inference_device
+from .warm_start import (WARM_START, WARM_START_STRENGTH, WARM_START_INDEX, prompt_embedding,
+                         warm_start_bucket)
 
-# Global variables to keep models in memory
-TEXT_TO_IMAGE_PIPELINE = None
-IMG_TO_IMG_PIPELINE = None
+# Above this many pixels per image the VAE runs in blended tiles, and above
+# this many pixels per batch it decodes one image at a time, to cap peak memory
+VAE_TILING_PIXELS = int(os.environ.get("MUSEMIND_VAE_TILING_PIXELS", str(640 * 640)))
 
-# Function to initialize pipelines only once
-def initialize_pipeline(pipeline_type="text2img", device=None):
+# Function to get a pipeline from the model manager
+def initialize_pipeline(pipeline_type="text2img", device=None, checkpoint=None):
     """
     Initialize and return the requested pipeline type.
-    Reuses existing pipeline if already loaded.
+    Reuses existing pipeline if already loaded; the model manager unloads
+    pipelines again when they sit idle or memory is needed elsewhere.
     
     Args:
         pipeline_type (str): "text2img" or "img2img"
         device (str): Device to use, defaults to auto-detection
+        checkpoint (str): Checkpoint name under the model root, defaults to
+            MUSEMIND_CHECKPOINT
         
     Returns:
         Pipeline object
     """
-    global TEXT_TO_IMAGE_PIPELINE, IMG_TO_IMG_PIPELINE
-    
-    # Auto-detect device if not specified
-    if device is None:
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-    
-    torch_dtype = torch.float16 if device == "cuda" else torch.float32
-    model_path = "./model/stable-diffusion-v1-5"
+    return MODEL_MANAGER.get(pipeline_type, device, checkpoint)
+
+# Load pipelines ahead of the first request
+def warmup_pipelines(pipeline_types=("text2img", "img2img"), checkpoint=None, should_cancel=None):
+    """
+    Load the given pipeline types so the first request doesn't pay for it
     
-    if pipeline_type == "text2img" and TEXT_TO_IMAGE_PIPELINE is None:
-        print(f"Initializing text-to-image pipeline on {device}...")
-        TEXT_TO_IMAGE_PIPELINE = StableDiffusionPipeline.from_pretrained(
-            model_path,
-            torch_dtype=torch_dtype,
-            safety_checker=None,
-        )
-        TEXT_TO_IMAGE_PIPELINE.scheduler = DPMSolverMultistepScheduler.from_config(
-            TEXT_TO_IMAGE_PIPELINE.scheduler.config,
-            use_karras_sigmas=True,  # Better quality sigmas
-            algorithm_type="dpmsolver++",  # Better algorithm
-        )
-        TEXT_TO_IMAGE_PIPELINE = TEXT_TO_IMAGE_PIPELINE.to(device)
-        TEXT_TO_IMAGE_PIPELINE.enable_attention_slicing()
+    Args:
+        pipeline_types (tuple): Pipeline types to load
+        checkpoint (str): Optional checkpoint name, defaults to MUSEMIND_CHECKPOINT
+        should_cancel (callable): Unused, accepted for the job interface
         
-        # Enable model offloading if on CUDA to save VRAM
-        if device == "cuda":
-            TEXT_TO_IMAGE_PIPELINE.enable_model_cpu_offload()
+    Returns:
+        list: The pipeline types that were loaded
+    """
+    device = inference_device()
+    for pipeline_type in pipeline_types:
+        pipe = initialize_pipeline(pipeline_type, device, checkpoint)
         
-        return TEXT_TO_IMAGE_PIPELINE
+        # img2img shares the UNet, so warming the text2img buckets covers both
+        if COMPILE_UNET and pipeline_type == "text2img":
+            warmup_buckets(pipe, device)
+    return list(pipeline_types)
+
+# Switch the VAE between whole-image and tiled/sliced processing
+def configure_vae(pipe, width, height, batch_size=1):
+    """
+    Enable VAE tiling and slicing for large requests, disable them otherwise.
+    Tiles overlap and are blended, so seams don't show.
+    
+    Args:
+        pipe: Pipeline whose VAE to configure
+        width (int): Image width in pixels
+        height (int): Image height in pixels
+        batch_size (int): Images decoded per pipeline call
         
-    elif pipeline_type == "img2img" and IMG_TO_IMG_PIPELINE is None:
-        print(f"Initializing image-to-image pipeline on {device}...")
-        IMG_TO_IMG_PIPELINE = StableDiffusionImg2ImgPipeline.from_pretrained(
-            model_path,
-            torch_dtype=torch_dtype,
-            safety_checker=None,
-        )
-        # Use the same improved scheduler
-        IMG_TO_IMG_PIPELINE.scheduler = DPMSolverMultistepScheduler.from_config(
-            IMG_TO_IMG_PIPELINE.scheduler.config,
-            use_karras_sigmas=True,
-            algorithm_type="dpmsolver++",
-        )
-        IMG_TO_IMG_PIPELINE = IMG_TO_IMG_PIPELINE.to(device)
-        IMG_TO_IMG_PIPELINE.enable_attention_slicing()
+    Returns:
+        bool: Whether the VAE is tiled
+    """
+    if not BACKEND.supports_vae_tiling:
+        return False
+    
+    tiled = width * height > VAE_TILING_PIXELS
+    if tiled:
+        pipe.vae.enable_tiling()
+    else:
+        pipe.vae.disable_tiling()
+    
+    if width * height * batch_size > VAE_TILING_PIXELS:
+        pipe.vae.enable_slicing()
+    else:
+        pipe.vae.disable_slicing()
+    
+    if tiled:
+        print(f"Using tiled VAE for {width}x{height}")
+    return tiled
+
+# Fit steps and resolution into the time left before a request's deadline
+def plan_for_deadline(deadline, latency_key, width, height, num_images, batch_size, steps, strength=1.0):
+    """
+    Choose the step count and generation size that finish by the deadline,
+    based on the step latency measured on this node. A compiled UNet only
+    runs at its resolution buckets, so only those are considered then.
+    
+    Args:
+        deadline (float): Wall-clock time the result is due
+        latency_key (tuple): (device, pipeline type)
+        width (int): Preferred generation width
+        height (int): Preferred generation height
+        num_images (int): Images in the request
+        batch_size (int): Images per pipeline call
+        steps (int): Step count the request would use without a deadline
+        strength (float): img2img strength (1.0 for text-to-image)
         
-        # Enable model offloading if on CUDA to save VRAM
-        if device == "cuda":
-            IMG_TO_IMG_PIPELINE.enable_model_cpu_offload()
-            
-        return IMG_TO_IMG_PIPELINE
+    Returns:
+        dict: The plan (steps, width, height, predicted_seconds, measured)
+    """
+    batch = min(batch_size, num_images)
+    calls = -(-num_images // batch)
+    remaining = deadline - time.time()
+    sizes = smaller_buckets(width, height, latency_key[0]) if COMPILE_UNET else None
+    plan = LATENCY.plan(latency_key, remaining, width, height, batch, calls, steps, strength, sizes)
+    print(f"Deadline in {remaining:.1f}s: {plan['steps']} steps at {plan['width']}x{plan['height']} "
+          f"(predicted {plan['predicted_seconds']}s)")
+    return plan
+
+# Build the per-step callback for one pipeline call
+def make_call_callback(should_cancel, deadline, latency_key, width, height, batch, guidance_hook=None):
+    """
+    Combine cancellation, step timing, the deadline stop and guidance
+    truncation into one callback
     
-    # Return existing pipeline
-    return TEXT_TO_IMAGE_PIPELINE if pipeline_type == "text2img" else IMG_TO_IMG_PIPELINE
+    Args:
+        should_cancel (callable): Cancellation check, or None
+        deadline (float): Wall-clock deadline, or None
+        latency_key (tuple): (device, pipeline type)
+        width (int): Generation width
+        height (int): Generation height
+        batch (int): Images in this call
+        guidance_hook (callable): Hook from guidance_truncation_hook(), or None
+        
+    Returns:
+        tuple: (callback, StepTimer to finish() after the call,
+        deadline hook or None)
+    """
+    timer = StepTimer(LATENCY, latency_key, width, height, batch)
+    stop_hook = None
+    if deadline is not None:
+        # Stop while there is still time for one more step and the decode
+        finish_seconds = (LATENCY.step_seconds(latency_key, width, height, batch)
+                          + LATENCY.overhead_seconds(latency_key, width, height, batch))
+        stop_hook = deadline_hook(deadline, finish_seconds)
+    return make_step_callback(cancellation_hook(should_cancel), timer, stop_hook, guidance_hook), timer, stop_hook
 
 # Enhanced pixelation for better pixel art quality
 def pixelate_image(image, pixel_size=8):
@@ -173,8 +253,91 @@ def enhance_image_quality(image, enhancement_level=1.2, sharpness=1.3, contrast=
     
     return image
 
+# Expand a single or multi-image request into per-image prompts and seeds
+def expand_batch(prompt, num_images=1, seeds=None, prompts=None):
+    """
+    Resolve the per-image prompts and seeds for a (possibly) multi-image request
+    
+    Args:
+        prompt (str): Base prompt, used when no prompt list is given
+        num_images (int): Number of images requested
+        seeds (list): Optional list of seeds, one per image
+        prompts (list): Optional list of prompts, one per image
+        
+    Returns:
+        tuple: (list of prompts, list of seeds) of equal length
+    """
+    if prompts:
+        num_images = len(prompts)
+    elif seeds:
+        num_images = max(int(num_images or 1), len(seeds))
+    num_images = max(1, int(num_images or 1))
+    
+    prompt_list = list(prompts) if prompts else [prompt] * num_images
+    
+    if seeds:
+        seed_list = [int(seed) for seed in seeds]
+        # Pad a short seed list with consecutive seeds
+        while len(seed_list) < num_images:
+            seed_list.append(seed_list[-1] + 1)
+        seed_list = seed_list[:num_images]
+    else:
+        # Vary the seed for each image but keep them reproducible
+        base_seed = int(time.time()) % 10000
+        seed_list = [base_seed + i for i in range(num_images)]
+    
+    return prompt_list, seed_list
+
+# Post-processing applied to every text-to-image result
+def postprocess_generated_image(image, style=None, style_obj=None):
+    """
+    Apply style-specific post-processing to a generated image
+    
+    Args:
+        image (PIL.Image): Raw pipeline output
+        style (str): Requested style name
+        style_obj (BaseStyle): Resolved style instance, if any
+        
+    Returns:
+        PIL.Image: Post-processed image
+    """
+    if style == "pixel_art" or (style_obj and style_obj.name == "pixel_art"):
+        # Apply optimized pixel art processing
+        image = pixelate_image(image, pixel_size=10)  # Less pixelation for better detail
+        image = reduce_colors(image, num_colors=32)  # More colors for better detail
+        return enhance_image_quality(image, enhancement_level=1.4, contrast=1.3, saturation=1.4)
+    
+    # Apply enhanced image quality for all other styles
+    return enhance_image_quality(image, enhancement_level=1.3, sharpness=1.4, contrast=1.25, saturation=1.3)
+
+# Save an image to disk and return its base64 encoding
+def save_and_encode_image(image, output_path):
+    """
+    Save the image to output_path and encode it for a JSON response
+    
+    Args:
+        image (PIL.Image): Image to save
+        output_path (str): Destination file path, or None to only encode
+        
+    Returns:
+        str: Base64 encoded PNG
+    """
+    if output_path:
+        output_folder = os.path.dirname(output_path)
+        if output_folder and not os.path.exists(output_folder):
+            os.makedirs(output_folder)
+        
+        # Save with higher quality
+        image.save(output_path, quality=95, optimize=True)
+    
+    # Convert the image to base64 to send as a response
+    buffered = BytesIO()
+    image.save(buffered, format="PNG", quality=95, optimize=True)
+    return base64.b64encode(buffered.getvalue()).decode("utf-8")
+
 # Optimized function to generate image from prompt with improved quality
-def generate_image(prompt: str, width: int = 512, height: int = 512, style: str = None):
+def generate_image(prompt: str, width: int = 512, height: int = 512, style: str = None, seed: int = None,
+                   checkpoint: str = None):
     """
     Generate an image based on the provided prompt and style with enhanced quality.
     
@@ -183,22 +346,64 @@ def generate_image(prompt: str, width: int = 512, height: int = 512, style: str
         width (int): Width of the output image (default: 512)
         height (int): Height of the output image (default: 512)
         style (str): Optional style to apply (e.g., "ghibli", "anime", "realistic")
+        seed (int): Optional seed for reproducible output
+        checkpoint (str): Optional checkpoint name, defaults to MUSEMIND_CHECKPOINT
         
     Returns:
         str: Base64 encoded string of the generated image
     """
+    images = generate_images(prompt, width, height, style, seeds=[seed] if seed is not None else None,
+                             checkpoint=checkpoint)
+    return images[0] if images else None
+
+# Batched variant of generate_image - one pipeline call for several images
+def generate_images(prompt: str, width: int = 512, height: int = 512, style: str = None,
+                    num_images: int = 1, seeds: list = None, prompts: list = None, checkpoint: str = None,
+                    output_folder: str = "generated_images", deadline: float = None, should_cancel=None,
+                    degrade_level: int = 0):
+    """
+    Generate several images in as few batched pipeline calls as memory allows.
+    Identical prompts share a single text encoding. With MUSEMIND_WARM_START,
+    an unseeded single-prompt request whose prompt is close to an earlier
+    one in the same style and size is rendered as a short img2img pass
+    from that earlier result.
+    
+    Args:
+        prompt (str): The text prompt describing the images to generate
+        width (int): Width of the output images (default: 512)
+        height (int): Height of the output images (default: 512)
+        style (str): Optional style to apply (e.g., "ghibli", "anime", "realistic")
+        num_images (int): Number of images to generate (default: 1)
+        seeds (list): Optional list of seeds, one per image
+        prompts (list): Optional list of prompts, one per image (overrides prompt)
+        checkpoint (str): Optional checkpoint name, defaults to MUSEMIND_CHECKPOINT
+        output_folder (str): Where results are saved, or None to skip saving
+        deadline (float): Optional wall-clock time the result is due; steps
+            and resolution are chosen to meet it and the loop ends early
+            if it is about to pass
+        should_cancel (callable): Polled after every denoising step; the run
+            stops with JobCancelled once it returns True
+        degrade_level (int): Admission control level; above 0 the run uses
+            fewer steps and a lower resolution
+        
+    Returns:
+        list: Base64 encoded strings of the generated images, or None on error
+    """
     # Check if CUDA is available for GPU acceleration
-    device = "cuda" if torch.cuda.is_available() else "cpu"
+    device = inference_device()
     print(f"Using device: {device}")
+    peak_memory = PeakMemory(device).start()
     
     # Get or initialize the pipeline
-    pipe = initialize_pipeline("text2img", device)
+    pipe = initialize_pipeline("text2img", device, checkpoint)
     
     # Get style object if a style name is provided
     style_obj = get_style(style)
     
+    prompt_list, seed_list = expand_batch(prompt, num_images, seeds, prompts)
+    
     # Apply specific style to the prompt if provided
-    styled_prompt = prompt
+    styled_prompts = list(prompt_list)
     # Improved negative prompt with more specific terms for better quality
     negative_prompt = "low quality, blurry, distorted, deformed, disfigured, bad anatomy, ugly, amateur, watermark, signature, text, cropped, low resolution, draft"
     
@@ -208,20 +413,17 @@ def generate_image(prompt: str, width: int = 512, height: int = 512, style: str
     
     if style_obj:
         # Use the style object to format the prompt and get parameters
-        styled_prompt = style_obj.get_prompt(prompt)
+        styled_prompts = [style_obj.get_prompt(p) for p in prompt_list]
         negative_prompt = style_obj.negative_prompt
         inference_steps = max(style_obj.inference_steps, inference_steps)  # Use the higher value
         guidance_scale = style_obj.guidance_scale
         
         print(f"Using style: {style_obj.name}")
-        print(f"Using styled prompt: {styled_prompt}")
+        print(f"Using styled prompt: {styled_prompts[0]}")
     
-    # Generate the image with improved parameters
+    # Generate the images with improved parameters
     try:
-        print(f"Generating with: steps={inference_steps}, guidance={guidance_scale}, dimensions={width}x{height}")
-        
-        # Set seed for reproducibility but allow for variation
-        generator = torch.Generator(device=device).manual_seed(int(time.time()) % 10000)
+        print(f"Generating {len(styled_prompts)} image(s) with: steps={inference_steps}, guidance={guidance_scale}, dimensions={width}x{height}")
         
         # Better dimension handling for CPU
         if device == "cpu":
@@ -234,58 +436,147 @@ def generate_image(prompt: str, width: int = 512, height: int = 512, style: str
         else:
             gen_width, gen_height = width, height
         
-        result = pipe(
-            prompt=styled_prompt,
-            negative_prompt=negative_prompt,
-            width=gen_width,
-            height=gen_height,
-            num_inference_steps=inference_steps,
-            guidance_scale=guidance_scale,
-            generator=generator
-        )
-
-        # Check if result contains the 'images' attribute
-        if not hasattr(result, "images") or not result.images:
-            print("Error: No images generated.")
-            return None
+        # Shed work while the server is overloaded
+        if degrade_level:
+            inference_steps, gen_width, gen_height = degrade(degrade_level, inference_steps, gen_width, gen_height,
+                                                             device)
+            print(f"Degradation level {degrade_level}: {inference_steps} steps at {gen_width}x{gen_height}")
+        
+        latency_key = (device, "text2img")
+        plan = None
+        if deadline is not None:
+            plan = plan_for_deadline(deadline, latency_key, gen_width, gen_height, len(styled_prompts),
+                                     max_batch_size(gen_width, gen_height, device), inference_steps)
+            inference_steps, gen_width, gen_height = plan["steps"], plan["width"], plan["height"]
+        
+        # A compiled UNet only runs at fixed sizes; the output is fitted back afterwards
+        if COMPILE_UNET:
+            gen_width, gen_height = snap_to_bucket(gen_width, gen_height, device)
+            print(f"Using resolution bucket: {gen_width}x{gen_height}")
+        
+        # Cap the batch from the memory that is free right now
+        batch_size = max_batch_size(gen_width, gen_height, device)
+        print(f"Batch size: {batch_size}")
+        vae_tiled = configure_vae(pipe, gen_width, gen_height, min(batch_size, len(styled_prompts)))
+        cache_interval = feature_cache_interval(device, [style_obj])
+        
+        # Seeded requests are reproducible, so they always start from noise
+        embedding = warm_start = None
+        call_pipe, call_latency_key = pipe, latency_key
+        if WARM_START and not seeds and len(set(prompt_list)) == 1:
+            embedding = prompt_embedding(pipe, prompt_list[0], device)
+            bucket = warm_start_bucket(style_obj, gen_width, gen_height, checkpoint or DEFAULT_CHECKPOINT,
+                                       BACKEND.name)
+            warm_start = WARM_START_INDEX.lookup(bucket, embedding)
+            if warm_start:
+                print(f"Warm start from \"{warm_start['prompt']}\" (similarity {warm_start['similarity']:.3f})")
+                call_pipe, call_latency_key = initialize_pipeline("img2img", device, checkpoint), (device, "img2img")
+        
+        images = []
+        steps_run = []
+        cached_steps = 0
+        guidance_saved = 0
+        for start in range(0, len(styled_prompts), batch_size):
+            chunk_prompts = styled_prompts[start:start + batch_size]
+            chunk_seeds = seed_list[start:start + batch_size]
+            generators = [torch.Generator(device=device).manual_seed(s) for s in chunk_seeds]
             
-        image = result.images[0]  # Get the generated image
-        
-        # Resize back to requested dimensions if we scaled down
-        if device == "cpu" and (gen_width != width or gen_height != height):
-            image = image.resize((width, height), Image.LANCZOS)
-        
-        # Apply style-specific post-processing
-        if style == "pixel_art" or (style_obj and style_obj.name == "pixel_art"):
-            # Apply optimized pixel art processing
-            image = pixelate_image(image, pixel_size=10)  # Less pixelation for better detail
-            image = reduce_colors(image, num_colors=32)  # More colors for better detail
-            image = enhance_image_quality(image, enhancement_level=1.4, contrast=1.3, saturation=1.4)
-        else:
-            # Apply enhanced image quality for all other styles
-            image = enhance_image_quality(image, enhancement_level=1.3, sharpness=1.4, contrast=1.25, saturation=1.3)
-
-        # Specify the output folder and filename
-        output_folder = "generated_images"
-        if not os.path.exists(output_folder):
-            os.makedirs(output_folder)
-
-        # Generate a safe filename based on the prompt and timestamp
+            if len(set(chunk_prompts)) == 1:
+                # Encode the shared prompt once and repeat the embeddings
+                prompt_kwargs = {
+                    "prompt": chunk_prompts[0],
+                    "negative_prompt": negative_prompt,
+                    "num_images_per_prompt": len(chunk_prompts),
+                }
+            else:
+                prompt_kwargs = {
+                    "prompt": chunk_prompts,
+                    "negative_prompt": [negative_prompt] * len(chunk_prompts),
+                }
+            
+            # A warm start denoises the earlier result from part-way, running strength * steps
+            if warm_start:
+                size_kwargs = {"image": [warm_start["image"]] * len(chunk_prompts), "strength": WARM_START_STRENGTH}
+            else:
+                size_kwargs = {"width": gen_width, "height": gen_height}
+            
+            guidance = guidance_truncation_hook()
+            step_callback, timer, stop_hook = make_call_callback(
+                should_cancel, deadline, call_latency_key, gen_width, gen_height, len(chunk_prompts), guidance)
+            
+            with feature_cache(call_pipe.unet, cache_interval) as cache_state:
+                result = call_pipe(
+                    **prompt_kwargs,
+                    **size_kwargs,
+                    num_inference_steps=inference_steps,
+                    guidance_scale=guidance_scale,
+                    generator=generators,
+                    callback_on_step_end=step_callback,
+                    callback_on_step_end_tensor_inputs=CALLBACK_TENSOR_INPUTS
+                )
+            timer.finish()
+            cached_steps += cache_state.cached_steps if cache_state else 0
+            guidance_saved += guidance.saved if guidance else 0
+            steps_run.append(stop_hook.stopped_at if stop_hook and stop_hook.stopped_at else inference_steps)
+            
+            # Check if result contains the 'images' attribute
+            if not hasattr(result, "images") or not result.images:
+                print("Error: No images generated.")
+                return None
+            
+            images.extend(result.images)
+        
+        # Full-quality renders from noise become starting points for later prompts
+        if embedding is not None and not warm_start and not degrade_level and min(steps_run) >= inference_steps:
+            WARM_START_INDEX.add(bucket, prompt_list[0], embedding, images[0])
+        
+        # Specify the filename
         timestamp = int(time.time())
-        safe_prompt = "".join(c if c.isalnum() or c in [' ', '_'] else '_' for c in prompt[:20])
-        output_path = os.path.join(output_folder, f"{safe_prompt}_{timestamp}.png")
         
-        # Save with higher quality
-        image.save(output_path, quality=95, optimize=True)
-
-        # Convert the image to base64 to send as a response
-        buffered = BytesIO()
-        image.save(buffered, format="PNG", quality=95, optimize=True)
-        img_str = base64.b64encode(buffered.getvalue()).decode("utf-8")
-
-        print(f"Image successfully saved to {output_path}")
-        return img_str
+        encoded_images = []
+        for index, image in enumerate(images):
+            # Resize back to requested dimensions if we scaled down
+            if COMPILE_UNET:
+                image = fit_to_size(image, width, height)
+            elif gen_width != width or gen_height != height:
+                image = image.resize((width, height), Image.LANCZOS)
+            
+            # Apply style-specific post-processing
+            image = postprocess_generated_image(image, style, style_obj)
+            
+            # Generate a safe filename based on the prompt and timestamp
+            safe_prompt = "".join(c if c.isalnum() or c in [' ', '_'] else '_' for c in prompt_list[index][:20])
+            suffix = f"_{index}" if len(images) > 1 else ""
+            output_path = os.path.join(output_folder, f"{safe_prompt}_{timestamp}{suffix}.png") if output_folder else None
+            
+            encoded_images.append(save_and_encode_image(image, output_path))
+            if output_path:
+                print(f"Image successfully saved to {output_path}")
+        
+        info = dict(peak_memory.read(), vae_tiled=vae_tiled)
+        if degrade_level:
+            info["degradation"] = {"level": degrade_level, "steps": inference_steps,
+                                   "width": gen_width, "height": gen_height}
+        if cache_interval:
+            info["feature_cache"] = {"interval": cache_interval, "unet_evaluations_saved": cached_steps}
+        if GUIDANCE_STOP_FRACTION < 1:
+            info["guidance_truncation"] = {"stop_fraction": GUIDANCE_STOP_FRACTION,
+                                           "unet_evaluations_saved": guidance_saved}
+        if embedding is not None:
+            info["warm_start_hit"] = warm_start is not None
+        if warm_start:
+            info["warm_start"] = {"source_prompt": warm_start["prompt"],
+                                  "similarity": round(warm_start["similarity"], 4),
+                                  "strength": WARM_START_STRENGTH,
+                                  "steps": int(inference_steps * WARM_START_STRENGTH)}
+        if plan is not None:
+            info["deadline"] = dict(plan, width=gen_width, height=gen_height, steps_run=min(steps_run),
+                                    stopped_early=min(steps_run) < inference_steps)
+        print(f"Peak memory: {info['peak_rss_mb']} MB RSS")
+        return GenerationResult(encoded_images, info)
         
+    except JobCancelled:
+        raise
     except Exception as e:
         print(f"Error generating image: {str(e)}")
         import traceback
@@ -320,8 +611,229 @@ def resize_for_processing(image, device="cpu"):
     # No resize needed
     return image, 1.0
 
+
+# Model-free image processors for styles that set the direct_enhance flag,
+# keyed by style name. Flagged styles without an entry use enhance_image.
+DIRECT_PROCESSORS = {
+    "enhance": enhance_image,
+}
+
+def get_direct_processor(style_obj):
+    """
+    Return the model-free processor for a style, if it asks for one
+    
+    Args:
+        style_obj (BaseStyle): Resolved style instance, or None
+        
+    Returns:
+        callable: Function taking and returning a PIL.Image, or None if the
+        style should go through the diffusion model
+    """
+    if style_obj is None or not style_obj.is_direct():
+        return None
+    return DIRECT_PROCESSORS.get(style_obj.name, enhance_image)
+
+# Pre-process an upload before it goes through img2img
+def prepare_init_image(image, device="cpu", style_obj=None):
+    """
+    Pre-enhance an init image and resize it for the hardware
+    
+    Args:
+        image (PIL.Image): Decoded RGB upload
+        device (str): "cuda" or "cpu"
+        style_obj (BaseStyle): Resolved style instance, if any
+        
+    Returns:
+        PIL.Image: Image ready for processing
+        float: Scale factor used (for scaling back later)
+    """
+    # Pre-enhance the image slightly before processing for better results
+    image = ImageEnhance.Contrast(image).enhance(1.15)
+    image = ImageEnhance.Sharpness(image).enhance(1.15)
+    
+    # Resize image for processing if needed, with better quality preservation
+    image, scale_factor = resize_for_processing(image, device)
+    
+    # The init image sets the latent size, so snap it for a compiled UNet
+    if COMPILE_UNET and not is_pixel_art(None, style_obj):
+        image = fit_to_size(image, *snap_to_bucket(image.width, image.height, device))
+    return image, scale_factor
+
+def is_pixel_art(style=None, style_obj=None):
+    """Return True if the request asks for the PIL-only pixel art style"""
+    return style == "pixel_art" or (style_obj is not None and style_obj.name == "pixel_art")
+
+# Pixel art restyling - purely PIL operations for better performance
+def pixel_art_image(init_image):
+    """
+    Turn an image into pixel art without the diffusion model
+    
+    Args:
+        init_image (PIL.Image): Pre-processed input image
+        
+    Returns:
+        PIL.Image: Pixel art image
+    """
+    # Start with enhancing the source image
+    enhanced_image = enhance_image_quality(init_image, enhancement_level=1.3, 
+                                         contrast=1.3, saturation=1.4)
+    
+    # Apply improved pixel art transformation
+    # First sharpen details
+    enhanced_image = enhanced_image.filter(ImageFilter.SHARPEN)
+    
+    # Then pixelate with better parameters
+    pixelated_image = pixelate_image(enhanced_image, pixel_size=10)
+    
+    # Use better color reduction with dithering for smoother transitions
+    final_image = reduce_colors(pixelated_image, num_colors=32)
+    
+    # Final touch-ups
+    return enhance_image_quality(final_image, enhancement_level=1.4,
+                                 contrast=1.3, saturation=1.4)
+
+# Sampling parameters for img2img, from the style when one is given
+def img2img_settings(style_obj=None, device="cpu"):
+    """
+    Return the img2img sampling parameters for a style
+    
+    Args:
+        style_obj (BaseStyle): Resolved style instance, if any
+        device (str): "cuda" or "cpu"
+        
+    Returns:
+        tuple: (negative prompt, inference steps, guidance scale, strength)
+    """
+    # Improved parameters for img2img
+    negative_prompt = "low quality, blurry, distorted, deformed, disfigured, bad anatomy, ugly, watermark, signature, text"
+    # Higher steps for better quality
+    inference_steps = 40 if device == "cuda" else 30
+    guidance_scale = 8.0
+    strength = 0.70  # Higher strength for more transformation
+    
+    if style_obj:
+        negative_prompt = style_obj.negative_prompt
+        inference_steps = max(style_obj.inference_steps, inference_steps)
+        guidance_scale = style_obj.guidance_scale
+        strength = style_obj.img2img_strength
+    
+    return negative_prompt, inference_steps, guidance_scale, strength
+
+def img2img_prompt(image_prompt=None, style_obj=None, instructions=None):
+    """Build the img2img prompt from the user's prompt, the style and any instructions"""
+    styled_prompt = image_prompt if image_prompt else "This image"
+    
+    # Get parameters from style object if available
+    if style_obj:
+        styled_prompt = style_obj.get_prompt(image_prompt if image_prompt else "This image")
+    
+    # Additional instructions if provided
+    if instructions:
+        styled_prompt += f", {instructions}"
+    
+    return styled_prompt
+
+def img2img_result_key(image_hash, style_obj, image_prompt, instructions, negative_prompt, strength, steps,
+                       guidance_scale, seed, size, device, checkpoint=None, cache_interval=0):
+    """Build the result cache key of one img2img output"""
+    # The backend, token merging, feature caching and guidance truncation all change the pixels
+    merge_ratio = TOKEN_MERGE_RATIOS.get(device, 0.0) if TOKEN_MERGING and not COMPILE_UNET else 0.0
+    return result_key(image_hash, style_obj.get_style_info() if style_obj else None, image_prompt, instructions,
+                      strength, steps, seed, checkpoint=checkpoint or DEFAULT_CHECKPOINT,
+                      negative_prompt=negative_prompt, guidance=guidance_scale, size=size, device=device,
+                      token_merge_ratio=merge_ratio, feature_cache_interval=cache_interval,
+                      guidance_stop_fraction=min(GUIDANCE_STOP_FRACTION, 1.0), backend=BACKEND.name)
+
+def restore_size(image, original_size):
+    """Scale a result back to the upload's size, undoing any resize or bucketing"""
+    if image.size == original_size:
+        return image
+    if COMPILE_UNET:
+        return fit_to_size(image, *original_size)
+    return image.resize(original_size, Image.LANCZOS)
+
+def postprocess_styled_image(styled_image):
+    """Apply the enhanced post-processing used for every img2img result"""
+    return enhance_image_quality(
+        styled_image, 
+        enhancement_level=1.3, 
+        sharpness=1.4, 
+        contrast=1.25, 
+        saturation=1.3
+    )
+
+# Style several different images in one img2img call
+def style_image_batch(init_images, style: str = None, instructions: str = None, prompt: str = None,
+                      seeds: list = None, checkpoint: str = None, postprocess: bool = True, should_cancel=None):
+    """
+    Apply one style to a batch of different images. The images must have
+    been through prepare_init_image and share the same size.
+    
+    Args:
+        init_images (list): Pre-processed PIL images of equal size
+        style (str): Style to apply (e.g., "ghibli", "anime", "realistic")
+        instructions (str): Additional instructions for image processing
+        prompt (str): Additional prompt to guide the style transfer
+        seeds (list): Optional list of seeds, one per image
+        checkpoint (str): Optional checkpoint name, defaults to MUSEMIND_CHECKPOINT
+        postprocess (bool): Apply postprocess_styled_image to img2img results
+            (callers may run it themselves, off the inference thread)
+        should_cancel (callable): Polled after every denoising step
+        
+    Returns:
+        list: Styled PIL images at the processing size, in input order
+    """
+    device = inference_device()
+    style_obj = get_style(style)
+    
+    direct_processor = get_direct_processor(style_obj)
+    if direct_processor is not None:
+        return [direct_processor(image) for image in init_images]
+    if is_pixel_art(style, style_obj):
+        return [pixel_art_image(image) for image in init_images]
+    
+    if len({image.size for image in init_images}) > 1:
+        raise ValueError("All images in a batch must have the same size")
+    
+    pipe = initialize_pipeline("img2img", device, checkpoint)
+    negative_prompt, inference_steps, guidance_scale, strength = img2img_settings(style_obj, device)
+    styled_prompt = img2img_prompt(prompt, style_obj, instructions)
+    _, seed_list = expand_batch(prompt, len(init_images), seeds)
+    
+    width, height = init_images[0].size
+    configure_vae(pipe, width, height, len(init_images))
+    
+    # Every image shares the prompt, so encode it once for the whole batch
+    prompt_embeds, negative_prompt_embeds = pipe.encode_prompt(
+        styled_prompt,
+        device,
+        num_images_per_prompt=len(init_images),
+        do_classifier_free_guidance=guidance_scale > 1,
+        negative_prompt=negative_prompt,
+    )
+    
+    step_callback, timer, _ = make_call_callback(should_cancel, None, (device, "img2img"),
+                                                 width, height, len(init_images), guidance_truncation_hook())
+    with feature_cache(pipe.unet, feature_cache_interval(device, [style_obj])):
+        result = pipe(
+            prompt_embeds=prompt_embeds,
+            negative_prompt_embeds=negative_prompt_embeds,
+            image=list(init_images),
+            strength=strength,
+            guidance_scale=guidance_scale,
+            num_inference_steps=inference_steps,
+            generator=[torch.Generator(device=device).manual_seed(s) for s in seed_list],
+            callback_on_step_end=step_callback,
+            callback_on_step_end_tensor_inputs=CALLBACK_TENSOR_INPUTS
+        )
+    timer.finish()
+    if not postprocess:
+        return list(result.images)
+    return [postprocess_styled_image(image) for image in result.images]
+
 # Optimized style application function with improved quality
-def apply_style_to_image(image_path: str, style: str = None, instructions: str = None, prompt: str = None):
+def apply_style_to_image(image_path: str, style: str = None, instructions: str = None, prompt: str = None,
+                         seed: int = None, checkpoint: str = None):
     """
     Apply a specific style to an uploaded image with enhanced quality.
     
@@ -330,14 +842,60 @@ def apply_style_to_image(image_path: str, style: str = None, instructions: str =
         style (str): Style to apply (e.g., "ghibli", "anime", "realistic")
         instructions (str): Additional instructions for image processing
         prompt (str): Additional prompt to guide the style transfer
+        seed (int): Optional seed for reproducible output
+        checkpoint (str): Optional checkpoint name, defaults to MUSEMIND_CHECKPOINT
         
     Returns:
         str: Base64 encoded string of the styled image
     """
+    images = apply_style_to_images(image_path, style, instructions, prompt,
+                                   seeds=[seed] if seed is not None else None, checkpoint=checkpoint)
+    return images[0] if images else None
+
+# Batched variant of apply_style_to_image - several variations of one upload
+def apply_style_to_images(image_path: str, style: str = None, instructions: str = None, prompt: str = None,
+                          num_images: int = 1, seeds: list = None, prompts: list = None, checkpoint: str = None,
+                          output_folder: str = "generated_images", deadline: float = None, should_cancel=None,
+                          degrade_level: int = 0):
+    """
+    Apply a style to an uploaded image, producing one or more variations
+    in as few batched img2img calls as memory allows.
+    
+    Args:
+        image_path (str): Path to the uploaded image
+        style (str): Style to apply (e.g., "ghibli", "anime", "realistic")
+        instructions (str): Additional instructions for image processing
+        prompt (str): Additional prompt to guide the style transfer
+        num_images (int): Number of variations to produce (default: 1)
+        seeds (list): Optional list of seeds, one per image
+        prompts (list): Optional list of prompts, one per image (overrides prompt)
+        checkpoint (str): Optional checkpoint name, defaults to MUSEMIND_CHECKPOINT
+        output_folder (str): Where results are saved, or None to skip saving
+        deadline (float): Optional wall-clock time the result is due; steps
+            and processing size are chosen to meet it and the loop ends
+            early if it is about to pass
+        should_cancel (callable): Polled after every denoising step; the run
+            stops with JobCancelled once it returns True
+        degrade_level (int): Admission control level; above 0 the run uses
+            fewer steps and a smaller processing size
+        
+    Returns:
+        list: Base64 encoded strings of the styled images, or None on error
+    """
     # Check if CUDA is available for GPU acceleration
-    device = "cuda" if torch.cuda.is_available() else "cpu"
+    device = inference_device()
     print(f"Using device: {device}")
     print(f"Applying style: {style}")
+    peak_memory = PeakMemory(device).start()
+    vae_tiled = False
+    plan = None
+    cache_keys = []
+    cached_images = {}
+    store_keys = set()
+    latents_cached = None
+    cache_interval = 0
+    cached_steps = 0
+    guidance_saved = 0
     
     try:
         # Check if the file exists
@@ -347,129 +905,378 @@ def apply_style_to_image(image_path: str, style: str = None, instructions: str =
         
         # Load the uploaded image
         init_image = Image.open(image_path).convert("RGB")
+        original_size = init_image.size
         
         # Print image details for debugging
         print(f"Original image size: {init_image.width}x{init_image.height}")
         
-        # Pre-enhance the image slightly before processing for better results
-        init_image = ImageEnhance.Contrast(init_image).enhance(1.15)
-        init_image = ImageEnhance.Sharpness(init_image).enhance(1.15)
-        
-        # Resize image for processing if needed, with better quality preservation
-        init_image, scale_factor = resize_for_processing(init_image, device)
-        print(f"Processing at size: {init_image.width}x{init_image.height}")
-        
         # Get style object if a style name is provided
         style_obj = get_style(style)
         
-        # Special handling for pixel art style - purely PIL operations for better performance
-        if style == "pixel_art" or (style_obj and style_obj.name == "pixel_art"):
-            print("Applying pixel art style with specialized processing")
-            
-            # Start with enhancing the source image
-            enhanced_image = enhance_image_quality(init_image, enhancement_level=1.3, 
-                                                 contrast=1.3, saturation=1.4)
-            
-            # Apply improved pixel art transformation
-            # First sharpen details
-            enhanced_image = enhanced_image.filter(ImageFilter.SHARPEN)
+        prompt_list, seed_list = expand_batch(prompt, num_images, seeds, prompts)
+        
+        # Styles flagged with direct_enhance skip the diffusion model entirely
+        direct_processor = get_direct_processor(style_obj)
+        
+        if direct_processor is None:
+            init_image, scale_factor = prepare_init_image(init_image, device, style_obj)
+            print(f"Processing at size: {init_image.width}x{init_image.height}")
+        else:
+            # Direct processing is cheap enough to run at full resolution
+            scale_factor = 1.0
+        
+        if direct_processor is not None:
+            print(f"Applying {style_obj.name} directly without the diffusion model")
             
-            # Then pixelate with better parameters
-            pixelated_image = pixelate_image(enhanced_image, pixel_size=10)
+            # Deterministic, so every variation is the same image
+            final_images = [direct_processor(init_image)]
             
-            # Use better color reduction with dithering for smoother transitions
-            final_image = reduce_colors(pixelated_image, num_colors=32)
+        # Special handling for pixel art style - purely PIL operations for better performance
+        elif is_pixel_art(style, style_obj):
+            print("Applying pixel art style with specialized processing")
             
-            # Final touch-ups
-            final_image = enhance_image_quality(final_image, enhancement_level=1.4,
-                                               contrast=1.3, saturation=1.4)
+            # Pixel art is deterministic, so every variation is the same image
+            final_images = [pixel_art_image(init_image)]
             
         else:
-            # Only load the img2img pipeline if we need it
-            img2img_pipeline = initialize_pipeline("img2img", device)
+            negative_prompt, inference_steps, guidance_scale, strength = img2img_settings(style_obj, device)
+            styled_prompts = [img2img_prompt(image_prompt, style_obj, instructions) for image_prompt in prompt_list]
+            cache_interval = feature_cache_interval(device, [style_obj])
             
-            # Improved parameters for img2img
-            styled_prompt = prompt if prompt else "This image"
-            negative_prompt = "low quality, blurry, distorted, deformed, disfigured, bad anatomy, ugly, watermark, signature, text"
-            # Higher steps for better quality
-            inference_steps = 40 if device == "cuda" else 30
-            guidance_scale = 8.0
-            strength = 0.70  # Higher strength for more transformation
+            # Earlier runs with identical inputs are returned without diffusion
+            image_hash = content_hash(image_path)
+            cache_keys = [
+                img2img_result_key(image_hash, style_obj, image_prompt, instructions, negative_prompt, strength,
+                                   inference_steps, guidance_scale, seed, init_image.size, device, checkpoint,
+                                   cache_interval)
+                for image_prompt, seed in zip(prompt_list, seed_list)
+            ]
+            for index, key in enumerate(cache_keys):
+                cached_image = RESULT_CACHE.get_image(key)
+                if cached_image is not None:
+                    cached_images[index] = cached_image
+            to_render = [index for index in range(len(styled_prompts)) if index not in cached_images]
+            print(f"Result cache: {len(cached_images)}/{len(cache_keys)} hits")
             
-            # Get parameters from style object if available
-            if style_obj:
-                if prompt:
-                    styled_prompt = style_obj.get_prompt(prompt)
-                else:
-                    styled_prompt = style_obj.get_prompt("This image")
-                    
-                negative_prompt = style_obj.negative_prompt
-                inference_steps = max(style_obj.inference_steps, inference_steps)
-                guidance_scale = style_obj.guidance_scale
-                strength = style_obj.img2img_strength
+            rendered_images = []
+            steps_run = [0]
+            if to_render:
+                # Only load the img2img pipeline if we need it
+                img2img_pipeline = initialize_pipeline("img2img", device, checkpoint)
+                render_prompts = [styled_prompts[index] for index in to_render]
+                render_seeds = [seed_list[index] for index in to_render]
                 
-            # Additional instructions if provided
-            if instructions:
-                styled_prompt += f", {instructions}"
+                # Shed work while the server is overloaded
+                if degrade_level:
+                    # Under compilation this is a smaller bucket of the same shape
+                    inference_steps, degraded_width, degraded_height = degrade(
+                        degrade_level, inference_steps, init_image.width, init_image.height, device)
+                    print(f"Degradation level {degrade_level}: {inference_steps} steps at "
+                          f"{degraded_width}x{degraded_height}")
+                    if (degraded_width, degraded_height) != init_image.size:
+                        scale_factor *= degraded_width / init_image.width
+                        init_image = init_image.resize((degraded_width, degraded_height), Image.LANCZOS)
                 
-            print(f"Using img2img with prompt: {styled_prompt}")
-            print(f"Using negative prompt: {negative_prompt}")
-            print(f"Using inference steps: {inference_steps}")
-            print(f"Using strength: {strength}")
+                latency_key = (device, "img2img")
+                if deadline is not None:
+                    plan = plan_for_deadline(deadline, latency_key, init_image.width, init_image.height,
+                                             len(render_prompts), max_batch_size(init_image.width, init_image.height, device),
+                                             inference_steps, strength)
+                    inference_steps = plan["steps"]
+                    if (plan["width"], plan["height"]) != init_image.size:
+                        scale_factor *= plan["width"] / init_image.width
+                        init_image = init_image.resize((plan["width"], plan["height"]), Image.LANCZOS)
             
-            # Apply img2img transformation with enhanced parameters
-            result = img2img_pipeline(
-                prompt=styled_prompt,
-                negative_prompt=negative_prompt,
-                image=init_image,
-                strength=strength,
-                guidance_scale=guidance_scale,
-                num_inference_steps=inference_steps,
-                generator=torch.Generator(device=device).manual_seed(int(time.time()) % 10000)
-            )
+                print(f"Using img2img with prompt: {render_prompts[0]}")
+                print(f"Using negative prompt: {negative_prompt}")
+                print(f"Using inference steps: {inference_steps}")
+                print(f"Using strength: {strength}")
             
-            final_image = result.images[0]
+                # Cap the batch from the memory that is free right now
+                batch_size = max_batch_size(init_image.width, init_image.height, device)
+                print(f"Batch size: {batch_size}")
+                vae_tiled = configure_vae(img2img_pipeline, init_image.width, init_image.height,
+                                          min(batch_size, len(render_prompts)))
+                
+                # Every variation (and every later style tried on this upload) samples
+                # from the same encoded image
+                posterior, latents_cached = encode_init_latents(img2img_pipeline, init_image,
+                                                                checkpoint or DEFAULT_CHECKPOINT)
             
-            # Apply enhanced post-processing
-            final_image = enhance_image_quality(
-                final_image, 
-                enhancement_level=1.3, 
-                sharpness=1.4, 
-                contrast=1.25, 
-                saturation=1.3
-            )
-        
-        # Scale back to original size if we resized earlier, with high quality
-        if scale_factor < 1.0:
-            original_width, original_height = Image.open(image_path).size
-            final_image = final_image.resize((original_width, original_height), Image.LANCZOS)
+                # img2img only runs the last `strength` fraction of the schedule
+                steps_run = [int(inference_steps * strength)]
+                for start in range(0, len(render_prompts), batch_size):
+                    chunk_prompts = render_prompts[start:start + batch_size]
+                    chunk_seeds = render_seeds[start:start + batch_size]
+                    generators = [torch.Generator(device=device).manual_seed(s) for s in chunk_seeds]
+                
+                    if len(set(chunk_prompts)) == 1:
+                        # Encode the shared prompt once and repeat the embeddings
+                        prompt_kwargs = {
+                            "prompt": chunk_prompts[0],
+                            "negative_prompt": negative_prompt,
+                            "num_images_per_prompt": len(chunk_prompts),
+                        }
+                    else:
+                        prompt_kwargs = {
+                            "prompt": chunk_prompts,
+                            "negative_prompt": [negative_prompt] * len(chunk_prompts),
+                        }
+                
+                    guidance = guidance_truncation_hook()
+                    step_callback, timer, stop_hook = make_call_callback(
+                        should_cancel, deadline, latency_key, init_image.width, init_image.height, len(chunk_prompts),
+                        guidance)
+                
+                    # Apply img2img transformation with enhanced parameters
+                    with feature_cache(img2img_pipeline.unet, cache_interval) as cache_state:
+                        result = img2img_pipeline(
+                            **prompt_kwargs,
+                            image=(sample_init_latents(img2img_pipeline, posterior, generators)
+                                   if posterior is not None else init_image),
+                            strength=strength,
+                            guidance_scale=guidance_scale,
+                            num_inference_steps=inference_steps,
+                            generator=generators,
+                            callback_on_step_end=step_callback,
+                            callback_on_step_end_tensor_inputs=CALLBACK_TENSOR_INPUTS
+                        )
+                    timer.finish()
+                    cached_steps += cache_state.cached_steps if cache_state else 0
+                    guidance_saved += guidance.saved if guidance else 0
+                    if stop_hook and stop_hook.stopped_at:
+                        steps_run.append(stop_hook.stopped_at)
+                
+                    # Apply enhanced post-processing
+                    rendered_images.extend(postprocess_styled_image(styled_image) for styled_image in result.images)
+                
+                # Results degraded to meet a deadline or shed load are not worth keeping
+                if plan is None and not degrade_level:
+                    store_keys.update(cache_keys[index] for index in to_render)
+            
+            rendered = iter(rendered_images)
+            final_images = [cached_images[index] if index in cached_images else next(rendered)
+                            for index in range(len(styled_prompts))]
         
         # Save the result with higher quality settings
-        output_folder = "generated_images"
-        if not os.path.exists(output_folder):
-            os.makedirs(output_folder)
-            
-        # Generate a safe filename
         timestamp = int(time.time())
         style_name = style if style else "styled"
-        output_path = os.path.join(output_folder, f"{style_name}_image_{timestamp}.png")
-        final_image.save(output_path, quality=95, optimize=True)
         
-        # Convert to base64 for response
-        buffered = BytesIO()
-        final_image.save(buffered, format="PNG", quality=95, optimize=True)
-        img_str = base64.b64encode(buffered.getvalue()).decode("utf-8")
+        encoded_images = []
+        for index, final_image in enumerate(final_images):
+            # Scale back to original size if we resized or bucketed earlier, with high quality
+            final_image = restore_size(final_image, original_size)
+            
+            # Generate a safe filename
+            suffix = f"_{index}" if len(final_images) > 1 else ""
+            output_path = os.path.join(output_folder, f"{style_name}_image_{timestamp}{suffix}.png") if output_folder else None
+            encoded_images.append(save_and_encode_image(final_image, output_path))
+            
+            if index < len(cache_keys) and cache_keys[index] in store_keys:
+                RESULT_CACHE.put(cache_keys[index], base64.b64decode(encoded_images[-1]))
+            
+            if output_path:
+                print(f"Styled image saved to {output_path}")
         
-        print(f"Styled image saved to {output_path}")
+        # Pad deterministic results up to the requested count
+        while len(encoded_images) < len(prompt_list):
+            encoded_images.append(encoded_images[-1])
         
         # Clear GPU memory if available
         if device == "cuda":
             torch.cuda.empty_cache()
-            
-        return img_str
         
+        info = dict(peak_memory.read(), vae_tiled=vae_tiled)
+        if cache_keys:
+            info["cache_hits"] = len(cached_images)
+            info["cache_lookups"] = len(cache_keys)
+        if latents_cached is not None:
+            info["latent_cache_hit"] = latents_cached
+        if degrade_level and latents_cached is not None:
+            info["degradation"] = {"level": degrade_level, "steps": inference_steps,
+                                   "width": init_image.width, "height": init_image.height}
+        if cache_interval:
+            info["feature_cache"] = {"interval": cache_interval, "unet_evaluations_saved": cached_steps}
+        if cache_keys and GUIDANCE_STOP_FRACTION < 1:
+            info["guidance_truncation"] = {"stop_fraction": GUIDANCE_STOP_FRACTION,
+                                           "unet_evaluations_saved": guidance_saved}
+        if plan is not None:
+            info["deadline"] = dict(plan, width=init_image.width, height=init_image.height, steps_run=min(steps_run),
+                                    stopped_early=min(steps_run) < steps_run[0])
+        print(f"Peak memory: {info['peak_rss_mb']} MB RSS")
+        return GenerationResult(encoded_images, info)
+        
+    except JobCancelled:
+        raise
     except Exception as e:
         print(f"Error applying style to image: {str(e)}")
         import traceback
         traceback.print_exc()
-        return None
\ No newline at end of file
+        return None
+
+# Several styles of one upload in shared img2img calls - one group of the fan-out endpoint
+def apply_styles_to_image(image_path: str, styles: list, instructions: str = None, prompt: str = None,
+                          seed: int = None, checkpoint: str = None, output_folder: str = None, should_cancel=None,
+                          degrade_level: int = 0):
+    """
+    Render one upload in several diffusion styles with batched img2img
+    calls. The image is pre-processed and VAE-encoded once; each batch
+    entry carries its own style prompt and negative prompt, while the
+    group shares one strength, step count and guidance scale (the mean
+    strength and guidance and the largest step count of its styles).
+    
+    Args:
+        image_path (str): Path to the uploaded image
+        styles (list): Style names, as grouped by backend.fanout.group_styles
+        instructions (str): Additional instructions for image processing
+        prompt (str): Additional prompt to guide the style transfer
+        seed (int): Seed shared by every style, so results are comparable
+        checkpoint (str): Optional checkpoint name, defaults to MUSEMIND_CHECKPOINT
+        output_folder (str): Where results are saved, or None to skip saving
+        should_cancel (callable): Polled after every denoising step; the run
+            stops with JobCancelled once it returns True
+        degrade_level (int): Admission control level; above 0 the group
+            uses fewer steps and a smaller processing size
+        
+    Returns:
+        list: Base64 encoded strings of the styled images, in style order,
+        or None on error
+    """
+    device = inference_device()
+    print(f"Applying styles {', '.join(styles)} in one group")
+    peak_memory = PeakMemory(device).start()
+    
+    try:
+        if not os.path.isfile(image_path):
+            print(f"Error: Image file not found: {image_path}")
+            return None
+        
+        init_image = Image.open(image_path).convert("RGB")
+        original_size = init_image.size
+        style_objs = [get_style(style) for style in styles]
+        if seed is None:
+            seed = int(time.time()) % 10000
+        
+        init_image, _ = prepare_init_image(init_image, device, style_objs[0])
+        
+        settings = [img2img_settings(style_obj, device) for style_obj in style_objs]
+        negative_prompts = [negative_prompt for negative_prompt, _, _, _ in settings]
+        inference_steps = max(steps for _, steps, _, _ in settings)
+        guidance_scale = round(sum(guidance for _, _, guidance, _ in settings) / len(settings), 2)
+        strength = round(sum(style_strength for _, _, _, style_strength in settings) / len(settings), 2)
+        styled_prompts = [img2img_prompt(prompt, style_obj, instructions) for style_obj in style_objs]
+        print(f"Group settings: {inference_steps} steps, strength {strength}, guidance {guidance_scale}")
+        cache_interval = feature_cache_interval(device, style_objs)
+        
+        image_hash = content_hash(image_path)
+        cache_keys = [
+            img2img_result_key(image_hash, style_obj, prompt, instructions, negative_prompt, strength,
+                               inference_steps, guidance_scale, seed, init_image.size, device, checkpoint,
+                               cache_interval)
+            for style_obj, negative_prompt in zip(style_objs, negative_prompts)
+        ]
+        final_images = [RESULT_CACHE.get_image(key) for key in cache_keys]
+        to_render = [index for index, image in enumerate(final_images) if image is None]
+        cache_hits = len(cache_keys) - len(to_render)
+        
+        vae_tiled = False
+        latents_cached = None
+        cached_steps = 0
+        guidance_saved = 0
+        if to_render:
+            # Shed work while the server is overloaded
+            if degrade_level:
+                # Under compilation this is a smaller bucket of the same shape
+                inference_steps, degraded_width, degraded_height = degrade(
+                    degrade_level, inference_steps, init_image.width, init_image.height, device)
+                if (degraded_width, degraded_height) != init_image.size:
+                    init_image = init_image.resize((degraded_width, degraded_height), Image.LANCZOS)
+            
+            pipe = initialize_pipeline("img2img", device, checkpoint)
+            batch_size = max_batch_size(init_image.width, init_image.height, device)
+            vae_tiled = configure_vae(pipe, init_image.width, init_image.height, min(batch_size, len(to_render)))
+            posterior, latents_cached = encode_init_latents(pipe, init_image, checkpoint or DEFAULT_CHECKPOINT)
+            latency_key = (device, "img2img")
+            
+            for start in range(0, len(to_render), batch_size):
+                chunk = to_render[start:start + batch_size]
+                # The same seed per style gives every style the same starting noise
+                generators = [torch.Generator(device=device).manual_seed(seed) for _ in chunk]
+                guidance = guidance_truncation_hook()
+                step_callback, timer, _ = make_call_callback(should_cancel, None, latency_key, init_image.width,
+                                                             init_image.height, len(chunk), guidance)
+                
+                with feature_cache(pipe.unet, cache_interval) as cache_state:
+                    result = pipe(
+                        prompt=[styled_prompts[index] for index in chunk],
+                        negative_prompt=[negative_prompts[index] for index in chunk],
+                        image=(sample_init_latents(pipe, posterior, generators)
+                               if posterior is not None else init_image),
+                        strength=strength,
+                        guidance_scale=guidance_scale,
+                        num_inference_steps=inference_steps,
+                        generator=generators,
+                        callback_on_step_end=step_callback,
+                        callback_on_step_end_tensor_inputs=CALLBACK_TENSOR_INPUTS
+                    )
+                timer.finish()
+                cached_steps += cache_state.cached_steps if cache_state else 0
+                guidance_saved += guidance.saved if guidance else 0
+                
+                for index, styled_image in zip(chunk, result.images):
+                    final_images[index] = restore_size(postprocess_styled_image(styled_image), original_size)
+        
+        timestamp = int(time.time())
+        encoded_images = []
+        for index, (style, final_image) in enumerate(zip(styles, final_images)):
+            output_path = os.path.join(output_folder, f"{style}_image_{timestamp}.png") if output_folder else None
+            encoded_images.append(save_and_encode_image(final_image, output_path))
+            if index in to_render and not degrade_level:
+                RESULT_CACHE.put(cache_keys[index], base64.b64decode(encoded_images[-1]))
+        
+        if device == "cuda":
+            torch.cuda.empty_cache()
+        
+        info = dict(peak_memory.read(), vae_tiled=vae_tiled, styles=list(styles), seed=seed,
+                    group={"steps": inference_steps, "strength": strength, "guidance_scale": guidance_scale},
+                    cache_hits=cache_hits, cache_lookups=len(cache_keys))
+        if latents_cached is not None:
+            info["latent_cache_hit"] = latents_cached
+        if degrade_level and to_render:
+            info["degradation"] = {"level": degrade_level, "steps": inference_steps,
+                                   "width": init_image.width, "height": init_image.height}
+        if cache_interval:
+            info["feature_cache"] = {"interval": cache_interval, "unet_evaluations_saved": cached_steps}
+        if GUIDANCE_STOP_FRACTION < 1:
+            info["guidance_truncation"] = {"stop_fraction": GUIDANCE_STOP_FRACTION,
+                                           "unet_evaluations_saved": guidance_saved}
+        return GenerationResult(encoded_images, info)
+        
+    except JobCancelled:
+        raise
+    except Exception as e:
+        print(f"Error applying styles to image: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return None
+
+# Generation functions that may run under the profiler
+PROFILABLE_FUNCTIONS = {"generate_images", "apply_style_to_images", "apply_styles_to_image"}
+
+# Profiled variant of a generation function, for sampled requests
+def run_profiled(profile_id: str, func_name: str, *args, **kwargs):
+    """
+    Run a generation function under cProfile and the torch profiler
+    
+    Args:
+        profile_id (str): Id naming the profile's artifact directory
+        func_name (str): One of PROFILABLE_FUNCTIONS
+        *args: Positional arguments for the function
+        **kwargs: Keyword arguments for the function (including should_cancel)
+        
+    Returns:
+        The function's result, with the profile details in its info
+    """
+    if func_name not in PROFILABLE_FUNCTIONS:
+        raise ValueError(f"Cannot profile {func_name}")
+    return profile_call(profile_id, globals()[func_name], *args, **kwargs)
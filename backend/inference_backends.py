@@ -0,0 +1,255 @@
+import fcntl
+import json
+import os
+import shutil
+import time
+import torch
+from diffusers import StableDiffusionPipeline, DPMSolverMultistepScheduler, StableDiffusionImg2ImgPipeline
+from .weights import load_pipeline_mmap
+from .compiled_unet import COMPILE_UNET, compile_unet
+from .token_merge import TOKEN_MERGING, TOKEN_MERGE_RATIOS, install_token_merging
+
+# Inference backend of this deployment: "torch" (diffusers on PyTorch) or
+# "onnx" (ONNX Runtime on CPU, needs optimum[onnxruntime])
+INFERENCE_BACKEND = os.environ.get("MUSEMIND_BACKEND", "torch")
+
+# Where ONNX exports of the checkpoints are kept, one directory per checkpoint
+ONNX_CACHE_DIR = os.environ.get("MUSEMIND_ONNX_CACHE_DIR", "./onnx_cache")
+
+# Map safetensors weights instead of copying them into process memory (CPU only)
+MMAP_WEIGHTS = os.environ.get("MUSEMIND_MMAP_WEIGHTS", "1") == "1"
+
+PIPELINE_CLASSES = {
+    "text2img": StableDiffusionPipeline,
+    "img2img": StableDiffusionImg2ImgPipeline,
+}
+
+PRECISIONS = {
+    "fp32": torch.float32,
+    "fp16": torch.float16,
+    "bf16": torch.bfloat16,
+}
+
+WEIGHT_EXTENSIONS = (".safetensors", ".bin", ".ckpt", ".pt")
+
+
+def use_dpm_solver(pipe):
+    """Give a pipeline its own DPM++ scheduler, since schedulers keep per-run state"""
+    pipe.scheduler = DPMSolverMultistepScheduler.from_config(
+        pipe.scheduler.config,
+        use_karras_sigmas=True,  # Better quality sigmas
+        algorithm_type="dpmsolver++",  # Better algorithm
+    )
+
+
+def module_bytes(module):
+    """Return the memory held by a module's parameters and buffers"""
+    tensors = list(module.parameters()) + list(module.buffers())
+    return sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+
+
+def checkpoint_signature(checkpoint_path):
+    """Return the size and modification time of every weight file in a checkpoint"""
+    signature = {}
+    for dirpath, _, filenames in os.walk(checkpoint_path):
+        for filename in filenames:
+            if filename.endswith(WEIGHT_EXTENSIONS):
+                path = os.path.join(dirpath, filename)
+                stat = os.stat(path)
+                signature[os.path.relpath(path, checkpoint_path)] = [stat.st_size, int(stat.st_mtime)]
+    return signature
+
+
+class TorchBackend:
+    """Diffusers pipelines running on PyTorch (the default backend)"""
+
+    name = "torch"
+
+    # Runs on CUDA when it is available
+    cpu_only = False
+
+    # Pipelines of different types for one checkpoint can share weights
+    supports_shared_weights = True
+
+    # Optimizations that reach into the pipeline's torch modules: UNet
+    # hooks (feature caching, token merging, compilation), VAE tiling and
+    # pre-encoded init latents
+    supports_unet_hooks = True
+    supports_vae_tiling = True
+    supports_latent_input = True
+
+    def load(self, pipeline_type, checkpoint, checkpoint_path, precision, device, sibling=None):
+        """
+        Build a pipeline, from disk or from the weights of a loaded sibling
+
+        Args:
+            pipeline_type (str): "text2img" or "img2img"
+            checkpoint (str): Checkpoint name
+            checkpoint_path (str): Checkpoint directory
+            precision (str): "fp32", "fp16" or "bf16"
+            device (str): Device to run on
+            sibling: Loaded pipeline of the same checkpoint and precision, or None
+
+        Returns:
+            Pipeline object
+        """
+        pipeline_class = PIPELINE_CLASSES[pipeline_type]
+        if sibling is None:
+            if MMAP_WEIGHTS and device == "cpu":
+                pipe = load_pipeline_mmap(pipeline_class, checkpoint_path, PRECISIONS[precision])
+            else:
+                pipe = pipeline_class.from_pretrained(
+                    checkpoint_path,
+                    torch_dtype=PRECISIONS[precision],
+                    safety_checker=None,
+                )
+        else:
+            pipe = pipeline_class(**sibling.components)
+
+        use_dpm_solver(pipe)
+
+        if sibling is None:
+            pipe = pipe.to(device)
+            if COMPILE_UNET:
+                pipe.unet = compile_unet(pipe.unet)
+        pipe.enable_attention_slicing()
+
+        # Wrap the (sliced) self-attention processors; merging changes token
+        # counts from step to step, which a compiled UNet would recompile for
+        if TOKEN_MERGING and not COMPILE_UNET:
+            install_token_merging(pipe.unet, TOKEN_MERGE_RATIOS.get(device, 0.0))
+
+        # Enable model offloading if on CUDA to save VRAM (offload hooks
+        # move weights between calls, which a compiled UNet can't follow)
+        if device == "cuda" and sibling is None and not COMPILE_UNET:
+            pipe.enable_model_cpu_offload()
+        return pipe
+
+    def memory_parts(self, pipe):
+        """Return {id: bytes} for the weights a pipeline holds; ids are shared between siblings"""
+        return {id(component): module_bytes(component) for component in pipe.components.values()
+                if isinstance(component, torch.nn.Module)}
+
+
+class OnnxBackend:
+    """
+    ONNX Runtime on CPU. The text encoder, UNet and VAE of a checkpoint
+    are exported to ONNX once and cached in ONNX_CACHE_DIR; ONNX Runtime
+    then runs them with its fused CPU kernels inside optimum's diffusers
+    compatible pipelines, so callbacks and schedulers work unchanged.
+    Exports are fp32 and are redone when the checkpoint's weights change.
+    """
+
+    name = "onnx"
+    cpu_only = True
+    # Each pipeline type opens its own inference sessions
+    supports_shared_weights = False
+    supports_unet_hooks = False
+    supports_vae_tiling = False
+    supports_latent_input = False
+
+    @staticmethod
+    def _optimum():
+        try:
+            from optimum import onnxruntime as ort_pipelines
+        except ImportError:
+            raise RuntimeError("The onnx backend needs optimum with ONNX Runtime: "
+                               "pip install optimum[onnxruntime]")
+        return ort_pipelines
+
+    def export_dir(self, checkpoint):
+        return os.path.join(ONNX_CACHE_DIR, checkpoint)
+
+    def export(self, checkpoint, checkpoint_path):
+        """
+        Export a checkpoint to ONNX unless an up-to-date export is cached.
+        Processes exporting the same checkpoint wait for each other.
+
+        Args:
+            checkpoint (str): Checkpoint name
+            checkpoint_path (str): Checkpoint directory
+
+        Returns:
+            str: Directory of the exported pipeline
+        """
+        output_dir = self.export_dir(checkpoint)
+        source_file = os.path.join(output_dir, "musemind_source.json")
+        signature = checkpoint_signature(checkpoint_path)
+        os.makedirs(ONNX_CACHE_DIR, exist_ok=True)
+
+        with open(output_dir + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(source_file) as f:
+                    if json.load(f) == signature:
+                        return output_dir
+            except (OSError, ValueError):
+                pass
+
+            print(f"Exporting {checkpoint} to ONNX (once per checkpoint, this takes a few minutes)...")
+            start_time = time.time()
+            partial_dir = output_dir + ".partial"
+            shutil.rmtree(partial_dir, ignore_errors=True)
+            pipe = self._optimum().ORTStableDiffusionPipeline.from_pretrained(checkpoint_path, export=True)
+            pipe.save_pretrained(partial_dir)
+            with open(os.path.join(partial_dir, "musemind_source.json"), "w") as f:
+                json.dump(signature, f)
+            del pipe
+
+            shutil.rmtree(output_dir, ignore_errors=True)
+            os.rename(partial_dir, output_dir)
+            print(f"ONNX export of {checkpoint} written to {output_dir} in {time.time() - start_time:.0f}s")
+        return output_dir
+
+    def load(self, pipeline_type, checkpoint, checkpoint_path, precision, device, sibling=None):
+        """Load a pipeline from the checkpoint's ONNX export (see TorchBackend.load)"""
+        import onnxruntime
+
+        ort_pipelines = self._optimum()
+        pipeline_classes = {
+            "text2img": ort_pipelines.ORTStableDiffusionPipeline,
+            "img2img": ort_pipelines.ORTStableDiffusionImg2ImgPipeline,
+        }
+        if precision != "fp32":
+            print(f"The onnx backend runs in fp32; ignoring precision {precision}")
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        # Stay within the cores a worker process was given
+        options.intra_op_num_threads = torch.get_num_threads()
+
+        pipe = pipeline_classes[pipeline_type].from_pretrained(
+            self.export(checkpoint, checkpoint_path),
+            provider="CPUExecutionProvider",
+            session_options=options,
+        )
+        use_dpm_solver(pipe)
+        return pipe
+
+    def memory_parts(self, pipe):
+        """Return {id: bytes} for a pipeline's sessions, estimated from the export size"""
+        model_dir = str(getattr(pipe, "model_save_dir", "") or "")
+        total = 0
+        for dirpath, _, filenames in os.walk(model_dir):
+            total += sum(os.path.getsize(os.path.join(dirpath, name)) for name in filenames
+                         if name.endswith((".onnx", ".onnx_data")))
+        return {id(pipe): total}
+
+
+BACKENDS = {
+    "torch": TorchBackend,
+    "onnx": OnnxBackend,
+}
+
+if INFERENCE_BACKEND not in BACKENDS:
+    raise ValueError(f"Unknown MUSEMIND_BACKEND {INFERENCE_BACKEND!r}, expected one of {', '.join(BACKENDS)}")
+
+# Backend used by the model manager
+BACKEND = BACKENDS[INFERENCE_BACKEND]()
+
+
+def inference_device():
+    """Return the device pipelines run on: CUDA when available, unless the backend is CPU-only"""
+    if BACKEND.cpu_only:
+        return "cpu"
+    return "cuda" if torch.cuda.is_available() else "cpu"
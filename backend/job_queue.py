@@ -0,0 +1,450 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import Future
+from .jobs import JobCancelled
+from .usage import GenerationResult
+
+# SQLite database holding the shared job queue. When set, diffusion jobs are
+# stored there and run by `python -m backend.job_queue` workers on any host
+# that mounts it; unset keeps them in the server process (or worker pool)
+QUEUE_DB = os.environ.get("MUSEMIND_QUEUE_DB", "")
+
+# Seconds a claimed job stays leased to its worker without a heartbeat
+LEASE_SECONDS = float(os.environ.get("MUSEMIND_QUEUE_LEASE_SECONDS", "60"))
+
+# Times a job is started before a worker dying on it fails it for good
+MAX_ATTEMPTS = int(os.environ.get("MUSEMIND_QUEUE_MAX_ATTEMPTS", "3"))
+
+# Seconds between polls for new jobs (workers) and finished jobs (front-ends)
+POLL_SECONDS = float(os.environ.get("MUSEMIND_QUEUE_POLL_SECONDS", "0.5"))
+
+# Seconds finished jobs and their results are kept
+RESULT_TTL = float(os.environ.get("MUSEMIND_QUEUE_RESULT_TTL", "3600"))
+
+# WAL is faster but needs every process on one host; the default rollback
+# journal also works for a database shared between hosts
+JOURNAL_MODE = os.environ.get("MUSEMIND_QUEUE_JOURNAL_MODE", "DELETE")
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    func_name TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    background INTEGER NOT NULL DEFAULT 0,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    expires REAL,
+    lease_owner TEXT,
+    lease_expires REAL,
+    cancel_reason TEXT,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_by_state ON jobs (state, background, created);
+"""
+
+# Largest number of job ids checked in one query
+_POLL_BATCH = 500
+
+
+def encode_result(result):
+    """Serialize a generation function's return value for the results table"""
+    if isinstance(result, GenerationResult):
+        return json.dumps({"images": list(result), "info": result.info})
+    return json.dumps({"value": result})
+
+
+def decode_result(text):
+    """Inverse of encode_result()"""
+    data = json.loads(text)
+    if "images" in data:
+        return GenerationResult(data["images"], data["info"])
+    return data["value"]
+
+
+class JobQueue:
+    """
+    Durable job queue in a SQLite database shared by any number of web
+    front-ends and workers. Front-ends enqueue jobs and are handed a
+    future that resolves when a worker stores the result; workers claim
+    jobs under a lease that a heartbeat keeps renewing. A job whose lease
+    runs out (its worker died) goes back to the queue until it has been
+    started max_attempts times. Results stay readable by job id for
+    RESULT_TTL seconds.
+    """
+
+    def __init__(self, path=QUEUE_DB, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS,
+                 poll_seconds=POLL_SECONDS, result_ttl=RESULT_TTL):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.poll_seconds = poll_seconds
+        self.result_ttl = result_ttl
+        self._local = threading.local()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._watcher = None
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self):
+        """Return this thread's connection (sqlite3 connections can't be shared)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit; claims open their own write transaction
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute(f"PRAGMA journal_mode={JOURNAL_MODE}")
+            self._local.conn = conn
+        return conn
+
+    def enqueue(self, func_name, args=(), kwargs=None, expires=None, background=False):
+        """
+        Store a call to a backend.generate function
+
+        Args:
+            func_name (str): Function to run
+            args (tuple): Positional arguments (JSON-serializable)
+            kwargs (dict): Keyword arguments (JSON-serializable)
+            expires (float): Wall-clock time after which the job is cancelled
+            background (bool): Claimed only when no foreground job is queued
+
+        Returns:
+            tuple: (job id, Future resolving to the function's result)
+        """
+        job_id = uuid.uuid4().hex
+        payload = json.dumps({"args": list(args), "kwargs": kwargs or {}})
+        self._connection().execute(
+            "INSERT INTO jobs (job_id, func_name, payload, background, state, max_attempts, expires, created) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, func_name, payload, int(background), QUEUED, self.max_attempts, expires, time.time()))
+
+        future = Future()
+        with self._lock:
+            self._pending[job_id] = future
+            if self._watcher is None:
+                self._watcher = threading.Thread(target=self._watch, name="queue-watcher", daemon=True)
+                self._watcher.start()
+        self._wake.set()
+        return job_id, future
+
+    def cancel(self, job_id, reason="cancelled"):
+        """
+        Cancel a job: a queued job is dropped, a running one is stopped by
+        its worker within a poll interval
+
+        Args:
+            job_id (str): Job to cancel
+            reason (str): Why it was cancelled, reported as its error
+        """
+        conn = self._connection()
+        conn.execute("UPDATE jobs SET state = ?, error = ?, finished = ? WHERE job_id = ? AND state = ?",
+                     (CANCELLED, reason, time.time(), job_id, QUEUED))
+        conn.execute("UPDATE jobs SET cancel_reason = ? WHERE job_id = ? AND state = ?",
+                     (reason, job_id, RUNNING))
+
+    def get(self, job_id):
+        """
+        Look up a job
+
+        Returns:
+            dict: The job's state, attempts, timestamps, error and decoded
+            result (None until it is done), or None for an unknown id
+        """
+        row = self._connection().execute(
+            "SELECT job_id, func_name, state, attempts, created, started, finished, result, error "
+            "FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["result"] = decode_result(row["result"]) if row["result"] is not None else None
+        return job
+
+    def claim(self, worker_id):
+        """
+        Lease the next job to a worker, requeueing jobs whose worker
+        stopped heartbeating and expiring jobs that waited too long
+
+        Args:
+            worker_id (str): Identifies the claiming worker
+
+        Returns:
+            tuple: (job_id, func_name, args, kwargs, expires), or None if
+            the queue is empty
+        """
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("UPDATE jobs SET state = ?, error = ?, finished = ? "
+                         "WHERE state = ? AND lease_expires < ? AND attempts >= max_attempts",
+                         (FAILED, "Worker died on every attempt", now, RUNNING, now))
+            requeued = conn.execute("UPDATE jobs SET state = ?, lease_owner = NULL "
+                                    "WHERE state = ? AND lease_expires < ?", (QUEUED, RUNNING, now)).rowcount
+            conn.execute("UPDATE jobs SET state = ?, error = ?, finished = ? "
+                         "WHERE state = ? AND expires IS NOT NULL AND expires < ?",
+                         (CANCELLED, "timeout", now, QUEUED, now))
+            row = conn.execute("SELECT job_id, func_name, payload, expires FROM jobs WHERE state = ? "
+                               "ORDER BY background, created LIMIT 1", (QUEUED,)).fetchone()
+            if row is not None:
+                conn.execute("UPDATE jobs SET state = ?, attempts = attempts + 1, lease_owner = ?, "
+                             "lease_expires = ?, started = ? WHERE job_id = ?",
+                             (RUNNING, worker_id, now + self.lease_seconds, now, row["job_id"]))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        if requeued:
+            print(f"Requeued {requeued} job(s) whose worker stopped heartbeating")
+        if row is None:
+            return None
+        payload = json.loads(row["payload"])
+        return row["job_id"], row["func_name"], payload["args"], payload["kwargs"], row["expires"]
+
+    def heartbeat(self, job_id, worker_id):
+        """
+        Renew a worker's lease on a job
+
+        Returns:
+            tuple: (whether the worker still holds the lease, cancel reason
+            or None)
+        """
+        conn = self._connection()
+        renewed = conn.execute("UPDATE jobs SET lease_expires = ? WHERE job_id = ? AND lease_owner = ? AND state = ?",
+                               (time.time() + self.lease_seconds, job_id, worker_id, RUNNING)).rowcount
+        row = conn.execute("SELECT cancel_reason FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return bool(renewed), row["cancel_reason"] if row else None
+
+    def cancel_reason(self, job_id):
+        """Return why a running job was cancelled, or None if it wasn't"""
+        row = self._connection().execute("SELECT cancel_reason FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return row["cancel_reason"] if row else None
+
+    def finish(self, job_id, worker_id, state, result=None, error=None):
+        """
+        Store a job's outcome, unless the worker lost its lease meanwhile
+
+        Args:
+            job_id (str): Finished job
+            worker_id (str): Worker that ran it
+            state (str): DONE, FAILED or CANCELLED
+            result (str): Output of encode_result() for DONE jobs
+            error (str): Failure message (a cancel reason takes precedence)
+
+        Returns:
+            bool: True if the outcome was stored
+        """
+        return bool(self._connection().execute(
+            "UPDATE jobs SET state = ?, result = ?, error = COALESCE(cancel_reason, ?), finished = ? "
+            "WHERE job_id = ? AND lease_owner = ? AND state = ?",
+            (state, result, error, time.time(), job_id, worker_id, RUNNING)).rowcount)
+
+    def purge(self):
+        """Delete finished jobs older than result_ttl; returns how many"""
+        placeholders = ", ".join("?" for _ in FINISHED_STATES)
+        return self._connection().execute(
+            f"DELETE FROM jobs WHERE state IN ({placeholders}) AND finished < ?",
+            (*FINISHED_STATES, time.time() - self.result_ttl)).rowcount
+
+    def load(self, sample=20):
+        """
+        Return the foreground work in the queue and how fast the workers
+        are getting through it
+
+        Args:
+            sample (int): Recently finished jobs the throughput is measured on
+
+        Returns:
+            tuple: (foreground jobs queued or running, seconds per job across
+            all workers, or None before any job has finished)
+        """
+        conn = self._connection()
+        jobs_ahead = conn.execute("SELECT COUNT(*) FROM jobs WHERE state IN (?, ?) AND background = 0",
+                                  (QUEUED, RUNNING)).fetchone()[0]
+        rows = conn.execute("SELECT started, finished, lease_owner FROM jobs WHERE state = ? "
+                            "ORDER BY finished DESC LIMIT ?", (DONE, sample)).fetchall()
+        if not rows:
+            return jobs_ahead, None
+
+        service_seconds = sum(row["finished"] - row["started"] for row in rows) / len(rows)
+        busy = conn.execute("SELECT DISTINCT lease_owner FROM jobs WHERE state = ?", (RUNNING,)).fetchall()
+        workers = {row["lease_owner"] for row in rows} | {row[0] for row in busy}
+        return jobs_ahead, service_seconds / len(workers)
+
+    def stats(self):
+        """
+        Return a snapshot of the queue
+
+        Returns:
+            dict: Job counts per state, the age of the oldest queued job and
+            the workers currently holding leases
+        """
+        conn = self._connection()
+        counts = {state: count for state, count in
+                  conn.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall()}
+        oldest = conn.execute("SELECT MIN(created) FROM jobs WHERE state = ?", (QUEUED,)).fetchone()[0]
+        workers = [row[0] for row in conn.execute(
+            "SELECT DISTINCT lease_owner FROM jobs WHERE state = ? AND lease_expires >= ?", (RUNNING, time.time()))]
+        return {
+            "jobs": {state: counts.get(state, 0) for state in (QUEUED, RUNNING) + FINISHED_STATES},
+            "oldest_queued_seconds": round(time.time() - oldest, 1) if oldest else 0.0,
+            "busy_workers": workers,
+        }
+
+    def _watch(self):
+        """Resolve the futures of this process's jobs as workers finish them"""
+        while True:
+            with self._lock:
+                # Futures cancelled on this side need no answer
+                for job_id in [job_id for job_id, future in self._pending.items() if future.done()]:
+                    del self._pending[job_id]
+                job_ids = list(self._pending)
+            if not job_ids:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+
+            for start in range(0, len(job_ids), _POLL_BATCH):
+                batch = job_ids[start:start + _POLL_BATCH]
+                placeholders = ", ".join("?" for _ in batch)
+                try:
+                    rows = self._connection().execute(
+                        f"SELECT job_id, state, result, error FROM jobs WHERE job_id IN ({placeholders}) "
+                        f"AND state IN (?, ?, ?)", (*batch, *FINISHED_STATES)).fetchall()
+                except sqlite3.Error as e:
+                    print(f"Job queue poll failed: {str(e)}")
+                    rows = []
+                for row in rows:
+                    with self._lock:
+                        future = self._pending.pop(row["job_id"], None)
+                    if future is None or not future.set_running_or_notify_cancel():
+                        continue
+                    if row["state"] == DONE:
+                        future.set_result(decode_result(row["result"]))
+                    elif row["state"] == CANCELLED:
+                        future.set_exception(JobCancelled(row["error"] or "cancelled"))
+                    else:
+                        future.set_exception(RuntimeError(row["error"]))
+            time.sleep(self.poll_seconds)
+
+
+def run_worker(queue, worker_id=None):
+    """
+    Claim and run jobs until interrupted. Start one of these per inference
+    process; more processes (on this or other hosts) scale out the queue.
+
+    Args:
+        queue (JobQueue): Queue to serve
+        worker_id (str): Name recorded on leases, defaults to host:pid
+    """
+    from . import generate
+    from .worker_pool import WORKER_FUNCTIONS
+
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+
+    # Compile every resolution bucket before claiming jobs
+    if generate.COMPILE_UNET:
+        generate.warmup_pipelines()
+
+    print(f"Queue worker {worker_id} serving {queue.path}")
+    last_purge = 0.0
+
+    while True:
+        job = queue.claim(worker_id)
+        if job is None:
+            if time.time() - last_purge > 60:
+                queue.purge()
+                last_purge = time.time()
+            time.sleep(queue.poll_seconds)
+            continue
+
+        job_id, func_name, args, kwargs, expires = job
+        print(f"Worker {worker_id} running job {job_id}: {func_name}")
+        cancel_event = threading.Event()
+        finished = threading.Event()
+
+        def heartbeat():
+            # Look for a cancellation every poll and renew well before the
+            # lease runs out; stop the job if it was cancelled or another
+            # worker has taken it over
+            renewed = time.time()
+            while not finished.wait(queue.poll_seconds):
+                if time.time() - renewed >= queue.lease_seconds / 3:
+                    owned, cancel_reason = queue.heartbeat(job_id, worker_id)
+                    renewed = time.time()
+                else:
+                    owned, cancel_reason = True, queue.cancel_reason(job_id)
+                if not owned or cancel_reason:
+                    cancel_event.set()
+
+        def should_cancel():
+            return cancel_event.is_set() or (expires is not None and time.time() > expires)
+
+        beat = threading.Thread(target=heartbeat, name=f"heartbeat-{job_id}", daemon=True)
+        beat.start()
+        try:
+            if func_name not in WORKER_FUNCTIONS:
+                raise ValueError(f"Unknown worker function: {func_name}")
+            result = getattr(generate, func_name)(*args, should_cancel=should_cancel, **kwargs)
+            queue.finish(job_id, worker_id, DONE, result=encode_result(result))
+        except JobCancelled as e:
+            queue.finish(job_id, worker_id, CANCELLED, error="timeout" if not cancel_event.is_set() else e.reason)
+        except Exception as e:
+            traceback.print_exc()
+            queue.finish(job_id, worker_id, FAILED, error=f"{type(e).__name__}: {e}")
+        finally:
+            finished.set()
+            beat.join()
+
+
+# Global queue, opened on first use when MUSEMIND_QUEUE_DB is set
+JOB_QUEUE = None
+_QUEUE_LOCK = threading.Lock()
+
+
+def get_job_queue():
+    """
+    Return the global job queue, opening it on first use
+
+    Returns:
+        JobQueue: The queue, or None when jobs run in this process
+    """
+    global JOB_QUEUE
+
+    if not QUEUE_DB:
+        return None
+
+    with _QUEUE_LOCK:
+        if JOB_QUEUE is None:
+            print(f"Using job queue {QUEUE_DB}")
+            JOB_QUEUE = JobQueue(QUEUE_DB)
+    return JOB_QUEUE
+
+
+if __name__ == "__main__":
+    queue = get_job_queue()
+    if queue is None:
+        raise SystemExit("Set MUSEMIND_QUEUE_DB to the shared queue database")
+    run_worker(queue)
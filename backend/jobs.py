@@ -0,0 +1,328 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, CancelledError, TimeoutError as FutureTimeout
+from styles import get_style
+from . import metrics
+
+# Lanes: CPU-only image operations never queue behind diffusion runs
+FAST_LANE = "fast"
+DIFFUSION_LANE = "diffusion"
+
+# Threads serving the fast lane
+FAST_LANE_THREADS = int(os.environ.get("MUSEMIND_FAST_LANE_THREADS", "2"))
+
+# Default and maximum per-job timeout in seconds
+JOB_TIMEOUT = float(os.environ.get("MUSEMIND_JOB_TIMEOUT", "600"))
+
+# Weight of the newest completion in the seconds-per-job average
+THROUGHPUT_EMA_WEIGHT = 0.2
+
+# Styles whose img2img path is pure PIL and never touches the pipeline
+# (styles flagged with direct_enhance are CPU-only as well)
+CPU_ONLY_STYLES = {"pixel_art"}
+
+
+class JobCancelled(Exception):
+    """Raised when a job is stopped by a cancel call, timeout or disconnect"""
+
+    def __init__(self, reason="cancelled"):
+        super().__init__(reason)
+        self.reason = reason
+
+
+def choose_lane(func_name, style=None, has_image=False):
+    """
+    Pick the lane a request should run on
+
+    Args:
+        func_name (str): backend.generate function to run
+        style (str): Requested style name or alias
+        has_image (bool): Whether the request styles an uploaded image
+
+    Returns:
+        str: FAST_LANE or DIFFUSION_LANE
+    """
+    if func_name == "apply_style_to_images" and has_image:
+        style_obj = get_style(style)
+        if style_obj and (style_obj.name in CPU_ONLY_STYLES or style_obj.is_direct()):
+            return FAST_LANE
+    return DIFFUSION_LANE
+
+
+class Job:
+    """
+    A unit of generation work. Any number of requests may wait on the
+    same job; it is cancelled when the last of them goes away, when it
+    is cancelled explicitly, or when its timeout passes.
+    """
+
+    def __init__(self, lane, timeout=None):
+        self.job_id = uuid.uuid4().hex
+        self.lane = lane
+        self.created = time.monotonic()
+        self.deadline = self.created + timeout if timeout else None
+        self.future = None
+        self.cancel_reason = None
+        self.waiters = 0
+        self._cancel_event = threading.Event()
+        self._on_cancel = None
+        self._lock = threading.Lock()
+
+    def should_cancel(self):
+        """Return True once the job has been cancelled or has timed out"""
+        if self._cancel_event.is_set():
+            return True
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            self.cancel("timeout")
+            return True
+        return False
+
+    def cancel(self, reason="cancelled"):
+        """
+        Stop the job: drop it if still queued, otherwise signal the
+        running pipeline to stop at its next step
+
+        Args:
+            reason (str): Why the job was cancelled
+        """
+        with self._lock:
+            if self._cancel_event.is_set():
+                return
+            self.cancel_reason = reason
+            self._cancel_event.set()
+
+        print(f"Cancelling job {self.job_id}: {reason}")
+        metrics.increment(f"jobs_cancelled_{reason.replace(' ', '_')}")
+        if self.future is not None:
+            self.future.cancel()
+        if self._on_cancel is not None:
+            self._on_cancel()
+
+    def done(self):
+        return self.future is not None and self.future.done()
+
+    def add_done_callback(self, fn):
+        """Call fn(job) once the job has finished"""
+        self.future.add_done_callback(lambda _: fn(self))
+
+    def wait(self, should_detach=None, poll_interval=0.25):
+        """
+        Block until the job finishes
+
+        Args:
+            should_detach (callable): Polled while waiting; returns a reason
+                string when this waiter should stop waiting (e.g. the client
+                disconnected), or None to keep waiting
+            poll_interval (float): Seconds between polls
+
+        Returns:
+            The job's result
+
+        Raises:
+            JobCancelled: If the job was cancelled or this waiter detached
+        """
+        with self._lock:
+            self.waiters += 1
+        attached = True
+
+        try:
+            while True:
+                try:
+                    return self.future.result(timeout=poll_interval)
+                except FutureTimeout:
+                    pass
+                except CancelledError:
+                    raise JobCancelled(self.cancel_reason or "cancelled")
+                except JobCancelled as e:
+                    # Report why the job was stopped rather than where
+                    self.should_cancel()
+                    raise JobCancelled(self.cancel_reason or e.reason)
+
+                if self.should_cancel():
+                    continue
+
+                reason = should_detach() if should_detach else None
+                if reason:
+                    with self._lock:
+                        self.waiters -= 1
+                        attached = False
+                        last_waiter = self.waiters == 0
+                    # Only stop the computation if nobody else needs it
+                    if last_waiter:
+                        self.cancel(reason)
+                    raise JobCancelled(reason)
+        finally:
+            if attached:
+                with self._lock:
+                    self.waiters -= 1
+
+
+class _Ticket:
+    """A request's handle on a job, cancellable by its client-facing id"""
+
+    def __init__(self, ticket_id):
+        self.ticket_id = ticket_id
+        self.reason = None
+
+
+class JobManager:
+    """
+    Runs jobs on separate priority lanes. The fast lane serves CPU-only
+    work from its own threads; the diffusion lane is serialized in
+    process (pipelines are not thread-safe), handed to the worker pool,
+    or stored in the shared job queue for queue workers to claim.
+    Background diffusion jobs are cancelled as soon as a foreground
+    diffusion job arrives.
+    """
+
+    def __init__(self, fast_threads=FAST_LANE_THREADS):
+        self._fast = ThreadPoolExecutor(max_workers=fast_threads, thread_name_prefix="fast-lane")
+        self._diffusion = ThreadPoolExecutor(max_workers=1, thread_name_prefix="diffusion-lane")
+        self._tickets = {}
+        self._background = set()
+        self._foreground = 0
+        self._last_foreground = 0.0
+        self._last_completion = 0.0
+        self._seconds_per_job = None
+        self._lock = threading.Lock()
+
+    def submit(self, lane, func_name, *args, timeout=JOB_TIMEOUT, background=False, **kwargs):
+        """
+        Queue a backend.generate function call on a lane
+
+        Args:
+            lane (str): FAST_LANE or DIFFUSION_LANE
+            func_name (str): Function to run
+            timeout (float): Seconds before the job is cancelled
+            background (bool): Opportunistic work that any foreground
+                diffusion job preempts
+
+        Returns:
+            Job: The queued job
+        """
+        from .worker_pool import get_worker_pool
+        from .job_queue import get_job_queue
+
+        job = Job(lane, timeout)
+        metrics.increment(f"jobs_submitted_{lane}")
+
+        if lane == DIFFUSION_LANE and background:
+            with self._lock:
+                self._background.add(job)
+        elif lane == DIFFUSION_LANE:
+            with self._lock:
+                self._foreground += 1
+                self._last_foreground = time.monotonic()
+                preempted = list(self._background)
+            # Stop background work at its next step so this job doesn't queue behind it
+            for background_job in preempted:
+                background_job.cancel("preempted")
+
+        queue = get_job_queue() if lane == DIFFUSION_LANE else None
+        pool = get_worker_pool() if lane == DIFFUSION_LANE and queue is None else None
+        if queue is not None:
+            # The queue's id, so the stored result can be fetched by job id
+            expires = time.time() + timeout if timeout else None
+            job.job_id, job.future = queue.enqueue(func_name, args, kwargs, expires=expires, background=background)
+            job._on_cancel = lambda: queue.cancel(job.job_id, job.cancel_reason)
+        elif pool is not None:
+            deadline = time.time() + timeout if timeout else None
+            job.future = pool.submit(func_name, *args, deadline=deadline, **kwargs)
+            job._on_cancel = lambda: pool.cancel(job.future)
+        else:
+            executor = self._fast if lane == FAST_LANE else self._diffusion
+            job.future = executor.submit(self._run, job, func_name, args, kwargs)
+
+        if lane == DIFFUSION_LANE:
+            job.add_done_callback(self._diffusion_done)
+        return job
+
+    def _diffusion_done(self, job):
+        with self._lock:
+            if job in self._background:
+                self._background.discard(job)
+            else:
+                # The time since the job arrived or the previous one finished,
+                # whichever is later, is how long the lane spent on it
+                now = time.monotonic()
+                if job.cancel_reason is None:
+                    seconds = now - max(job.created, self._last_completion)
+                    previous = self._seconds_per_job
+                    self._seconds_per_job = seconds if previous is None else \
+                        previous + (seconds - previous) * THROUGHPUT_EMA_WEIGHT
+                    self._last_completion = now
+                self._foreground -= 1
+                self._last_foreground = now
+
+    def diffusion_load(self):
+        """
+        Return the foreground diffusion work in this process
+
+        Returns:
+            tuple: (jobs queued or running, measured seconds between job
+            completions while busy, or None before any has finished)
+        """
+        with self._lock:
+            return self._foreground, self._seconds_per_job
+
+    def foreground_idle_seconds(self):
+        """
+        Return how long the diffusion lane has had no foreground work
+
+        Returns:
+            float: Seconds since the last foreground diffusion job finished,
+            or 0.0 while one is queued or running
+        """
+        with self._lock:
+            if self._foreground > 0:
+                return 0.0
+            return time.monotonic() - self._last_foreground
+
+    @staticmethod
+    def _run(job, func_name, args, kwargs):
+        # Jobs can time out or be cancelled while still queued
+        if job.should_cancel():
+            raise JobCancelled(job.cancel_reason or "cancelled")
+
+        from . import generate
+        return getattr(generate, func_name)(*args, should_cancel=job.should_cancel, **kwargs)
+
+    def open_ticket(self, ticket_id=None):
+        """
+        Register a client-facing id that can later be passed to cancel()
+
+        Args:
+            ticket_id (str): Id chosen by the client, generated if omitted
+
+        Returns:
+            _Ticket: The registered ticket
+        """
+        ticket = _Ticket(ticket_id or uuid.uuid4().hex)
+        with self._lock:
+            self._tickets[ticket.ticket_id] = ticket
+        return ticket
+
+    def close_ticket(self, ticket):
+        with self._lock:
+            if self._tickets.get(ticket.ticket_id) is ticket:
+                del self._tickets[ticket.ticket_id]
+
+    def cancel(self, ticket_id):
+        """
+        Cancel the request waiting under ticket_id
+
+        Returns:
+            bool: True if a waiting request was found
+        """
+        with self._lock:
+            ticket = self._tickets.get(ticket_id)
+        if ticket is None:
+            return False
+        ticket.reason = "cancelled by client"
+        return True
+
+
+# Shared job manager used by the routes
+JOBS = JobManager()
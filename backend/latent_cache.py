@@ -0,0 +1,144 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+import torch
+from diffusers.utils.torch_utils import randn_tensor
+from .inference_backends import BACKEND
+
+# Memory VAE-encoded init images may use, per process (0 disables the cache)
+LATENT_CACHE_MB = float(os.environ.get("MUSEMIND_LATENT_CACHE_MB", "64"))
+
+
+def latent_key(image, checkpoint, dtype):
+    """
+    Build the cache key of a pre-processed init image
+
+    Args:
+        image (PIL.Image): The image exactly as it is passed to the pipeline
+        checkpoint (str): Checkpoint whose VAE encodes it
+        dtype (torch.dtype): VAE precision
+
+    Returns:
+        str: Hex digest
+    """
+    digest = hashlib.sha256(image.tobytes())
+    digest.update(f"{image.mode}:{image.width}x{image.height}:{checkpoint}:{dtype}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class LatentCache:
+    """
+    Least-recently-used cache of VAE-encoded init images, bounded by the
+    memory the latents take up. Entries stay on the device they were
+    encoded on.
+    """
+
+    def __init__(self, max_bytes=LATENT_CACHE_MB * 1024 ** 2):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached latents for key, or None"""
+        with self._lock:
+            latents = self._entries.get(key)
+            if latents is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return latents
+
+    def put(self, key, latents):
+        """Store latents under key, evicting the least recently used entries"""
+        size = latents.element_size() * latents.nelement()
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = latents
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.element_size() * evicted.nelement()
+
+    def stats(self):
+        """
+        Return the cache's size and hit counts
+
+        Returns:
+            dict: entries, size in MB, hits, misses and the hit rate
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "size_mb": round(self._bytes / 1024 ** 2, 1),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+def encode_init_latents(pipe, image, checkpoint):
+    """
+    VAE-encode an init image for img2img, reusing the posterior of an
+    earlier call with the same pre-processed image. Only the encoder pass
+    is cached; each run still draws its own seeded sample from the
+    posterior with sample_init_latents().
+
+    Args:
+        pipe (StableDiffusionImg2ImgPipeline): Pipeline whose VAE encodes the image
+        image (PIL.Image): Pre-processed init image
+        checkpoint (str): Checkpoint name, part of the cache key
+
+    Returns:
+        tuple: (posterior mean and std stacked along the batch dimension,
+        or None when the cache is disabled; whether it came from the cache)
+    """
+    if LATENT_CACHE.max_bytes <= 0 or not BACKEND.supports_latent_input:
+        return None, False
+
+    key = latent_key(image, checkpoint, pipe.vae.dtype)
+    posterior = LATENT_CACHE.get(key)
+    if posterior is not None:
+        return posterior, True
+
+    device = pipe._execution_device
+    pixels = pipe.image_processor.preprocess(image).to(device=device, dtype=pipe.vae.dtype)
+    with torch.no_grad():
+        latent_dist = pipe.vae.encode(pixels).latent_dist
+    posterior = torch.cat([latent_dist.mean, latent_dist.std])
+    LATENT_CACHE.put(key, posterior)
+    return posterior, False
+
+
+def sample_init_latents(pipe, posterior, generators):
+    """
+    Draw one posterior sample per generator, scaled for the UNet. This is
+    the draw the pipeline makes when it encodes the image itself, so each
+    seed gives the same image as an uncached run and the generators are
+    left in the same state for the pipeline's noise.
+
+    Args:
+        pipe (StableDiffusionImg2ImgPipeline): Pipeline whose VAE encoded the image
+        posterior (torch.Tensor): Result of encode_init_latents()
+        generators (list): One seeded torch.Generator per image
+
+    Returns:
+        torch.Tensor: Latents with one entry per generator, passed to the
+        pipeline in place of the image
+    """
+    mean, std = posterior[:1], posterior[1:]
+    samples = [mean + std * randn_tensor(mean.shape, generator=generator, device=mean.device, dtype=mean.dtype)
+               for generator in generators]
+    return torch.cat(samples) * pipe.vae.config.scaling_factor
+
+
+# Process-wide latent cache
+LATENT_CACHE = LatentCache()
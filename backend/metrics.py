@@ -0,0 +1,74 @@
+import threading
+
+# Process-wide counters and gauges, exposed through the /metrics endpoint
+_COUNTERS = {}
+_GAUGES = {}
+_LOCK = threading.Lock()
+
+
+def increment(name, value=1):
+    """
+    Add value to a counter, creating it at zero if needed
+
+    Args:
+        name (str): Counter name
+        value (int): Amount to add
+    """
+    with _LOCK:
+        _COUNTERS[name] = _COUNTERS.get(name, 0) + value
+
+
+def set_gauge(name, value):
+    """
+    Set a gauge to the given value
+
+    Args:
+        name (str): Gauge name
+        value (float): Current value
+    """
+    with _LOCK:
+        _GAUGES[name] = value
+
+
+def set_gauge_max(name, value):
+    """
+    Raise a gauge to value if value is higher, tracking a running maximum
+
+    Args:
+        name (str): Gauge name
+        value (float): Observed value
+    """
+    with _LOCK:
+        _GAUGES[name] = max(_GAUGES.get(name, value), value)
+
+
+def get_counter(name):
+    """Return the current value of a counter (0 if it was never incremented)"""
+    with _LOCK:
+        return _COUNTERS.get(name, 0)
+
+
+def ratio(numerator, denominator):
+    """
+    Compute the ratio of two counters
+
+    Returns:
+        float: numerator / denominator, or 0.0 when the denominator is zero
+    """
+    with _LOCK:
+        total = _COUNTERS.get(denominator, 0)
+        return _COUNTERS.get(numerator, 0) / total if total else 0.0
+
+
+def snapshot():
+    """
+    Return a copy of all metrics
+
+    Returns:
+        dict: {"counters": {...}, "gauges": {...}}
+    """
+    with _LOCK:
+        return {
+            "counters": dict(_COUNTERS),
+            "gauges": dict(_GAUGES),
+        }
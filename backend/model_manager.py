@@ -0,0 +1,261 @@
+import gc
+import os
+import threading
+import time
+from collections import OrderedDict
+import torch
+from .utils import get_available_memory, get_total_memory, list_checkpoints, MODEL_ROOT, DEFAULT_CHECKPOINT
+from .inference_backends import BACKEND, PIPELINE_CLASSES, PRECISIONS, WEIGHT_EXTENSIONS, inference_device
+
+# RAM the loaded pipelines may use, in GB (0 = 75% of system memory)
+MEMORY_BUDGET_GB = float(os.environ.get("MUSEMIND_MODEL_BUDGET_GB", "0"))
+
+# Pipelines unused for this many seconds are unloaded (0 disables)
+IDLE_TIMEOUT = float(os.environ.get("MUSEMIND_MODEL_IDLE_TIMEOUT", "900"))
+
+# Start evicting idle pipelines when free system memory drops below this, in GB
+MIN_FREE_MEMORY_GB = float(os.environ.get("MUSEMIND_MIN_FREE_MEMORY_GB", "1.0"))
+
+
+def default_precision(device):
+    """Return the precision used on a device unless overridden by MUSEMIND_PRECISION"""
+    return os.environ.get("MUSEMIND_PRECISION") or ("fp16" if device == "cuda" else "fp32")
+
+
+def estimate_checkpoint_bytes(checkpoint_path):
+    """Estimate the memory a checkpoint needs from the size of its weight files"""
+    total = 0
+    for dirpath, _, filenames in os.walk(checkpoint_path):
+        for filename in filenames:
+            if filename.endswith(WEIGHT_EXTENSIONS):
+                total += os.path.getsize(os.path.join(dirpath, filename))
+    return total
+
+
+class _Entry:
+    """A loaded pipeline and its usage bookkeeping"""
+
+    def __init__(self, key, pipeline):
+        self.key = key
+        self.pipeline = pipeline
+        self.loaded_at = time.time()
+        self.last_used = self.loaded_at
+        self.uses = 0
+
+
+class ModelManager:
+    """
+    Keeps loaded pipelines keyed by (checkpoint, pipeline type, precision)
+    within a memory budget. The least recently used pipelines are unloaded
+    to make room for new ones, when they sit idle past the idle timeout,
+    or when the system runs low on free memory. Pipelines of different
+    types for the same checkpoint share their weights.
+
+    A pipeline evicted while a call is still running stays alive until
+    that call returns, since the caller holds its own reference.
+    """
+
+    def __init__(self, budget_bytes=None, idle_timeout=IDLE_TIMEOUT, min_free_bytes=None):
+        if budget_bytes is None:
+            budget_bytes = MEMORY_BUDGET_GB * 1024 ** 3 if MEMORY_BUDGET_GB > 0 else get_total_memory() * 0.75
+        if min_free_bytes is None:
+            min_free_bytes = MIN_FREE_MEMORY_GB * 1024 ** 3
+
+        self.budget_bytes = budget_bytes
+        self.idle_timeout = idle_timeout
+        self.min_free_bytes = min_free_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        self._load_lock = threading.Lock()  # Loads are slow, keep them off the state lock
+        self._reaper = None
+        self.loads = 0
+        self.evictions = 0
+
+        # Forked workers inherit loaded pipelines but not threads or lock state
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._lock = threading.RLock()
+        self._load_lock = threading.Lock()
+        self._reaper = None
+
+    def get(self, pipeline_type="text2img", device=None, checkpoint=None, precision=None):
+        """
+        Return a loaded pipeline, loading it first if needed
+
+        Args:
+            pipeline_type (str): "text2img" or "img2img"
+            device (str): Device to use, defaults to auto-detection
+            checkpoint (str): Checkpoint directory name under MODEL_ROOT
+            precision (str): "fp32", "fp16" or "bf16"
+
+        Returns:
+            Pipeline object
+        """
+        if device is None:
+            device = inference_device()
+        checkpoint = checkpoint or DEFAULT_CHECKPOINT
+        precision = precision or default_precision(device)
+        key = (checkpoint, pipeline_type, precision)
+
+        with self._load_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+            if entry is None:
+                entry = self._load(key, device)
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            entry.last_used = time.time()
+            entry.uses += 1
+
+        self._start_reaper()
+        return entry.pipeline
+
+    def _load(self, key, device):
+        checkpoint, pipeline_type, precision = key
+        if pipeline_type not in PIPELINE_CLASSES:
+            raise ValueError(f"Unknown pipeline type: {pipeline_type}")
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown precision: {precision}")
+        if checkpoint not in list_checkpoints():
+            raise ValueError(f"Unknown checkpoint: {checkpoint}")
+
+        checkpoint_path = os.path.join(MODEL_ROOT, checkpoint)
+
+        # Reuse the weights of a sibling pipeline for the same checkpoint
+        with self._lock:
+            sibling = next((entry for (ckpt, _, prec), entry in self._entries.items()
+                            if ckpt == checkpoint and prec == precision), None)
+        if sibling is not None and not BACKEND.supports_shared_weights:
+            sibling = None
+
+        if sibling is None:
+            with self._lock:
+                self._make_room(estimate_checkpoint_bytes(checkpoint_path))
+            print(f"Initializing {pipeline_type} pipeline for {checkpoint} ({precision}) "
+                  f"on {device} with the {BACKEND.name} backend...")
+        else:
+            print(f"Initializing {pipeline_type} pipeline for {checkpoint} ({precision}) from loaded weights...")
+        pipe = BACKEND.load(pipeline_type, checkpoint, checkpoint_path, precision, device,
+                            sibling.pipeline if sibling is not None else None)
+
+        entry = _Entry(key, pipe)
+        with self._lock:
+            self._entries[key] = entry
+            self.loads += 1
+        return entry
+
+    def resident_bytes(self):
+        """Return the memory held by all loaded pipelines, counting shared weights once"""
+        with self._lock:
+            parts = {}
+            for entry in self._entries.values():
+                parts.update(BACKEND.memory_parts(entry.pipeline))
+            return sum(parts.values())
+
+    def _make_room(self, needed_bytes):
+        """Evict least recently used pipelines until needed_bytes fits the budget"""
+        while self._entries and self.resident_bytes() + needed_bytes > self.budget_bytes:
+            self._evict(next(iter(self._entries)), "memory budget")
+
+    def _evict(self, key, reason):
+        self._entries.pop(key)
+        print(f"Unloading {key[1]} pipeline for {key[0]} ({key[2]}): {reason}")
+        self.evictions += 1
+
+        # Pipelines hold reference cycles, so collect them right away
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def evict_idle(self):
+        """
+        Unload pipelines idle past the timeout, and the least recently used
+        ones while free system memory is below the minimum
+
+        Returns:
+            int: Number of pipelines unloaded
+        """
+        evicted = 0
+        now = time.time()
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if self.idle_timeout and now - entry.last_used > self.idle_timeout:
+                    self._evict(key, "idle timeout")
+                    evicted += 1
+
+            # Keep the most recently used pipeline even under pressure
+            while len(self._entries) > 1 and get_available_memory("cpu") < self.min_free_bytes:
+                self._evict(next(iter(self._entries)), "memory pressure")
+                evicted += 1
+        return evicted
+
+    def unload(self, checkpoint=None, pipeline_type=None):
+        """
+        Unload matching pipelines (all of them if no filter is given)
+
+        Returns:
+            int: Number of pipelines unloaded
+        """
+        with self._lock:
+            keys = [key for key in self._entries
+                    if (checkpoint is None or key[0] == checkpoint)
+                    and (pipeline_type is None or key[1] == pipeline_type)]
+            for key in keys:
+                self._evict(key, "admin request")
+        return len(keys)
+
+    def _start_reaper(self):
+        if self._reaper is not None:
+            return
+        with self._lock:
+            if self._reaper is None:
+                self._reaper = threading.Thread(target=self._reap, name="model-reaper", daemon=True)
+                self._reaper.start()
+
+    def _reap(self):
+        while True:
+            time.sleep(30)
+            try:
+                self.evict_idle()
+            except Exception as e:
+                print(f"Error evicting idle pipelines: {str(e)}")
+
+    def stats(self):
+        """
+        Return a snapshot of the manager state
+
+        Returns:
+            dict: Budget, usage and one record per loaded pipeline
+        """
+        now = time.time()
+        with self._lock:
+            pipelines = [{
+                "checkpoint": entry.key[0],
+                "pipeline_type": entry.key[1],
+                "precision": entry.key[2],
+                "bytes": sum(BACKEND.memory_parts(entry.pipeline).values()),
+                "uses": entry.uses,
+                "idle_seconds": round(now - entry.last_used, 1),
+                "loaded_seconds": round(now - entry.loaded_at, 1),
+            } for entry in self._entries.values()]
+
+            return {
+                "budget_bytes": int(self.budget_bytes),
+                "resident_bytes": self.resident_bytes(),
+                "available_bytes": get_available_memory("cpu"),
+                "idle_timeout": self.idle_timeout,
+                "loads": self.loads,
+                "evictions": self.evictions,
+                "checkpoints": list_checkpoints(),
+                "default_checkpoint": DEFAULT_CHECKPOINT,
+                "backend": BACKEND.name,
+                "pipelines": pipelines,
+            }
+
+
+# Process-wide manager used by initialize_pipeline
+MODEL_MANAGER = ModelManager()
@@ -0,0 +1,165 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+from .jobs import JOBS, JOB_TIMEOUT, JobCancelled, DIFFUSION_LANE
+from .usage import result_info
+from . import metrics
+
+# Prompts and styles /random_image chooses from
+RANDOM_PROMPTS = [
+    "A peaceful mountain landscape at sunset",
+    "A futuristic cyberpunk city at night with neon lights",
+    "An underwater scene with colorful coral reef and fish",
+    "A fantasy castle in the clouds",
+    "A cozy cottage in a forest clearing",
+    "A tropical beach paradise with palm trees",
+    "A space station orbiting a distant planet",
+    "An ancient temple hidden in the jungle",
+    "A steampunk airship floating in the sky",
+    "A winter wonderland with snow-covered trees",
+    "A magical fairy garden with glowing mushrooms",
+    "A medieval village market scene",
+    "A desert oasis with camels and palm trees",
+    "A rustic farm with fields of wheat at golden hour",
+    "A bustling city street in the rain"
+]
+
+RANDOM_STYLES = [
+    "realistic", "anime", "ghibli", "oil_painting",
+    "watercolor", "pixel_art", "cyberpunk", "fantasy"
+]
+
+# Ready images kept per resolution (0 disables prefetching)
+PREFETCH_POOL_SIZE = int(os.environ.get("MUSEMIND_PREFETCH_POOL_SIZE", "2"))
+
+# Resolutions kept ready, as comma-separated WIDTHxHEIGHT
+PREFETCH_RESOLUTIONS = os.environ.get("MUSEMIND_PREFETCH_RESOLUTIONS", "512x512")
+
+# Seconds the diffusion lane must be free of user requests before refilling
+PREFETCH_IDLE_SECONDS = float(os.environ.get("MUSEMIND_PREFETCH_IDLE_SECONDS", "2"))
+
+
+def parse_resolutions(spec):
+    """Parse "512x512,768x512" into a list of (width, height) tuples"""
+    resolutions = []
+    for item in spec.split(","):
+        item = item.strip().lower()
+        if item:
+            width, height = (int(value) for value in item.split("x"))
+            resolutions.append((width, height))
+    return resolutions
+
+
+def random_request(rng=random):
+    """Pick a random (prompt, style) combination"""
+    return rng.choice(RANDOM_PROMPTS), rng.choice(RANDOM_STYLES)
+
+
+class PrefetchPool:
+    """
+    Random images rendered ahead of time for /random_image. A background
+    thread keeps up to `size` images ready per resolution, rendering only
+    while no user request needs the diffusion lane; its jobs are submitted
+    as background work, so a user request arriving mid-render preempts it.
+    """
+
+    def __init__(self, size=PREFETCH_POOL_SIZE, resolutions=None, idle_seconds=PREFETCH_IDLE_SECONDS):
+        self.size = size
+        self.resolutions = resolutions if resolutions is not None else parse_resolutions(PREFETCH_RESOLUTIONS)
+        self.idle_seconds = idle_seconds
+        self._ready = {resolution: deque() for resolution in self.resolutions}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    @property
+    def enabled(self):
+        return self.size > 0 and bool(self.resolutions)
+
+    def start(self):
+        """Start the refill thread (does nothing if already running or disabled)"""
+        with self._lock:
+            if not self.enabled or self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._refill_loop, name="prefetch-refill", daemon=True)
+        self._thread.start()
+        print(f"Prefetching {self.size} random images for {', '.join(f'{w}x{h}' for w, h in self.resolutions)}")
+
+    def take(self, width, height):
+        """
+        Take a ready image for a resolution
+
+        Args:
+            width (int): Requested width
+            height (int): Requested height
+
+        Returns:
+            dict: image, prompt, style and info, or None if none is ready
+        """
+        with self._lock:
+            ready = self._ready.get((width, height))
+            entry = ready.popleft() if ready else None
+        metrics.increment("prefetch_requests")
+        if entry:
+            metrics.increment("prefetch_hits")
+        self._wake.set()
+        return entry
+
+    def stats(self):
+        """Return the number of ready images per resolution"""
+        with self._lock:
+            return {f"{width}x{height}": len(ready) for (width, height), ready in self._ready.items()}
+
+    def _next_resolution(self):
+        """Return the resolution with the fewest ready images, or None if all are full"""
+        with self._lock:
+            resolution = min(self._ready, key=lambda key: len(self._ready[key]))
+            return resolution if len(self._ready[resolution]) < self.size else None
+
+    def _refill_loop(self):
+        while True:
+            resolution = self._next_resolution()
+            if resolution is None:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+
+            # Leave the lane to user requests and give bursts time to settle
+            idle = JOBS.foreground_idle_seconds()
+            if idle < self.idle_seconds:
+                time.sleep(self.idle_seconds - idle)
+                continue
+
+            width, height = resolution
+            prompt, style = random_request()
+            start_time = time.time()
+            try:
+                job = JOBS.submit(DIFFUSION_LANE, "generate_images", prompt, width, height, style, 1, None,
+                                  timeout=JOB_TIMEOUT, background=True, output_folder=None)
+                images = job.wait()
+            except JobCancelled as e:
+                print(f"Prefetch of {width}x{height} {style} stopped: {e.reason}")
+                continue
+            except Exception as e:
+                print(f"Prefetch of {width}x{height} {style} failed: {str(e)}")
+                time.sleep(max(self.idle_seconds, 5))
+                continue
+
+            if not images:
+                time.sleep(max(self.idle_seconds, 5))
+                continue
+
+            with self._lock:
+                self._ready[resolution].append({
+                    "image": images[0],
+                    "prompt": prompt,
+                    "style": style,
+                    "info": dict(result_info(images), prefetch_seconds=round(time.time() - start_time, 2)),
+                })
+            metrics.increment("prefetch_rendered")
+
+
+# Pool served by /random_image
+PREFETCH = PrefetchPool()
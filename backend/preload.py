@@ -0,0 +1,15 @@
+# Imported by the worker pool's fork server (MUSEMIND_PRELOAD=1): loads the
+# pipelines once so every forked worker shares the same weight pages
+import gc
+import torch
+from .generate import warmup_pipelines
+
+# Don't start intra-op thread pools here; they do not survive fork and
+# each worker sizes its own after it starts
+torch.set_num_threads(1)
+
+warmup_pipelines()
+
+# Move everything loaded so far out of the collector's reach, so garbage
+# collections in the workers don't write to (and un-share) these pages
+gc.freeze()
@@ -0,0 +1,118 @@
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+import uuid
+
+# Where profiles and traces are written (served at /profiles/<id>/<file>)
+PROFILE_DIR = os.environ.get("MUSEMIND_PROFILE_DIR", "./profiles")
+
+# Secret a request must send in the X-MuseMind-Profile header (or the
+# profile query parameter) to be profiled; profiling is off while unset
+PROFILE_TOKEN = os.environ.get("MUSEMIND_PROFILE_TOKEN", "")
+
+# Profiled runs allowed per minute across the server
+PROFILE_MAX_PER_MINUTE = float(os.environ.get("MUSEMIND_PROFILE_MAX_PER_MINUTE", "2"))
+
+# Functions in the profile summary
+SUMMARY_ROWS = 40
+
+
+class ProfileSampler:
+    """
+    Admits profiling requests at a bounded rate, one at a time, so the
+    switch can stay on in production: profiler overhead only ever lands
+    on the occasional request that asked for it.
+    """
+
+    def __init__(self, max_per_minute=PROFILE_MAX_PER_MINUTE):
+        self.max_per_minute = max_per_minute
+        self._recent = []
+        self._active = False
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Claim a profiling slot
+
+        Returns:
+            str: A new profile id, or None if the rate limit is reached or
+            another profiled run is in progress
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._recent = [started for started in self._recent if now - started < 60]
+            if self._active or len(self._recent) >= self.max_per_minute:
+                return None
+            self._recent.append(now)
+            self._active = True
+        return time.strftime("%Y%m%d-%H%M%S") + "-" + uuid.uuid4().hex[:8]
+
+    def release(self):
+        """Free the slot claimed by acquire()"""
+        with self._lock:
+            self._active = False
+
+
+def profile_call(profile_id, func, *args, **kwargs):
+    """
+    Run func under cProfile and the torch profiler and store the results
+    in PROFILE_DIR/<profile_id>: profile.prof (cProfile stats, for
+    snakeviz or pstats), summary.txt (top functions and torch operators)
+    and trace.json (Chrome trace, for chrome://tracing or Perfetto).
+
+    Args:
+        profile_id (str): Id from ProfileSampler.acquire()
+        func (callable): Function to profile
+        *args: Positional arguments for func
+        **kwargs: Keyword arguments for func
+
+    Returns:
+        The function's result. Profile details are added to its info dict
+        when it has one.
+    """
+    import torch
+    from torch.profiler import profile, ProfilerActivity
+
+    output_dir = os.path.join(os.path.abspath(PROFILE_DIR), profile_id)
+    os.makedirs(output_dir, exist_ok=True)
+
+    activities = [ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+        activities.append(ProfilerActivity.CUDA)
+
+    profiler = cProfile.Profile()
+    start_time = time.time()
+    with profile(activities=activities) as torch_profiler:
+        profiler.enable()
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            profiler.disable()
+    elapsed = time.time() - start_time
+
+    files = {"cprofile": "profile.prof", "summary": "summary.txt", "trace": "trace.json"}
+    profiler.dump_stats(os.path.join(output_dir, files["cprofile"]))
+    torch_profiler.export_chrome_trace(os.path.join(output_dir, files["trace"]))
+
+    stats_text = io.StringIO()
+    pstats.Stats(profiler, stream=stats_text).sort_stats("cumulative").print_stats(SUMMARY_ROWS)
+    sort_key = "cuda_time_total" if torch.cuda.is_available() else "cpu_time_total"
+    with open(os.path.join(output_dir, files["summary"]), "w") as f:
+        f.write(f"Profile {profile_id}: {func.__name__} took {elapsed:.2f}s\n\n")
+        f.write("Torch operators\n")
+        f.write(torch_profiler.key_averages().table(sort_by=sort_key, row_limit=SUMMARY_ROWS))
+        f.write("\n\nPython functions\n")
+        f.write(stats_text.getvalue())
+
+    print(f"Profile {profile_id} written to {output_dir}")
+    info = getattr(result, "info", None)
+    if info is not None:
+        info["profile"] = {"id": profile_id, "seconds": round(elapsed, 2), "files": files}
+    return result
+
+
+# Rate limiter for profiled requests
+PROFILE_SAMPLER = ProfileSampler()
@@ -0,0 +1,157 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from io import BytesIO
+from PIL import Image
+
+# Finished img2img results, shared by all worker processes through the filesystem
+RESULT_CACHE_DIR = os.environ.get("MUSEMIND_RESULT_CACHE_DIR", "./cache/results")
+
+# Size limit of the result cache in MB (0 disables it)
+RESULT_CACHE_MB = float(os.environ.get("MUSEMIND_RESULT_CACHE_MB", "512"))
+
+
+def result_key(image_hash, style_spec, prompt, instructions, strength, steps, seed, **extra):
+    """
+    Build the cache key of one img2img result
+
+    Args:
+        image_hash (str): SHA-256 of the source image
+        style_spec (dict): The style's parameters (get_style_info()), so
+            editing a style invalidates its cached results
+        prompt (str): User prompt for this image
+        instructions (str): Additional instructions
+        strength (float): img2img strength
+        steps (int): Inference steps
+        seed (int): Seed of this image
+        **extra: Anything else that changes the output (checkpoint, device...)
+
+    Returns:
+        str: Hex digest
+    """
+    params = dict(extra, image_hash=image_hash, style=style_spec, prompt=prompt, instructions=instructions,
+                  strength=strength, steps=steps, seed=seed)
+    return hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    Content-keyed PNG cache on disk with least-recently-used trimming.
+    Entries are written atomically, so concurrent workers never see a
+    partial file; reads refresh an entry's modification time.
+    """
+
+    def __init__(self, folder=RESULT_CACHE_DIR, max_bytes=RESULT_CACHE_MB * 1024 ** 2):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._bytes = None  # Computed lazily from the directory
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _path(self, key):
+        return os.path.join(self.folder, key[:2], key + ".png")
+
+    def get(self, key):
+        """
+        Return the cached PNG bytes for key, or None
+        """
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def get_image(self, key):
+        """Return the cached result for key as a PIL image, or None"""
+        data = self.get(key)
+        return Image.open(BytesIO(data)).convert("RGB") if data is not None else None
+
+    def put(self, key, data):
+        """
+        Store PNG bytes under key, trimming old entries if over the limit
+        """
+        if not self.enabled:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+        with self._lock:
+            if self._bytes is None:
+                self._bytes = self._scan_bytes()
+            else:
+                self._bytes += len(data)
+            over = self._bytes > self.max_bytes
+        if over:
+            self.trim()
+
+    def _entries(self):
+        entries = []
+        for dirpath, _, filenames in os.walk(self.folder):
+            for filename in filenames:
+                if filename.endswith(".png"):
+                    path = os.path.join(dirpath, filename)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _scan_bytes(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def trim(self):
+        """Delete least recently used entries until the cache is at 90% of its limit"""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        with self._lock:
+            self._bytes = total
+
+    def stats(self):
+        """
+        Return hit counts for this process
+
+        Returns:
+            dict: hits, misses and the hit rate
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+# Process-wide result cache
+RESULT_CACHE = ResultCache()
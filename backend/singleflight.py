@@ -0,0 +1,125 @@
+import hashlib
+import json
+import threading
+from styles import get_style
+from . import metrics
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """
+    Compute the SHA-256 of a file's contents
+
+    Args:
+        path (str): File to hash
+        chunk_size (int): Read size in bytes
+
+    Returns:
+        str: Hex digest
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def normalize_prompt(prompt):
+    """Lower-case and collapse whitespace the same way the CLIP tokenizer sees it"""
+    if prompt is None:
+        return None
+    return " ".join(prompt.lower().split())
+
+
+def request_key(kind, prompt=None, style=None, width=None, height=None, steps=None,
+                guidance=None, seed=None, image_hash=None, **extra):
+    """
+    Build a stable key from the parameters that determine a generation result
+
+    Args:
+        kind (str): Operation name, e.g. "generate_images"
+        prompt (str): Text prompt
+        style (str): Style name or alias
+        width (int): Output width
+        height (int): Output height
+        steps (int): Inference steps, if overridden
+        guidance (float): Guidance scale, if overridden
+        seed: Seed or list of seeds
+        image_hash (str): Hash of the input image, for img2img
+        **extra: Any further parameters that affect the output
+
+    Returns:
+        str: Hex digest identifying the request
+    """
+    # Resolve aliases and misspellings so "oil" and "oil_painting" share a key
+    style_obj = get_style(style)
+
+    params = {
+        "kind": kind,
+        "prompt": normalize_prompt(prompt),
+        "style": style_obj.name if style_obj else None,
+        "width": width,
+        "height": height,
+        "steps": steps,
+        "guidance": guidance,
+        "seed": seed,
+        "image_hash": image_hash,
+    }
+    for name, value in extra.items():
+        # Only prompt text is normalized; other names, such as checkpoints, are case-sensitive
+        params[name] = normalize_prompt(value) if name == "instructions" else value
+
+    encoded = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    """
+    Collapse concurrent identical requests into one job. The first caller
+    starts the job; callers that arrive while it is still running attach
+    to the same job and share its result.
+    """
+
+    def __init__(self, name="singleflight"):
+        self.name = name
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def join(self, key, start):
+        """
+        Return the running job for key, starting one if there is none
+
+        Args:
+            key (str): Request key from request_key()
+            start (callable): Starts the job and returns it; the job must
+                provide add_done_callback(fn)
+
+        Returns:
+            The job for this key, possibly started by another caller
+        """
+        with self._lock:
+            job = self._in_flight.get(key)
+            leader = job is None
+            if leader:
+                job = start()
+                self._in_flight[key] = job
+
+        metrics.increment(f"{self.name}_requests")
+        if not leader:
+            metrics.increment(f"{self.name}_deduplicated")
+        else:
+            job.add_done_callback(lambda finished: self._forget(key, finished))
+        return job
+
+    def _forget(self, key, job):
+        with self._lock:
+            if self._in_flight.get(key) is job:
+                del self._in_flight[key]
+
+    def in_flight(self):
+        """Return the number of distinct computations currently running"""
+        with self._lock:
+            return len(self._in_flight)
+
+
+# Shared instance used by the generation routes
+SINGLE_FLIGHT = SingleFlight("singleflight")
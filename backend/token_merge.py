@@ -0,0 +1,199 @@
+import math
+import os
+import torch
+
+# Merge similar tokens before UNet self-attention (ToMe for Stable Diffusion;
+# PyTorch backend only)
+TOKEN_MERGING = (os.environ.get("MUSEMIND_TOKEN_MERGING", "0") == "1" and
+                 os.environ.get("MUSEMIND_BACKEND", "torch") == "torch")
+
+# Fraction of tokens merged away per device tier; CPU nodes gain the most
+TOKEN_MERGE_RATIOS = {
+    "cpu": float(os.environ.get("MUSEMIND_TOKEN_MERGE_RATIO_CPU", "0.5")),
+    "cuda": float(os.environ.get("MUSEMIND_TOKEN_MERGE_RATIO_CUDA", "0.3")),
+}
+
+# Number of resolution levels merged, starting at the latent size: 1 merges
+# only in the full-resolution blocks, which hold nearly all attention cost;
+# 2 also merges in the blocks one downsampling below, and so on
+MAX_DOWNSAMPLE = 1
+
+# Each destination token represents one block of this many tokens per side
+STRIDE = 2
+
+
+class TokenMergeState:
+    """Per-UNet settings shared by its merging attention processors"""
+
+    def __init__(self, ratio):
+        self.ratio = ratio
+        self.latent_size = None
+        self.generator = torch.Generator(device="cpu")
+
+
+def bipartite_soft_matching(metric, height, width, ratio, generator):
+    """
+    Plan a token merge: split the tokens into one destination per
+    STRIDE x STRIDE block and the remaining sources, and pair the
+    `ratio * N` sources most similar to a destination with it
+
+    Args:
+        metric (torch.Tensor): (batch, tokens, channels) features compared by cosine similarity
+        height (int): Token grid height
+        width (int): Token grid width
+        ratio (float): Fraction of all tokens to merge away
+        generator (torch.Generator): Picks the destination within each block
+
+    Returns:
+        tuple: (merge, unmerge) functions, or (None, None) if nothing is merged
+    """
+    batch, tokens, _ = metric.shape
+    grid_height, grid_width = height // STRIDE, width // STRIDE
+    num_dst = grid_height * grid_width
+    r = min(int(tokens * ratio), tokens - num_dst)
+    if r <= 0:
+        return None, None
+
+    with torch.no_grad():
+        # Mark one random destination per block, then sort destinations first
+        choice = torch.randint(STRIDE * STRIDE, size=(grid_height, grid_width, 1), generator=generator)
+        block_view = torch.zeros(grid_height, grid_width, STRIDE * STRIDE, dtype=torch.int64)
+        block_view.scatter_(dim=2, index=choice, src=-torch.ones_like(choice))
+        block_view = block_view.view(grid_height, grid_width, STRIDE, STRIDE).transpose(1, 2)
+        block_view = block_view.reshape(grid_height * STRIDE, grid_width * STRIDE)
+        buffer = torch.zeros(height, width, dtype=torch.int64)
+        buffer[:grid_height * STRIDE, :grid_width * STRIDE] = block_view
+        order = buffer.reshape(1, -1, 1).argsort(dim=1).to(metric.device)
+
+        src_order = order[:, num_dst:, :]
+        dst_order = order[:, :num_dst, :]
+
+        def split(x):
+            channels = x.shape[-1]
+            src = torch.gather(x, dim=1, index=src_order.expand(x.shape[0], tokens - num_dst, channels))
+            dst = torch.gather(x, dim=1, index=dst_order.expand(x.shape[0], num_dst, channels))
+            return src, dst
+
+        metric = metric / metric.norm(dim=-1, keepdim=True)
+        src_metric, dst_metric = split(metric)
+        scores = src_metric @ dst_metric.transpose(-1, -2)
+
+        best_score, best_dst = scores.max(dim=-1)
+        ranked = best_score.argsort(dim=-1, descending=True)[..., None]
+        kept_idx = ranked[..., r:, :]
+        merged_idx = ranked[..., :r, :]
+        target_idx = torch.gather(best_dst[..., None], dim=-2, index=merged_idx)
+
+    def merge(x):
+        src, dst = split(x)
+        n, src_tokens, channels = src.shape
+        kept = torch.gather(src, dim=-2, index=kept_idx.expand(n, src_tokens - r, channels))
+        src = torch.gather(src, dim=-2, index=merged_idx.expand(n, r, channels))
+        dst = dst.scatter_reduce(-2, target_idx.expand(n, r, channels), src, reduce="mean")
+        return torch.cat([kept, dst], dim=1)
+
+    def unmerge(x):
+        kept_count = kept_idx.shape[1]
+        kept, dst = x[..., :kept_count, :], x[..., kept_count:, :]
+        n, _, channels = kept.shape
+        src = torch.gather(dst, dim=-2, index=target_idx.expand(n, r, channels))
+
+        out = torch.zeros(n, tokens, channels, device=x.device, dtype=x.dtype)
+        src_positions = src_order.expand(n, src_order.shape[1], 1)
+        out.scatter_(dim=-2, index=dst_order.expand(n, num_dst, channels), src=dst)
+        out.scatter_(dim=-2, index=torch.gather(src_positions, dim=1, index=kept_idx).expand(n, kept_count, channels),
+                     src=kept)
+        out.scatter_(dim=-2, index=torch.gather(src_positions, dim=1, index=merged_idx).expand(n, r, channels),
+                     src=src)
+        return out
+
+    return merge, unmerge
+
+
+class TokenMergingAttnProcessor:
+    """
+    Wraps a self-attention processor: tokens are merged before attention
+    and the output is unmerged back to the full token count afterwards
+    """
+
+    def __init__(self, processor, state):
+        self.processor = processor
+        self.state = state
+
+    def _grid(self, tokens):
+        """Return the token grid size at this block's resolution, or None"""
+        if self.state.latent_size is None:
+            return None
+        height, width = self.state.latent_size
+        for level in range(MAX_DOWNSAMPLE):
+            grid_height, grid_width = math.ceil(height / 2 ** level), math.ceil(width / 2 ** level)
+            if grid_height * grid_width == tokens:
+                return grid_height, grid_width
+        return None
+
+    def __call__(self, attn, hidden_states, *args, **kwargs):
+        # Processors differ in what they accept (SlicedAttnProcessor takes no
+        # temb), so the wrapped one gets exactly the arguments received here
+        encoder_hidden_states = args[0] if args else kwargs.get("encoder_hidden_states")
+        if encoder_hidden_states is None and self.state.ratio > 0 and hidden_states.ndim == 3:
+            grid = self._grid(hidden_states.shape[1])
+            if grid is not None:
+                merge, unmerge = bipartite_soft_matching(hidden_states, grid[0], grid[1], self.state.ratio,
+                                                         self.state.generator)
+                if merge is not None:
+                    return unmerge(self.processor(attn, merge(hidden_states), *args, **kwargs))
+        return self.processor(attn, hidden_states, *args, **kwargs)
+
+
+def _track_latent_size(unet, args):
+    """UNet pre-forward hook: record the latent size and reseed the destination picks"""
+    state = unet._musemind_token_merge
+    sample = args[0]
+    state.latent_size = tuple(sample.shape[-2:])
+    # Destinations vary from step to step but are reproducible for a seed
+    timestep = args[1] if len(args) > 1 else 0
+    state.generator.manual_seed(int(timestep.flatten()[0]) if torch.is_tensor(timestep) else int(timestep))
+
+
+def install_token_merging(unet, ratio):
+    """
+    Install merging processors on every self-attention layer of a UNet.
+    Safe to call again, e.g. after enable_attention_slicing() replaced
+    the processors, or to change the ratio.
+
+    Args:
+        unet (UNet2DConditionModel): UNet to patch
+        ratio (float): Fraction of tokens to merge away (0 disables merging)
+
+    Returns:
+        TokenMergeState: The UNet's merge settings
+    """
+    state = getattr(unet, "_musemind_token_merge", None)
+    if state is None:
+        state = TokenMergeState(ratio)
+        unet._musemind_token_merge = state
+        unet.register_forward_pre_hook(_track_latent_size)
+    state.ratio = ratio
+
+    processors = {}
+    for name, processor in unet.attn_processors.items():
+        if name.endswith("attn1.processor") and not isinstance(processor, TokenMergingAttnProcessor):
+            processor = TokenMergingAttnProcessor(processor, state)
+        processors[name] = processor
+    unet.set_attn_processor(processors)
+    return state
+
+
+def set_token_merge_ratio(unet, ratio):
+    """Change the merge ratio of a UNet with merging installed; returns the previous ratio"""
+    state = getattr(unet, "_musemind_token_merge", None)
+    if state is None:
+        return 0.0
+    previous, state.ratio = state.ratio, ratio
+    return previous
+
+
+def token_merge_ratio(unet):
+    """Return the merge ratio in effect for a UNet (0 when merging is not installed)"""
+    state = getattr(unet, "_musemind_token_merge", None)
+    return state.ratio if state is not None else 0.0
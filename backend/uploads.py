@@ -0,0 +1,332 @@
+import glob
+import hashlib
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+import warnings
+from PIL import Image
+from werkzeug.utils import secure_filename
+from .singleflight import hash_file
+
+# Uploads are stored once per content, as <sha256>.<ext>
+BLOB_NAME = re.compile(r"^([0-9a-f]{64})\.[a-z0-9]+$")
+
+ALIASES_FILE = ".aliases.json"
+
+# Image formats accepted by /upload, with the extension they are stored under
+UPLOAD_FORMATS = {"PNG": "png", "JPEG": "jpg", "GIF": "gif", "WEBP": "webp"}
+
+# Magic bytes of the accepted formats, as (offset, bytes) pairs; anything
+# else is rejected as soon as the first bytes of the upload arrive
+UPLOAD_SIGNATURES = [
+    ("PNG", ((0, b"\x89PNG\r\n\x1a\n"),)),
+    ("JPEG", ((0, b"\xff\xd8\xff"),)),
+    ("GIF", ((0, b"GIF87a"),)),
+    ("GIF", ((0, b"GIF89a"),)),
+    ("WEBP", ((0, b"RIFF"), (8, b"WEBP"))),
+]
+
+# Bytes needed to tell every signature apart
+SIGNATURE_BYTES = 12
+
+# Largest accepted image, in pixels and per side
+MAX_UPLOAD_PIXELS = int(os.environ.get("MUSEMIND_MAX_UPLOAD_PIXELS", str(50 * 1000 * 1000)))
+MAX_UPLOAD_SIDE = int(os.environ.get("MUSEMIND_MAX_UPLOAD_SIDE", "12000"))
+
+# Most frames an animated upload may have (only the first one is styled)
+MAX_UPLOAD_FRAMES = int(os.environ.get("MUSEMIND_MAX_UPLOAD_FRAMES", "100"))
+
+# The header of a recognised format must be readable within this many bytes
+MAX_HEADER_BYTES = 1024 * 1024
+
+
+class UploadRejected(Exception):
+    """Raised for an upload that is not an acceptable image"""
+
+
+def sniff_format(data):
+    """
+    Identify an upload's format from its magic bytes
+
+    Args:
+        data (bytes): The start of the file
+
+    Returns:
+        str: Format name, or None if data is too short to tell yet
+
+    Raises:
+        UploadRejected: If data cannot be the start of an accepted format
+    """
+    data = data[:SIGNATURE_BYTES]
+    partial = False
+    for image_format, signature in UPLOAD_SIGNATURES:
+        parts = [(data[offset:offset + len(magic)], magic) for offset, magic in signature]
+        if all(chunk == magic for chunk, magic in parts):
+            return image_format
+        # Every byte received so far agrees with this signature
+        if all(chunk == magic[:len(chunk)] for chunk, magic in parts):
+            partial = True
+    if partial and len(data) < SIGNATURE_BYTES:
+        return None
+    raise UploadRejected("Unsupported file type. Please upload PNG, JPG, GIF or WEBP files.")
+
+
+def probe_image(data, complete=True):
+    """
+    Read an image's format, size and frame count from its header, without
+    decoding any pixel data, and check them against the upload limits
+
+    Args:
+        data (bytes): The start of the file, or all of it
+        complete (bool): Whether data is the whole file; frame counts are
+            only checked then, as they need to walk every frame header
+
+    Returns:
+        dict: format, width, height and frames, or None if data is too
+        short to contain the header
+
+    Raises:
+        UploadRejected: If the file is not an accepted image or exceeds a limit
+    """
+    if sniff_format(data) is None:
+        if not complete:
+            return None
+        raise UploadRejected("File is not a readable image")
+
+    try:
+        with warnings.catch_warnings():
+            # The pixel limit is checked below with a clearer message
+            warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+            image = Image.open(io.BytesIO(data))
+            image_format = image.format
+            width, height = image.size
+            frames = getattr(image, "n_frames", 1) if complete else 1
+    except Image.DecompressionBombError:
+        raise UploadRejected(f"Image exceeds the limit of {MAX_UPLOAD_PIXELS / 1e6:.1f} megapixels")
+    except Exception:
+        if not complete and len(data) < MAX_HEADER_BYTES:
+            return None
+        raise UploadRejected("File is not a readable image")
+
+    if image_format not in UPLOAD_FORMATS:
+        raise UploadRejected(f"Unsupported image format {image_format}. Please upload PNG, JPG, GIF or WEBP files.")
+    if width < 1 or height < 1 or max(width, height) > MAX_UPLOAD_SIDE:
+        raise UploadRejected(f"Image is {width}x{height}; sides may be at most {MAX_UPLOAD_SIDE} pixels")
+    if width * height > MAX_UPLOAD_PIXELS:
+        raise UploadRejected(f"Image is {width}x{height} ({width * height / 1e6:.1f} megapixels); "
+                             f"the limit is {MAX_UPLOAD_PIXELS / 1e6:.1f} megapixels")
+    if frames > MAX_UPLOAD_FRAMES:
+        raise UploadRejected(f"Image has {frames} frames; the limit is {MAX_UPLOAD_FRAMES}")
+    return {"format": image_format, "width": width, "height": height, "frames": frames}
+
+
+def check_stored_image(path):
+    """
+    Check the header of an image already on disk (uploads from before
+    validation existed), so a bad file fails fast instead of in a worker
+
+    Args:
+        path (str): Path to the image
+
+    Raises:
+        UploadRejected: If the file is not an acceptable image
+    """
+    # Stored blobs passed the checks when they were uploaded
+    if BLOB_NAME.match(os.path.basename(path)):
+        return
+    with open(path, "rb") as f:
+        data = f.read(MAX_HEADER_BYTES)
+    probe_image(data, complete=len(data) < MAX_HEADER_BYTES)
+
+
+class UploadStream(io.BytesIO):
+    """
+    In-memory buffer for an upload that hashes the body and checks the
+    image header while it is being received. A bad header raises
+    UploadRejected from write(), which aborts the rest of the transfer.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.digest = hashlib.sha256()
+        self.format = None
+        self.probe = None
+        self._next_probe = 4096
+
+    def write(self, data):
+        self.digest.update(data)
+        written = super().write(data)
+        # Reject anything that isn't an accepted format from its first bytes
+        if self.format is None:
+            with self.getbuffer() as view:
+                head = view[:SIGNATURE_BYTES].tobytes()
+            self.format = sniff_format(head)
+        # Re-try the header at doubling sizes until it has been read
+        if self.probe is None and self.tell() >= self._next_probe:
+            self._next_probe *= 2
+            self.probe = probe_image(self.getvalue(), complete=False)
+        return written
+
+    def finish(self):
+        """
+        Check the complete file
+
+        Returns:
+            dict: Result of probe_image
+
+        Raises:
+            UploadRejected: If the file is not an acceptable image
+        """
+        self.probe = probe_image(self.getvalue(), complete=True)
+        return self.probe
+
+
+def content_hash(path):
+    """
+    Return the SHA-256 of an upload, read from its name when it is a
+    content-addressed blob and computed otherwise
+
+    Args:
+        path (str): Path to the uploaded file
+
+    Returns:
+        str: Hex digest
+    """
+    match = BLOB_NAME.match(os.path.basename(path))
+    if match:
+        return match.group(1)
+    return hash_file(path)
+
+
+class UploadStore:
+    """
+    Content-addressed upload storage. Each distinct file is stored once,
+    named by its hash; the names clients uploaded it under are kept as
+    aliases that resolve to the stored blob.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self._aliases = None
+        self._lock = threading.Lock()
+
+    def _alias_path(self):
+        return os.path.join(self.folder, ALIASES_FILE)
+
+    def _load_aliases(self):
+        try:
+            with open(self._alias_path()) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_aliases(self):
+        fd, temp_path = tempfile.mkstemp(dir=self.folder, prefix=".aliases-")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self._aliases, f)
+        os.replace(temp_path, self._alias_path())
+
+    def save(self, stream, original_filename, chunk_size=1024 * 1024):
+        """
+        Validate and store an uploaded image. Nothing is written to disk
+        unless the image passes the checks and isn't stored already.
+
+        Args:
+            stream (file): Upload stream; an UploadStream has been hashed
+                and checked while it was received, anything else is read
+                into one first
+            original_filename (str): Name the client sent
+            chunk_size (int): Read size in bytes
+
+        Returns:
+            dict: filename (the blob name), filepath, hash, alias, image
+            details and whether the content was already stored
+
+        Raises:
+            UploadRejected: If the file is not an acceptable image
+        """
+        if not isinstance(stream, UploadStream):
+            buffer = UploadStream()
+            for chunk in iter(lambda: stream.read(chunk_size), b""):
+                buffer.write(chunk)
+            stream = buffer
+        probe = stream.finish()
+        content = stream.digest.hexdigest()
+        alias = secure_filename(original_filename)
+
+        os.makedirs(self.folder, exist_ok=True)
+        # The same bytes may already be stored under another extension
+        existing = glob.glob(os.path.join(self.folder, content + ".*"))
+        if existing:
+            blob_path = existing[0]
+        else:
+            blob_path = os.path.join(self.folder, f"{content}.{UPLOAD_FORMATS[probe['format']]}")
+            fd, temp_path = tempfile.mkstemp(dir=self.folder, prefix=".upload-")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(stream.getbuffer())
+                os.replace(temp_path, blob_path)
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+
+        blob_name = os.path.basename(blob_path)
+        self.add_alias(alias, blob_name)
+        return {
+            "filename": blob_name,
+            "filepath": blob_path,
+            "hash": content,
+            "alias": alias,
+            "image": probe,
+            "deduplicated": bool(existing),
+        }
+
+    def add_alias(self, alias, blob_name):
+        """Point alias at a stored blob (the newest upload under a name wins)"""
+        if not alias or alias == blob_name:
+            return
+        with self._lock:
+            # Other processes may have added aliases since we last looked
+            self._aliases = self._load_aliases()
+            if self._aliases.get(alias) != blob_name:
+                self._aliases[alias] = blob_name
+                self._save_aliases()
+
+    def resolve(self, filename):
+        """
+        Find the stored file for a blob name, alias or legacy upload name
+
+        Args:
+            filename (str): Name from a client request
+
+        Returns:
+            str: Path to the file, or None if it doesn't exist
+        """
+        filename = os.path.basename(filename or "")
+        if not filename or filename.startswith("."):
+            return None
+
+        path = os.path.join(self.folder, filename)
+        if os.path.isfile(path):
+            return path
+
+        with self._lock:
+            if self._aliases is None or filename not in self._aliases:
+                self._aliases = self._load_aliases()
+            blob_name = self._aliases.get(filename)
+        if blob_name:
+            path = os.path.join(self.folder, blob_name)
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def aliases_of(self, blob_name):
+        """Return the aliases that point at a blob"""
+        with self._lock:
+            if self._aliases is None:
+                self._aliases = self._load_aliases()
+            return sorted(alias for alias, target in self._aliases.items() if target == blob_name)
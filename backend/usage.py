@@ -0,0 +1,82 @@
+import resource
+
+# Writing this to /proc/self/clear_refs resets the peak RSS (VmHWM) of the process
+_RESET_PEAK_RSS = b"5"
+
+
+class GenerationResult(list):
+    """
+    The list of encoded images returned by a generation function, plus
+    an info dict of per-request details for the response. It pickles
+    with its info, so it survives the trip back from a worker process.
+    """
+
+    def __init__(self, images=(), info=None):
+        super().__init__(images)
+        self.info = dict(info or {})
+
+
+def result_info(result):
+    """Return the info dict of a generation result ({} for plain lists)"""
+    return getattr(result, "info", {})
+
+
+def read_peak_rss():
+    """
+    Return the peak resident set size of this process
+
+    Returns:
+        int: Peak RSS in bytes
+    """
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # Lifetime peak, reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class PeakMemory:
+    """
+    Measures the peak memory of one request. The process peak is reset
+    when tracking starts, so the reading covers only this request (and
+    anything running beside it in the same process).
+    """
+
+    def __init__(self, device="cpu"):
+        self.device = device
+        self.reset = False
+
+    def start(self):
+        try:
+            with open("/proc/self/clear_refs", "wb") as clear_refs:
+                clear_refs.write(_RESET_PEAK_RSS)
+            self.reset = True
+        except OSError:
+            # Not Linux or not permitted; fall back to the lifetime peak
+            self.reset = False
+
+        if self.device == "cuda":
+            import torch
+            torch.cuda.reset_peak_memory_stats()
+        return self
+
+    def read(self):
+        """
+        Return the peaks seen since start()
+
+        Returns:
+            dict: peak_rss_mb, whether it is per request, and on CUDA
+            peak_vram_mb
+        """
+        info = {
+            "peak_rss_mb": round(read_peak_rss() / 1024 ** 2, 1),
+            "peak_rss_scope": "request" if self.reset else "process",
+        }
+        if self.device == "cuda":
+            import torch
+            info["peak_vram_mb"] = round(torch.cuda.max_memory_allocated() / 1024 ** 2, 1)
+        return info
@@ -0,0 +1,107 @@
+import os
+
+# Directory holding one sub-directory per diffusers checkpoint
+MODEL_ROOT = os.environ.get("MUSEMIND_MODEL_ROOT", "./model")
+
+# Checkpoint used when a request does not name one
+DEFAULT_CHECKPOINT = os.environ.get("MUSEMIND_CHECKPOINT", "stable-diffusion-v1-5")
+
+# Rough working-set estimate for one 512x512 image during a pipeline call
+# (UNet activations, attention buffers and the VAE decode), per precision
+BYTES_PER_512_IMAGE = {
+    "cuda": 1.0 * 1024 ** 3,  # float16 with attention slicing
+    "cpu": 2.0 * 1024 ** 3,   # float32
+}
+
+# Fraction of the currently free memory a single batch is allowed to use
+BATCH_MEMORY_FRACTION = 0.7
+
+# Hard ceiling regardless of how much memory is free
+MAX_BATCH_SIZE = 8
+
+
+def get_available_memory(device="cpu"):
+    """
+    Return the amount of memory currently available for inference
+
+    Args:
+        device (str): "cuda" or "cpu"
+
+    Returns:
+        int: Available memory in bytes
+    """
+    if device == "cuda":
+        import torch
+    if device == "cuda" and torch.cuda.is_available():
+        free_bytes, _ = torch.cuda.mem_get_info()
+        return free_bytes
+
+    # Prefer MemAvailable, which accounts for reclaimable page cache
+    try:
+        with open("/proc/meminfo") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        # Unknown platform - assume enough memory for a single image
+        return BYTES_PER_512_IMAGE["cpu"]
+
+
+def get_total_memory():
+    """
+    Return the total system memory
+
+    Returns:
+        int: Total memory in bytes
+    """
+    try:
+        with open("/proc/meminfo") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemTotal:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    try:
+        return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return get_available_memory("cpu")
+
+
+def list_checkpoints():
+    """
+    List the diffusers checkpoints available under MODEL_ROOT
+
+    Returns:
+        list: Checkpoint directory names
+    """
+    if not os.path.isdir(MODEL_ROOT):
+        return []
+    return sorted(
+        name for name in os.listdir(MODEL_ROOT)
+        if os.path.isfile(os.path.join(MODEL_ROOT, name, "model_index.json"))
+    )
+
+
+def max_batch_size(width, height, device="cpu"):
+    """
+    Compute how many images of the given size fit in one pipeline call
+
+    Args:
+        width (int): Generation width in pixels
+        height (int): Generation height in pixels
+        device (str): "cuda" or "cpu"
+
+    Returns:
+        int: Batch size between 1 and MAX_BATCH_SIZE
+    """
+    per_image = BYTES_PER_512_IMAGE.get(device, BYTES_PER_512_IMAGE["cpu"])
+    per_image = per_image * (width * height) / (512 * 512)
+    budget = get_available_memory(device) * BATCH_MEMORY_FRACTION
+
+    return int(max(1, min(MAX_BATCH_SIZE, budget // per_image)))
@@ -0,0 +1,209 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from io import BytesIO
+import numpy as np
+import torch
+from PIL import Image
+
+# Render near-duplicate prompts as a short img2img pass from the most
+# similar earlier result instead of from pure noise
+WARM_START = os.environ.get("MUSEMIND_WARM_START", "0") == "1"
+
+# Cosine similarity of the prompt embeddings needed to warm-start
+WARM_START_THRESHOLD = float(os.environ.get("MUSEMIND_WARM_START_THRESHOLD", "0.92"))
+
+# img2img strength of a warm-started run; it also runs only this fraction of the steps
+WARM_START_STRENGTH = float(os.environ.get("MUSEMIND_WARM_START_STRENGTH", "0.6"))
+
+# Earlier results and their prompt embeddings, shared by all workers through the filesystem
+WARM_START_DIR = os.environ.get("MUSEMIND_WARM_START_DIR", "./cache/warm_start")
+
+# Results kept per style, size and checkpoint; the oldest are dropped beyond it
+WARM_START_MAX_ENTRIES = int(os.environ.get("MUSEMIND_WARM_START_MAX_ENTRIES", "200"))
+
+
+def prompt_embedding(pipe, prompt, device):
+    """
+    Embed a prompt with the pipeline's own text encoder: the final hidden
+    state at the end-of-text token (CLIP's pooled output), unit length
+
+    Args:
+        pipe: Pipeline whose tokenizer and text encoder to use
+        prompt (str): Prompt without style additions
+        device (str): Device the pipeline runs on
+
+    Returns:
+        numpy.ndarray: float32 vector
+    """
+    tokenizer = pipe.tokenizer
+    token_count = len(tokenizer(prompt, truncation=True, max_length=tokenizer.model_max_length).input_ids)
+    with torch.no_grad():
+        prompt_embeds, _ = pipe.encode_prompt(prompt, device, 1, False)
+    vector = prompt_embeds[0, token_count - 1].float().cpu().numpy()
+    return vector / max(float(np.linalg.norm(vector)), 1e-8)
+
+
+def warm_start_bucket(style_obj, width, height, checkpoint, backend):
+    """
+    Build the key of the results a run may start from: the same style
+    (parameters included), generation size, checkpoint and backend
+
+    Returns:
+        str: Hex digest
+    """
+    params = {
+        "style": style_obj.get_style_info() if style_obj else None,
+        "size": [width, height],
+        "checkpoint": checkpoint,
+        "backend": backend,
+    }
+    return hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:32]
+
+
+def _write_atomic(path, data):
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+
+class WarmStartIndex:
+    """
+    Earlier text-to-image results on disk, one directory per bucket, each
+    a PNG with a JSON sidecar holding its prompt and prompt embedding.
+    The sidecar is written last, so a result is only found once complete.
+    Embeddings are read once per process and kept in memory.
+    """
+
+    def __init__(self, folder=WARM_START_DIR, max_entries=WARM_START_MAX_ENTRIES):
+        self.folder = folder
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._embeddings = {}  # sidecar path -> (prompt, embedding)
+        self._lock = threading.Lock()
+
+    def _sidecars(self, bucket):
+        try:
+            names = os.listdir(os.path.join(self.folder, bucket))
+        except OSError:
+            return []
+        return [os.path.join(self.folder, bucket, name) for name in names if name.endswith(".json")]
+
+    def _load(self, path):
+        with self._lock:
+            entry = self._embeddings.get(path)
+        if entry is None:
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                return None
+            entry = (data["prompt"], np.asarray(data["embedding"], dtype=np.float32))
+            with self._lock:
+                self._embeddings[path] = entry
+        return entry
+
+    def lookup(self, bucket, embedding, threshold=WARM_START_THRESHOLD):
+        """
+        Find the most similar earlier result in a bucket
+
+        Args:
+            bucket (str): Key from warm_start_bucket()
+            embedding (numpy.ndarray): Unit-length prompt embedding
+            threshold (float): Minimum cosine similarity
+
+        Returns:
+            dict: image (PIL.Image), prompt and similarity of the best match,
+            or None when nothing is similar enough
+        """
+        sidecars = self._sidecars(bucket)
+        with self._lock:
+            # Forget entries other workers have trimmed
+            folder, listed = os.path.join(self.folder, bucket), set(sidecars)
+            for path in [path for path in self._embeddings
+                         if os.path.dirname(path) == folder and path not in listed]:
+                del self._embeddings[path]
+
+        best_path, best_prompt, best_similarity = None, None, threshold
+        for path in sidecars:
+            entry = self._load(path)
+            if entry is None or entry[1].shape != embedding.shape:
+                continue
+            similarity = float(np.dot(entry[1], embedding))
+            if similarity >= best_similarity:
+                best_path, best_prompt, best_similarity = path, entry[0], similarity
+
+        image = None
+        if best_path is not None:
+            try:
+                image = Image.open(best_path[:-len(".json")] + ".png").convert("RGB")
+            except OSError:
+                image = None  # Trimmed by another worker in the meantime
+        with self._lock:
+            if image is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return {"image": image, "prompt": best_prompt, "similarity": best_similarity}
+
+    def add(self, bucket, prompt, embedding, image):
+        """
+        Store a result as a future starting point, dropping the oldest
+        entries of its bucket beyond max_entries
+
+        Args:
+            bucket (str): Key from warm_start_bucket()
+            prompt (str): Prompt the result was rendered from
+            embedding (numpy.ndarray): Its prompt embedding
+            image (PIL.Image): Raw pipeline output at the generation size
+        """
+        if self.max_entries <= 0:
+            return
+        folder = os.path.join(self.folder, bucket)
+        os.makedirs(folder, exist_ok=True)
+        name = hashlib.sha256(embedding.tobytes() + image.tobytes()).hexdigest()[:32]
+
+        buffered = BytesIO()
+        image.save(buffered, format="PNG")
+        _write_atomic(os.path.join(folder, name + ".png"), buffered.getvalue())
+        sidecar = json.dumps({"prompt": prompt, "embedding": embedding.tolist()})
+        _write_atomic(os.path.join(folder, name + ".json"), sidecar.encode("utf-8"))
+
+        sidecars = self._sidecars(bucket)
+        if len(sidecars) > self.max_entries:
+            def modified(path):
+                try:
+                    return os.path.getmtime(path)
+                except OSError:
+                    return 0
+            for path in sorted(sidecars, key=modified)[:len(sidecars) - self.max_entries]:
+                for stale in (path, path[:-len(".json")] + ".png"):
+                    try:
+                        os.remove(stale)
+                    except OSError:
+                        pass
+                with self._lock:
+                    self._embeddings.pop(path, None)
+
+    def stats(self):
+        """
+        Return lookup counts for this process
+
+        Returns:
+            dict: hits, misses and the hit rate
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+# Process-wide warm-start index
+WARM_START_INDEX = WarmStartIndex()
@@ -0,0 +1,168 @@
+import json
+import os
+import struct
+import torch
+from accelerate import init_empty_weights
+from diffusers import UNet2DConditionModel, AutoencoderKL
+from transformers import CLIPTextModel
+
+# Pipeline components whose weights are worth sharing between processes
+MMAP_COMPONENTS = {
+    "unet": UNet2DConditionModel,
+    "vae": AutoencoderKL,
+    "text_encoder": CLIPTextModel,
+}
+
+SAFETENSORS_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+
+def mmap_safetensors(path):
+    """
+    Map a safetensors file into memory and return tensors that view it.
+    The mapping is private copy-on-write, so the weights live in the page
+    cache and are shared by every process that maps the same file.
+
+    Args:
+        path (str): Path to a .safetensors file
+
+    Returns:
+        dict: Tensor name to tensor
+    """
+    with open(path, "rb") as f:
+        header_size = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_size))
+    header.pop("__metadata__", None)
+
+    storage = torch.UntypedStorage.from_file(path, shared=False, nbytes=os.path.getsize(path))
+    data = torch.empty(0, dtype=torch.uint8).set_(storage)
+    data_start = 8 + header_size
+
+    tensors = {}
+    for name, info in header.items():
+        dtype = SAFETENSORS_DTYPES[info["dtype"]]
+        begin, end = info["data_offsets"]
+        itemsize = torch.empty((), dtype=dtype).element_size()
+        if (data_start + begin) % itemsize:
+            raise ValueError(f"Tensor {name} in {path} is not aligned for mapping")
+
+        raw = data[data_start + begin:data_start + end]
+        tensors[name] = raw.view(dtype).reshape(info["shape"])
+    return tensors
+
+
+def component_weight_files(component_path, variant=None):
+    """
+    Find the safetensors files of one component, honouring weight variants
+
+    Args:
+        component_path (str): Component directory, e.g. <checkpoint>/unet
+        variant (str): Variant such as "fp16", or None for the default weights
+
+    Returns:
+        list: Paths of the matching files (several for sharded weights)
+    """
+    if not os.path.isdir(component_path):
+        return []
+
+    files = []
+    for filename in sorted(os.listdir(component_path)):
+        if not filename.endswith(".safetensors"):
+            continue
+        is_variant = len(filename.split(".")) > 2
+        if variant is None and not is_variant:
+            files.append(os.path.join(component_path, filename))
+        elif variant is not None and f".{variant}." in filename:
+            files.append(os.path.join(component_path, filename))
+    return files
+
+
+def load_component_mmap(component_class, component_path, torch_dtype, variant=None):
+    """
+    Build a model with memory-mapped weights, skipping the usual
+    deserialize-and-copy into private memory
+
+    Args:
+        component_class (type): Model class, e.g. UNet2DConditionModel
+        component_path (str): Component directory
+        torch_dtype (torch.dtype): Expected floating point dtype
+        variant (str): Weight variant to load
+
+    Returns:
+        torch.nn.Module: The model, or None if the weights can't be mapped
+        as they are (no safetensors, other dtype, or non-matching keys)
+    """
+    files = component_weight_files(component_path, variant)
+    if not files:
+        return None
+
+    state_dict = {}
+    for path in files:
+        state_dict.update(mmap_safetensors(path))
+
+    # Converting dtypes would copy every tensor and defeat the mapping
+    if any(t.is_floating_point() and t.dtype != torch_dtype for t in state_dict.values()):
+        return None
+
+    if hasattr(component_class, "load_config"):
+        config = component_class.load_config(component_path)
+        with init_empty_weights():
+            model = component_class.from_config(config)
+    else:
+        config = component_class.config_class.from_pretrained(component_path)
+        with init_empty_weights():
+            model = component_class(config)
+
+    try:
+        model.load_state_dict(state_dict, strict=True, assign=True)
+    except RuntimeError as e:
+        print(f"Cannot map {component_path} directly: {str(e).splitlines()[0]}")
+        return None
+
+    # Anything still on the meta device was not in the file
+    if any(t.is_meta for t in list(model.parameters()) + list(model.buffers())):
+        return None
+
+    model.eval()
+    model.requires_grad_(False)
+    return model
+
+
+def load_pipeline_mmap(pipeline_class, checkpoint_path, torch_dtype):
+    """
+    Load a pipeline whose large components use memory-mapped weights.
+    Components that can't be mapped are loaded the normal way.
+
+    Args:
+        pipeline_class (type): Diffusers pipeline class
+        checkpoint_path (str): Checkpoint directory
+        torch_dtype (torch.dtype): Pipeline dtype
+
+    Returns:
+        Pipeline object
+    """
+    variant = "fp16" if torch_dtype == torch.float16 else None
+
+    components = {}
+    for name, component_class in MMAP_COMPONENTS.items():
+        model = load_component_mmap(component_class, os.path.join(checkpoint_path, name), torch_dtype, variant)
+        if model is not None:
+            components[name] = model
+
+    print(f"Memory-mapped components: {', '.join(components) or 'none'}")
+    return pipeline_class.from_pretrained(
+        checkpoint_path,
+        torch_dtype=torch_dtype,
+        safety_checker=None,
+        **components,
+    )
@@ -0,0 +1,348 @@
+import os
+import itertools
+import multiprocessing
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import Future
+from .jobs import JobCancelled
+
+# Functions from backend.generate that inference workers are allowed to run
+WORKER_FUNCTIONS = {"generate_images", "apply_style_to_images", "apply_styles_to_image", "run_profiled",
+                    "warmup_pipelines"}
+
+# Number of inference worker processes (0 runs inference in the server process)
+NUM_WORKERS = int(os.environ.get("MUSEMIND_WORKERS", "0"))
+
+# Torch threads per worker (0 splits the available cores evenly)
+THREADS_PER_WORKER = int(os.environ.get("MUSEMIND_THREADS_PER_WORKER", "0"))
+
+# Load pipelines once in a fork server and fork workers from it, so they
+# share the weight pages instead of each loading a private copy
+PRELOAD = os.environ.get("MUSEMIND_PRELOAD", "0") == "1"
+
+
+class WorkerCrashedError(RuntimeError):
+    """Raised for a job whose worker process died while running it"""
+
+
+def plan_cpu_sets(num_workers, threads_per_worker=0):
+    """
+    Split the CPUs this process may run on into one set per worker
+
+    Args:
+        num_workers (int): Number of worker processes
+        threads_per_worker (int): Cores per worker, 0 to split evenly
+
+    Returns:
+        list: One list of CPU ids per worker
+    """
+    if hasattr(os, "sched_getaffinity"):
+        cpus = sorted(os.sched_getaffinity(0))
+    else:
+        cpus = list(range(os.cpu_count() or 1))
+
+    per_worker = threads_per_worker or max(1, len(cpus) // num_workers)
+
+    cpu_sets = []
+    for index in range(num_workers):
+        start = (index * per_worker) % len(cpus)
+        # Contiguous blocks keep each worker on neighbouring cores
+        cpu_sets.append([cpus[(start + offset) % len(cpus)] for offset in range(min(per_worker, len(cpus)))])
+    return cpu_sets
+
+
+def _worker_main(worker_id, cpu_ids, conn, cancel_event):
+    """
+    Entry point of an inference worker process
+
+    Args:
+        worker_id (int): Index of this worker in the pool
+        cpu_ids (list): CPUs the worker is pinned to
+        conn (Connection): Pipe end shared with the dispatcher
+        cancel_event (Event): Set by the dispatcher to stop the current job
+    """
+    num_threads = max(1, len(cpu_ids))
+
+    # Size the thread pools before torch is imported so they pick it up
+    os.environ["OMP_NUM_THREADS"] = str(num_threads)
+    os.environ["MKL_NUM_THREADS"] = str(num_threads)
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpu_ids)
+
+    import torch
+    torch.set_num_threads(num_threads)
+
+    from . import generate
+
+    # Compile every resolution bucket before taking jobs (a no-op for
+    # buckets a preloading fork server has already warmed)
+    if generate.COMPILE_UNET:
+        generate.warmup_pipelines()
+
+    print(f"Worker {worker_id} ready on CPUs {cpu_ids} with {num_threads} threads")
+    conn.send(("ready", None, None))
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+
+        # None is the shutdown signal
+        if message is None:
+            break
+
+        job_id, func_name, args, kwargs, deadline = message
+
+        def should_cancel():
+            return cancel_event.is_set() or (deadline is not None and time.time() > deadline)
+
+        try:
+            result = getattr(generate, func_name)(*args, should_cancel=should_cancel, **kwargs)
+            conn.send((job_id, True, result))
+        except JobCancelled as e:
+            # None marks a cancelled job
+            conn.send((job_id, None, e.reason))
+        except Exception as e:
+            traceback.print_exc()
+            conn.send((job_id, False, f"{type(e).__name__}: {e}"))
+
+
+class _Worker:
+    """Bookkeeping for one worker process on the dispatcher side"""
+
+    def __init__(self, worker_id, cpu_ids, process, conn, cancel_event):
+        self.worker_id = worker_id
+        self.cpu_ids = cpu_ids
+        self.process = process
+        self.conn = conn
+        self.cancel_event = cancel_event
+        self.job = None  # (job_id, future, message) while busy
+        self.jobs_done = 0
+
+
+class WorkerPool:
+    """
+    Pool of inference worker processes, each with its own pipelines and a
+    pinned thread budget. Jobs go to whichever worker is idle; crashed
+    workers are restarted and their in-flight job is failed.
+    """
+
+    def __init__(self, num_workers, threads_per_worker=0, preload=False):
+        self.num_workers = num_workers
+        self.cpu_sets = plan_cpu_sets(num_workers, threads_per_worker)
+        if preload:
+            # The fork server is single-threaded, so forking from it is safe
+            # even though the server process itself is multi-threaded
+            self._ctx = multiprocessing.get_context("forkserver")
+            self._ctx.set_forkserver_preload([f"{__package__}.preload"])
+        else:
+            self._ctx = multiprocessing.get_context("spawn")
+        self._jobs = queue.Queue()
+        self._idle = queue.Queue()
+        self._workers = {}
+        self._lock = threading.Lock()
+        self._job_ids = itertools.count()
+        self._closed = False
+        self.restarts = 0
+
+    def start(self):
+        """Start all worker processes and the dispatcher thread"""
+        for worker_id in range(self.num_workers):
+            self._spawn(worker_id)
+        threading.Thread(target=self._dispatch, name="worker-dispatcher", daemon=True).start()
+        return self
+
+    def _spawn(self, worker_id):
+        cpu_ids = self.cpu_sets[worker_id]
+        parent_conn, child_conn = self._ctx.Pipe()
+        cancel_event = self._ctx.Event()
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(worker_id, cpu_ids, child_conn, cancel_event),
+            name=f"musemind-worker-{worker_id}",
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+
+        worker = _Worker(worker_id, cpu_ids, process, parent_conn, cancel_event)
+        with self._lock:
+            self._workers[worker_id] = worker
+        threading.Thread(target=self._listen, args=(worker,), name=f"worker-listener-{worker_id}", daemon=True).start()
+
+    def _listen(self, worker):
+        """Collect results from one worker and restart it if it dies"""
+        while True:
+            try:
+                job_id, ok, payload = worker.conn.recv()
+            except (EOFError, OSError):
+                break
+
+            if job_id == "ready":
+                self._idle.put(worker)
+                continue
+
+            with self._lock:
+                _, future, _ = worker.job
+                worker.job = None
+                worker.jobs_done += 1
+
+            if ok:
+                future.set_result(payload)
+            elif ok is None:
+                future.set_exception(JobCancelled(payload))
+            else:
+                future.set_exception(RuntimeError(payload))
+            self._idle.put(worker)
+
+        worker.process.join(timeout=5)
+        if self._closed:
+            return
+
+        with self._lock:
+            job = worker.job
+            worker.job = None
+            self.restarts += 1
+
+        print(f"Worker {worker.worker_id} exited with code {worker.process.exitcode}, restarting")
+        if job:
+            job[1].set_exception(WorkerCrashedError(f"Worker {worker.worker_id} crashed while running job {job[0]}"))
+        self._spawn(worker.worker_id)
+
+    def _dispatch(self):
+        """Hand queued jobs to idle workers in submission order"""
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+
+            job_id, future, message = job
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            # Don't start jobs whose timeout passed while they were queued
+            deadline = message[-1]
+            if deadline is not None and time.time() > deadline:
+                future.set_exception(JobCancelled("timeout"))
+                continue
+
+            while True:
+                worker = self._idle.get()
+                # Skip stale entries left behind by workers that have been replaced
+                if self._workers.get(worker.worker_id) is not worker or not worker.process.is_alive():
+                    continue
+
+                with self._lock:
+                    worker.job = job
+                    worker.cancel_event.clear()
+                try:
+                    worker.conn.send(message)
+                    break
+                except (BrokenPipeError, OSError):
+                    # The listener will restart this worker; try the next one
+                    with self._lock:
+                        worker.job = None
+
+    def submit(self, func_name, *args, deadline=None, **kwargs):
+        """
+        Queue a call to a backend.generate function on the next idle worker
+
+        Args:
+            func_name (str): Name of a function in WORKER_FUNCTIONS
+            deadline (float): Wall-clock time after which the job is cancelled
+
+        Returns:
+            Future: Resolves to the function's return value
+        """
+        if func_name not in WORKER_FUNCTIONS:
+            raise ValueError(f"Unknown worker function: {func_name}")
+        if self._closed:
+            raise RuntimeError("Worker pool has been shut down")
+
+        job_id = next(self._job_ids)
+        future = Future()
+        self._jobs.put((job_id, future, (job_id, func_name, args, kwargs, deadline)))
+        return future
+
+    def cancel(self, future):
+        """
+        Cancel a submitted job: drop it if still queued, otherwise tell its
+        worker to stop at the next denoising step
+
+        Args:
+            future (Future): Future returned by submit()
+        """
+        if future.cancel():
+            return
+        with self._lock:
+            for worker in self._workers.values():
+                if worker.job is not None and worker.job[1] is future:
+                    worker.cancel_event.set()
+                    break
+
+    def stats(self):
+        """
+        Return a snapshot of the pool state
+
+        Returns:
+            dict: Per-worker status plus queue depth and restart count
+        """
+        with self._lock:
+            workers = [{
+                "worker_id": worker.worker_id,
+                "pid": worker.process.pid,
+                "alive": worker.process.is_alive(),
+                "busy": worker.job is not None,
+                "cpus": worker.cpu_ids,
+                "jobs_done": worker.jobs_done,
+            } for worker in self._workers.values()]
+
+        return {
+            "num_workers": self.num_workers,
+            "queued_jobs": self._jobs.qsize(),
+            "restarts": self.restarts,
+            "workers": workers,
+        }
+
+    def shutdown(self):
+        """Stop the dispatcher and all worker processes"""
+        self._closed = True
+        self._jobs.put(None)
+        with self._lock:
+            workers = list(self._workers.values())
+        for worker in workers:
+            try:
+                worker.conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for worker in workers:
+            worker.process.join(timeout=10)
+            if worker.process.is_alive():
+                worker.process.terminate()
+
+
+# Global pool, started on first use when MUSEMIND_WORKERS > 0
+WORKER_POOL = None
+_POOL_LOCK = threading.Lock()
+
+
+def get_worker_pool():
+    """
+    Return the global worker pool, starting it on first use
+
+    Returns:
+        WorkerPool: The pool, or None when running in-process
+    """
+    global WORKER_POOL
+
+    if NUM_WORKERS <= 0:
+        return None
+
+    with _POOL_LOCK:
+        if WORKER_POOL is None:
+            print(f"Starting {NUM_WORKERS} inference workers...")
+            WORKER_POOL = WorkerPool(NUM_WORKERS, THREADS_PER_WORKER, PRELOAD).start()
+    return WORKER_POOL
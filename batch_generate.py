@@ -0,0 +1,239 @@
+#Batch runner for catalog jobs: reads a JSONL job file, one record per image,
+#and renders it through the same code as the web app with the model loaded once.
+#
+#Record fields: prompt, style, width/height (or size "512x768"), seed, image
+#(path of an image to restyle), instructions, checkpoint and an optional id.
+#
+#Usage: python batch_generate.py jobs.jsonl --out catalog_output
+#Rerunning the same command after a crash skips everything in the manifest.
+
+import argparse
+import base64
+import json
+import os
+import sys
+import time
+import zlib
+
+MANIFEST_NAME = "manifest.jsonl"
+
+# Same limits as the web app
+MIN_SIZE, MAX_SIZE = 256, 1024
+
+
+# Parse a job file into normalized records
+def load_records(job_file):
+    """
+    Read and validate the records of a JSONL job file
+
+    Args:
+        job_file (str): Path to the job file
+
+    Returns:
+        list: Normalized record dicts in file order
+    """
+    records = []
+    with open(job_file) as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                raw = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"{job_file}:{line_number}: invalid JSON ({e})")
+
+            width, height = raw.get("width", 512), raw.get("height", 512)
+            if raw.get("size"):
+                width, height = (int(value) for value in str(raw["size"]).lower().split("x"))
+
+            record_id = str(raw.get("id", line_number))
+            if not raw.get("prompt") and not raw.get("image"):
+                raise ValueError(f"{job_file}:{line_number}: a record needs a prompt or an image")
+
+            records.append({
+                "id": record_id,
+                "prompt": raw.get("prompt"),
+                "style": raw.get("style"),
+                "width": min(max(int(width), MIN_SIZE), MAX_SIZE),
+                "height": min(max(int(height), MIN_SIZE), MAX_SIZE),
+                # Seedless records get a stable seed, so a resumed run renders the same image
+                "seed": int(raw["seed"]) if raw.get("seed") is not None else zlib.crc32(record_id.encode()) % 2 ** 31,
+                "image": raw.get("image"),
+                "instructions": raw.get("instructions"),
+                "checkpoint": raw.get("checkpoint"),
+            })
+
+    ids = [record["id"] for record in records]
+    if len(set(ids)) != len(ids):
+        raise ValueError(f"{job_file}: record ids must be unique")
+    return records
+
+
+# Group records that can share one batched pipeline call
+def group_records(records, batch_size):
+    """
+    Group compatible records, keeping the order in which groups first appear
+
+    Text-to-image records are compatible when style, size and checkpoint
+    match; restyling records when they also share the source image and
+    instructions. Prompts and seeds may differ within a group.
+
+    Args:
+        records (list): Normalized records
+        batch_size (int): Maximum records per group
+
+    Returns:
+        list: Lists of records, each rendered with one call
+    """
+    groups = {}
+    for record in records:
+        if record["image"]:
+            key = ("img2img", record["image"], record["style"], record["instructions"], record["checkpoint"])
+        else:
+            key = ("text2img", record["style"], record["width"], record["height"], record["checkpoint"])
+        groups.setdefault(key, []).append(record)
+
+    batches = []
+    for group in groups.values():
+        for start in range(0, len(group), batch_size):
+            batches.append(group[start:start + batch_size])
+    return batches
+
+
+# Read the ids that finished in an earlier run
+def load_manifest(out_dir):
+    """
+    Return the manifest entries whose output file still exists
+
+    Args:
+        out_dir (str): Output directory
+
+    Returns:
+        dict: Record id to manifest entry
+    """
+    done = {}
+    manifest_path = os.path.join(out_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return done
+
+    with open(manifest_path) as manifest:
+        for line in manifest:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # A crash can leave a torn last line behind
+                continue
+            if os.path.exists(os.path.join(out_dir, entry["file"])):
+                done[entry["id"]] = entry
+    return done
+
+
+# Render one group and return the encoded images
+def render_batch(batch):
+    """
+    Render a group of compatible records with one generation call
+
+    Args:
+        batch (list): Records from group_records
+
+    Returns:
+        GenerationResult: One encoded image per record, or None on error
+    """
+    from backend.generate import generate_images, apply_style_to_images
+
+    first = batch[0]
+    # A record without a prompt is rendered from its style alone
+    prompts = [record["prompt"] or "" for record in batch]
+    seeds = [record["seed"] for record in batch]
+
+    if first["image"]:
+        return apply_style_to_images(first["image"], first["style"], first["instructions"], prompts[0],
+                                     len(batch), seeds, prompts if any(prompts) else None,
+                                     checkpoint=first["checkpoint"], output_folder=None)
+    return generate_images(prompts[0], first["width"], first["height"], first["style"],
+                           len(batch), seeds, prompts, checkpoint=first["checkpoint"], output_folder=None)
+
+
+# Write one image and append its manifest entry
+def write_output(out_dir, manifest, record, encoded_image, info):
+    """
+    Save a rendered image as <id>.png and record it in the manifest
+
+    Args:
+        out_dir (str): Output directory
+        manifest (file): Open manifest file
+        record (dict): The record the image was rendered for
+        encoded_image (str): Base64 encoded PNG
+        info (dict): Details reported by the generation call
+    """
+    filename = f"{record['id']}.png"
+    path = os.path.join(out_dir, filename)
+
+    # Write under a temporary name so a crash never leaves a truncated image
+    with open(path + ".tmp", "wb") as f:
+        f.write(base64.b64decode(encoded_image))
+    os.replace(path + ".tmp", path)
+
+    entry = dict(record, file=filename, finished_at=time.time(), info=info)
+    manifest.write(json.dumps(entry) + "\n")
+
+
+def format_duration(seconds):
+    """Format seconds as H:MM:SS"""
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render a JSONL job file in batches")
+    parser.add_argument("job_file", help="JSONL file with one record per image")
+    parser.add_argument("--out", default="batch_output", help="Output directory (default: batch_output)")
+    parser.add_argument("--batch-size", type=int, default=8, help="Maximum records per pipeline call (default: 8)")
+    args = parser.parse_args()
+
+    try:
+        records = load_records(args.job_file)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        return 1
+
+    os.makedirs(args.out, exist_ok=True)
+    done = load_manifest(args.out)
+    pending = [record for record in records if record["id"] not in done]
+    batches = group_records(pending, max(1, args.batch_size))
+
+    print(f"{len(records)} records, {len(done)} already done, {len(pending)} to render in {len(batches)} batches")
+
+    rendered = failed = 0
+    start = time.time()
+    with open(os.path.join(args.out, MANIFEST_NAME), "a") as manifest:
+        for batch in batches:
+            results = render_batch(batch)
+
+            if not results:
+                failed += len(batch)
+                print(f"Batch failed: {', '.join(record['id'] for record in batch)}")
+            else:
+                info = getattr(results, "info", {})
+                for record, encoded_image in zip(batch, results):
+                    write_output(args.out, manifest, record, encoded_image, info)
+                rendered += len(batch)
+
+                # Make finished work durable before starting the next batch
+                manifest.flush()
+                os.fsync(manifest.fileno())
+
+            elapsed = time.time() - start
+            remaining = len(pending) - rendered - failed
+            per_minute = rendered / elapsed * 60 if elapsed > 0 else 0.0
+            eta = format_duration(remaining / per_minute * 60) if per_minute else "?"
+            print(f"[{len(done) + rendered}/{len(records)}] {per_minute:.1f} images/min, "
+                  f"{failed} failed, ETA {eta}")
+
+    print(f"Finished: {rendered} rendered, {failed} failed in {format_duration(time.time() - start)}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,70 @@
+# Fixed prompts, seeds and render loop shared by the quality/speed benchmarks,
+# so every optimization is measured on the same images
+
+import os
+import time
+from contextlib import nullcontext
+
+from similarity import ssim, psnr
+
+PROMPTS = [
+    "A peaceful mountain landscape at sunset",
+    "A cozy cottage in a forest clearing",
+    "A steampunk airship floating in the sky",
+    "Portrait of an old fisherman, detailed face",
+]
+
+SEEDS = [1234, 5678]
+
+
+def render(pipe, size, steps, device="cpu", context=None):
+    """
+    Render every prompt/seed pair and return the images and seconds per image
+
+    Args:
+        pipe: Text-to-image pipeline
+        size (int): Width and height in pixels
+        steps (int): Denoising steps
+        device (str): Device the seeded generators are created on
+        context (callable): Optional factory of a context manager entered
+            around each pipeline call
+
+    Returns:
+        tuple: (list of PIL images, seconds per image)
+    """
+    import torch
+
+    images = []
+    start = time.perf_counter()
+    for prompt in PROMPTS:
+        for seed in SEEDS:
+            with context() if context else nullcontext():
+                result = pipe(
+                    prompt=prompt,
+                    width=size,
+                    height=size,
+                    num_inference_steps=steps,
+                    guidance_scale=7.5,
+                    generator=torch.Generator(device=device).manual_seed(seed),
+                )
+            images.append(result.images[0])
+    return images, (time.perf_counter() - start) / len(images)
+
+
+def warm_up(pipe, size):
+    """Render one untimed image so the first measurement doesn't pay for lazy initialization"""
+    pipe(prompt=PROMPTS[0], width=size, height=size, num_inference_steps=2)
+
+
+def compare(baseline, images):
+    """Return the mean SSIM and PSNR (dB) of images against the baseline images"""
+    similarity = sum(ssim(a, b) for a, b in zip(baseline, images)) / len(images)
+    noise = sum(psnr(a, b) for a, b in zip(baseline, images)) / len(images)
+    return similarity, noise
+
+
+def save_images(folder, prefix, images):
+    """Write images to folder as <prefix>_<index>.png"""
+    os.makedirs(folder, exist_ok=True)
+    for index, image in enumerate(images):
+        image.save(os.path.join(folder, f"{prefix}_{index}.png"))
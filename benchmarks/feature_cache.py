@@ -0,0 +1,56 @@
+# Measures what UNet feature caching buys on this node: seconds per image and
+# how close the images stay to full-UNet output for the same prompts and seeds.
+#
+# Usage: python benchmarks/feature_cache.py [--intervals 2 3 5] [--size 512] [--steps 30]
+
+import argparse
+import json
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from common import render, warm_up, compare, save_images
+
+
+def main():
+    parser = argparse.ArgumentParser(description="UNet feature caching speed and similarity benchmark")
+    parser.add_argument("--intervals", type=int, nargs="+", default=[2, 3, 5])
+    parser.add_argument("--size", type=int, default=512)
+    parser.add_argument("--steps", type=int, default=30)
+    parser.add_argument("--checkpoint", default=None)
+    parser.add_argument("--save", metavar="DIR", help="Also write every image to DIR for inspection")
+    args = parser.parse_args()
+
+    import torch
+    from backend.generate import initialize_pipeline
+    from backend.feature_cache import feature_cache
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    pipe = initialize_pipeline("text2img", device, args.checkpoint)
+    warm_up(pipe, args.size)
+
+    baseline, baseline_seconds = render(pipe, args.size, args.steps, device)
+    print(f"{'interval':>8} {'s/image':>8} {'speedup':>8} {'SSIM':>6} {'PSNR':>7}")
+    print(f"{1:>8} {baseline_seconds:>8.2f} {1.0:>7.2f}x {1.0:>6.3f} {'inf':>7}")
+
+    results = [{"interval": 1, "seconds_per_image": round(baseline_seconds, 3)}]
+    for interval in args.intervals:
+        images, seconds = render(pipe, args.size, args.steps, device,
+                                 lambda: feature_cache(pipe.unet, interval))
+        similarity, noise = compare(baseline, images)
+        print(f"{interval:>8} {seconds:>8.2f} {baseline_seconds / seconds:>7.2f}x {similarity:>6.3f} {noise:>6.1f}")
+        results.append({"interval": interval, "seconds_per_image": round(seconds, 3),
+                        "speedup": round(baseline_seconds / seconds, 2),
+                        "ssim": round(similarity, 4), "psnr_db": round(noise, 2)})
+        if args.save:
+            save_images(args.save, f"deepcache_{interval}", images)
+
+    if args.save:
+        save_images(args.save, "deepcache_1", baseline)
+    print(json.dumps({"device": device, "size": args.size, "steps": args.steps, "results": results}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+# Compares the PyTorch and ONNX Runtime backends on this node's CPU: load and
+# export time, seconds per image, and how close ONNX output stays to PyTorch
+# output for the same prompts and seeds.
+#
+# Usage: python benchmarks/onnx_backend.py [--size 512] [--steps 30] [--checkpoint NAME]
+
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from common import render, warm_up, compare, save_images
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PyTorch vs ONNX Runtime backend benchmark (CPU)")
+    parser.add_argument("--size", type=int, default=512)
+    parser.add_argument("--steps", type=int, default=30)
+    parser.add_argument("--checkpoint", default=None)
+    parser.add_argument("--save", metavar="DIR", help="Also write every image to DIR for inspection")
+    args = parser.parse_args()
+
+    from backend.utils import MODEL_ROOT, DEFAULT_CHECKPOINT
+    from backend.inference_backends import TorchBackend, OnnxBackend
+
+    checkpoint = args.checkpoint or DEFAULT_CHECKPOINT
+    checkpoint_path = os.path.join(MODEL_ROOT, checkpoint)
+
+    results = []
+    baseline = None
+    print(f"{'backend':>8} {'load s':>7} {'s/image':>8} {'speedup':>8} {'SSIM':>6} {'PSNR':>7}")
+    for backend in (TorchBackend(), OnnxBackend()):
+        # The first ONNX load includes the export; later runs reuse the cache
+        start = time.perf_counter()
+        pipe = backend.load("text2img", checkpoint, checkpoint_path, "fp32", "cpu")
+        load_seconds = time.perf_counter() - start
+
+        warm_up(pipe, args.size)
+        images, seconds = render(pipe, args.size, args.steps)
+        record = {"backend": backend.name, "load_seconds": round(load_seconds, 1),
+                  "seconds_per_image": round(seconds, 3)}
+
+        if baseline is None:
+            baseline, baseline_seconds = images, seconds
+            print(f"{backend.name:>8} {load_seconds:>7.1f} {seconds:>8.2f} {1.0:>7.2f}x {1.0:>6.3f} {'inf':>7}")
+        else:
+            similarity, noise = compare(baseline, images)
+            print(f"{backend.name:>8} {load_seconds:>7.1f} {seconds:>8.2f} {baseline_seconds / seconds:>7.2f}x "
+                  f"{similarity:>6.3f} {noise:>6.1f}")
+            record.update(speedup=round(baseline_seconds / seconds, 2), ssim=round(similarity, 4),
+                          psnr_db=round(noise, 2))
+        results.append(record)
+
+        if args.save:
+            save_images(args.save, backend.name, images)
+        del pipe
+
+    print(json.dumps({"checkpoint": checkpoint, "size": args.size, "steps": args.steps, "results": results}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+# Image similarity scores shared by the quality/speed benchmarks
+
+import numpy as np
+
+# SSIM constants for 8-bit images
+_C1 = (0.01 * 255) ** 2
+_C2 = (0.03 * 255) ** 2
+
+
+def _box_mean(x, size):
+    """Mean over every size x size window (valid positions only)"""
+    padded = np.pad(x, ((1, 0), (1, 0))).cumsum(axis=0).cumsum(axis=1)
+    total = padded[size:, size:] - padded[:-size, size:] - padded[size:, :-size] + padded[:-size, :-size]
+    return total / (size * size)
+
+
+def ssim(image_a, image_b, window=7):
+    """
+    Structural similarity of two images' luminance, with uniform windows
+
+    Args:
+        image_a (PIL.Image): First image
+        image_b (PIL.Image): Second image, resized to the first if needed
+        window (int): Window size in pixels
+
+    Returns:
+        float: Mean SSIM, 1.0 for identical images
+    """
+    if image_b.size != image_a.size:
+        image_b = image_b.resize(image_a.size)
+    a = np.asarray(image_a.convert("L"), dtype=np.float64)
+    b = np.asarray(image_b.convert("L"), dtype=np.float64)
+
+    mean_a, mean_b = _box_mean(a, window), _box_mean(b, window)
+    var_a = _box_mean(a * a, window) - mean_a ** 2
+    var_b = _box_mean(b * b, window) - mean_b ** 2
+    covariance = _box_mean(a * b, window) - mean_a * mean_b
+
+    score = ((2 * mean_a * mean_b + _C1) * (2 * covariance + _C2)) / \
+            ((mean_a ** 2 + mean_b ** 2 + _C1) * (var_a + var_b + _C2))
+    return float(score.mean())
+
+
+def psnr(image_a, image_b):
+    """Peak signal-to-noise ratio in dB between two RGB images (inf if identical)"""
+    if image_b.size != image_a.size:
+        image_b = image_b.resize(image_a.size)
+    a = np.asarray(image_a.convert("RGB"), dtype=np.float64)
+    b = np.asarray(image_b.convert("RGB"), dtype=np.float64)
+    mse = ((a - b) ** 2).mean()
+    return float("inf") if mse == 0 else float(10 * np.log10(255 ** 2 / mse))
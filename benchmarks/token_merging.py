@@ -0,0 +1,57 @@
+# Measures what token merging buys on this node: seconds per image and how
+# close the images stay to unmerged output for the same prompts and seeds.
+#
+# Usage: python benchmarks/token_merging.py [--ratios 0.3 0.5 0.6] [--size 512] [--steps 30]
+
+import argparse
+import json
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from common import render, warm_up, compare, save_images
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Token merging speed and similarity benchmark")
+    parser.add_argument("--ratios", type=float, nargs="+", default=[0.3, 0.5, 0.6])
+    parser.add_argument("--size", type=int, default=512)
+    parser.add_argument("--steps", type=int, default=30)
+    parser.add_argument("--checkpoint", default=None)
+    parser.add_argument("--save", metavar="DIR", help="Also write every image to DIR for inspection")
+    args = parser.parse_args()
+
+    import torch
+    from backend.generate import initialize_pipeline
+    from backend.token_merge import install_token_merging
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    pipe = initialize_pipeline("text2img", device, args.checkpoint)
+    install_token_merging(pipe.unet, 0.0)
+    warm_up(pipe, args.size)
+
+    baseline, baseline_seconds = render(pipe, args.size, args.steps, device)
+    print(f"{'ratio':>6} {'s/image':>8} {'speedup':>8} {'SSIM':>6} {'PSNR':>7}")
+    print(f"{0.0:>6} {baseline_seconds:>8.2f} {1.0:>7.2f}x {1.0:>6.3f} {'inf':>7}")
+
+    results = [{"ratio": 0.0, "seconds_per_image": round(baseline_seconds, 3)}]
+    for ratio in args.ratios:
+        install_token_merging(pipe.unet, ratio)
+        images, seconds = render(pipe, args.size, args.steps, device)
+        similarity, noise = compare(baseline, images)
+        print(f"{ratio:>6} {seconds:>8.2f} {baseline_seconds / seconds:>7.2f}x {similarity:>6.3f} {noise:>6.1f}")
+        results.append({"ratio": ratio, "seconds_per_image": round(seconds, 3),
+                         "speedup": round(baseline_seconds / seconds, 2),
+                         "ssim": round(similarity, 4), "psnr_db": round(noise, 2)})
+        if args.save:
+            save_images(args.save, f"tome_{ratio}", images)
+
+    if args.save:
+        save_images(args.save, "tome_0.0", baseline)
+    print(json.dumps({"device": device, "size": args.size, "steps": args.steps, "results": results}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# Measures worker memory and cold-start time for each weight loading mode:
+#   copy    - every worker deserializes its own copy of the weights
+#   mmap    - every worker maps the safetensors files (shared page cache)
+#   preload - workers fork from a server that already loaded the pipelines
+#
+# Usage: python benchmarks/worker_memory.py [--workers 1 4 8] [--modes copy mmap preload]
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODE_ENV = {
+    "copy": {"MUSEMIND_MMAP_WEIGHTS": "0", "MUSEMIND_PRELOAD": "0"},
+    "mmap": {"MUSEMIND_MMAP_WEIGHTS": "1", "MUSEMIND_PRELOAD": "0"},
+    "preload": {"MUSEMIND_MMAP_WEIGHTS": "1", "MUSEMIND_PRELOAD": "1"},
+}
+
+
+def read_memory(pid):
+    """
+    Read a process's memory use from /proc
+
+    Args:
+        pid (int): Process id
+
+    Returns:
+        dict: rss, pss and uss (private) in bytes
+    """
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as smaps:
+        for line in smaps:
+            parts = line.split()
+            if len(parts) >= 3 and parts[2] == "kB":
+                values[parts[0].rstrip(":")] = int(parts[1]) * 1024
+    return {
+        "rss": values.get("Rss", 0),
+        "pss": values.get("Pss", 0),
+        "uss": values.get("Private_Clean", 0) + values.get("Private_Dirty", 0),
+    }
+
+
+def run_once(mode, num_workers):
+    """Start a pool in this process, warm every worker and report its memory"""
+    sys.path.insert(0, ROOT)
+    from backend.worker_pool import WorkerPool
+
+    start = time.perf_counter()
+    pool = WorkerPool(num_workers, preload=mode == "preload").start()
+
+    # One warmup per worker; a worker only takes a job once it is ready
+    futures = [pool.submit("warmup_pipelines") for _ in range(num_workers)]
+    for future in futures:
+        future.result()
+    cold_start = time.perf_counter() - start
+
+    workers = [read_memory(worker["pid"]) for worker in pool.stats()["workers"]]
+    pool.shutdown()
+
+    print(json.dumps({
+        "mode": mode,
+        "workers": num_workers,
+        "cold_start_s": round(cold_start, 1),
+        "rss_per_worker_mb": round(sum(w["rss"] for w in workers) / len(workers) / 1024 ** 2),
+        "uss_per_worker_mb": round(sum(w["uss"] for w in workers) / len(workers) / 1024 ** 2),
+        "pss_total_mb": round(sum(w["pss"] for w in workers) / 1024 ** 2),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker memory and cold-start benchmark")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--modes", nargs="+", default=list(MODE_ENV), choices=list(MODE_ENV))
+    parser.add_argument("--run", nargs=2, metavar=("MODE", "WORKERS"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_once(args.run[0], int(args.run[1]))
+        return
+
+    print(f"{'mode':<8} {'workers':>7} {'cold start':>11} {'RSS/worker':>11} {'USS/worker':>11} {'PSS total':>10}")
+    for mode in args.modes:
+        for num_workers in args.workers:
+            # Settings are read at import time, so each run gets a fresh interpreter
+            env = dict(os.environ, **MODE_ENV[mode])
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--run", mode, str(num_workers)],
+                cwd=ROOT, env=env, capture_output=True, text=True,
+            )
+            if output.returncode != 0:
+                print(f"{mode:<8} {num_workers:>7} failed:\n{output.stderr[-2000:]}")
+                continue
+
+            # Worker logs share stdout, the result is the last JSON line
+            result = json.loads([line for line in output.stdout.splitlines() if line.startswith("{")][-1])
+            print(f"{mode:<8} {num_workers:>7} {result['cold_start_s']:>10}s "
+                  f"{result['rss_per_worker_mb']:>8} MB {result['uss_per_worker_mb']:>8} MB "
+                  f"{result['pss_total_mb']:>7} MB")
+
+
+if __name__ == "__main__":
+    main()
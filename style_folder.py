@@ -0,0 +1,38 @@
+#Styles every image in a folder with one style, without going through the web app.
+#Decoding, img2img inference and PNG encoding run as overlapping stages, so the
+#model is never left waiting on disk I/O.
+#
+#Usage: python style_folder.py photos/ styled/ --style watercolor --batch-size 4
+
+import argparse
+import sys
+from backend.bulk_style import style_directory
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply a style to every image in a folder")
+    parser.add_argument("input_dir", help="Folder of images to style")
+    parser.add_argument("output_dir", help="Folder to write the styled PNGs to")
+    parser.add_argument("--style", required=True, help="Style to apply, e.g. ghibli or watercolor")
+    parser.add_argument("--prompt", help="Additional prompt to guide the style transfer")
+    parser.add_argument("--instructions", help="Additional instructions for image processing")
+    parser.add_argument("--seed", type=int, help="Base seed for reproducible output")
+    parser.add_argument("--checkpoint", help="Checkpoint name under the model root")
+    parser.add_argument("--batch-size", type=int, default=4, help="Images per img2img call (default: 4)")
+    parser.add_argument("--decode-workers", type=int, default=2, help="Decode threads (default: 2)")
+    parser.add_argument("--encode-workers", type=int, default=2, help="Encode threads (default: 2)")
+    parser.add_argument("--queue-size", type=int, default=8, help="Images buffered between stages (default: 8)")
+    parser.add_argument("--overwrite", action="store_true", help="Restyle images that already have an output")
+    args = parser.parse_args()
+
+    stats = style_directory(
+        args.input_dir, args.output_dir, args.style, args.instructions, args.prompt, args.seed,
+        checkpoint=args.checkpoint, batch_size=max(1, args.batch_size),
+        decode_workers=max(1, args.decode_workers), encode_workers=max(1, args.encode_workers),
+        queue_size=max(1, args.queue_size), overwrite=args.overwrite,
+    )
+    return 1 if stats["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -12,6 +12,34 @@ from styles.pop_art import PopArtStyle
 from styles.steampunk import SteampunkStyle
 from styles.watercolor import WatercolorStyle
 
+# Dictionary mapping style names to their respective classes
+STYLES = {
+    "ghibli": GhibliStyle,
+    "pixel_art": PixelArtStyle,
+    "realistic": RealisticStyle,
+    "anime": AnimeStyle,
+    "comic_book": ComicBookStyle,
+    "cyberpunk": CyberpunkStyle,
+    "enhance": EnhanceStyle,
+    "fantasy": FantasyStyle,
+    "impressionist": ImpressionistStyle,
+    "oil_painting": OilPaintingStyle,
+    "pop_art": PopArtStyle,
+    "steampunk": SteampunkStyle,
+    "watercolor": WatercolorStyle
+}
+
+# Alternative spellings accepted by get_style
+STYLE_ALIASES = {
+    "pixelart": "pixel_art",
+    "comic": "comic_book",
+    "oil": "oil_painting",
+    "popart": "pop_art",
+}
+
+# Canonical names of every registered style (aliases excluded)
+STYLE_NAMES = tuple(STYLES)
+
 
 def get_style(style_name):
     """
@@ -27,27 +55,7 @@ def get_style(style_name):
         return None
         
     style_name = style_name.lower().strip()
-    
-    # Dictionary mapping style names to their respective classes
-    styles = {
-        "ghibli": GhibliStyle,
-        "pixel_art": PixelArtStyle,
-        "pixelart": PixelArtStyle,  # Alias
-        "realistic": RealisticStyle,
-        "anime": AnimeStyle,
-        "comic_book": ComicBookStyle,
-        "comic": ComicBookStyle,  # Alias
-        "cyberpunk": CyberpunkStyle,
-        "enhance": EnhanceStyle,
-        "fantasy": FantasyStyle,
-        "impressionist": ImpressionistStyle,
-        "oil_painting": OilPaintingStyle,
-        "oil": OilPaintingStyle,  # Alias
-        "pop_art": PopArtStyle,
-        "popart": PopArtStyle,  # Alias
-        "steampunk": SteampunkStyle,
-        "watercolor": WatercolorStyle
-    }
+    style_name = STYLE_ALIASES.get(style_name, style_name)
     
     # Check for common misspellings of "ghibli"
     if ("gib" in style_name or "ghib" in style_name) and "li" in style_name:
@@ -64,4 +72,4 @@ def get_style(style_name):
         return SteampunkStyle()
         
     # Return the style instance if it exists, otherwise None
-    return styles[style_name]() if style_name in styles else None
\ No newline at end of file
+    return STYLES[style_name]() if style_name in STYLES else None
\ No newline at end of file
@@ -56,8 +56,18 @@ class BaseStyle:
             "negative_prompt": self.negative_prompt,
             "inference_steps": self.inference_steps,
             "guidance_scale": self.guidance_scale,
-            "strength": self.img2img_strength
+            "strength": self.img2img_strength,
+            "direct_enhance": False  # Set to True to skip the diffusion model
         }
+    
+    def is_direct(self):
+        """
+        Check whether img2img for this style runs without the diffusion model
+        
+        Returns:
+            bool: True if adjust_for_img2img sets the direct_enhance flag
+        """
+        return bool(self.adjust_for_img2img("This image").get("direct_enhance", False))
         
     def detect_content_type(self, content):
         """